@@ -1,6 +1,18 @@
+import json
+import logging
+import os
 import re
-from typing import Optional, List, Dict
-from langchain_nvidia_ai_endpoints import ChatNVIDIA
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, List, Dict, Tuple
+from llm_clients import get_llm
+import llm_dispatch
+import metrics
+from response_cache import normalize_query
+
+logger = logging.getLogger(__name__)
 
 # Define your available models
 MODEL_CATALOG = {
@@ -23,71 +35,205 @@ def sanitize_query(query: str) -> str:
     return re.sub(r"\bcontext\b", "provided information", query, flags=re.IGNORECASE)
 
 
-def choose_model(query: str) -> str:
+# Names the heuristics and the descriptions below use for models missing from
+# MODEL_CATALOG. There is no 70B ChatQA endpoint configured, so RAG-style
+# questions go to the 8B ChatQA model.
+MODEL_ALIASES = {
+    "nvidia_chatqa_70b": "nvidia_chatqa_8b",
+}
+
+
+def resolve_model(name: str) -> Optional[str]:
+    """Model id for a MODEL_CATALOG name or alias, or None if unknown."""
+    return MODEL_CATALOG.get(MODEL_ALIASES.get(name, name))
+
+
+# Smaller or sibling models that can stand in for a catalog model when it is
+# slow or failing: hedged requests and fallbacks go to these.
+MODEL_FALLBACKS = {
+    "meta_llama_405b": ["nvidia_chatqa_8b", "chatglm3_6b"],
+    "nvidia_chatqa_8b": ["chatglm3_6b"],
+    "chatglm3_6b": ["nvidia_chatqa_8b"],
+    "bielik_11b_26": ["bielik_11b_23"],
+    "bielik_11b_23": ["bielik_11b_26"],
+    "breeze_7b": ["chatglm3_6b"],
+}
+
+
+def fallback_models(model_id: str) -> List[str]:
+    """Model ids that may answer in place of `model_id`, best first."""
+    name = next((name for name, path in MODEL_CATALOG.items() if path == model_id), None)
+    return [MODEL_CATALOG[fallback] for fallback in MODEL_FALLBACKS.get(name, [])]
+
+
+# Intent keywords per catalog model, matched as whole words or phrases.
+INTENT_KEYWORDS = {
+    "nvidia_chatqa_70b": ["qa", "retrieval", "question answer", "document", "rag"],
+    "meta_llama_405b": ["math", "reasoning", "logic", "code", "analysis"],
+    "chatglm3_6b": ["chat", "assistant", "conversation", "talk", "discuss"],
+}
+_INTENT_PATTERNS = {
+    name: re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")\b")
+    for name, keywords in INTENT_KEYWORDS.items()
+}
+
+
+def classify_model(query: str) -> Tuple[str, float]:
     """
-    Agentic model selection heuristics.
-    Can be extended to more advanced intent detection.
+    Local, instant model choice with a confidence in [0, 1].
+
+    Language hints are near-certain. One matching intent is fairly certain and
+    more so with more matching keywords; several competing intents are not.
+    With no hints at all the default RAG model is a reasonable guess.
     """
     q = query.lower()
 
     # Language hints
     if any(ch in q for ch in "ąćęłńóśźż"):
-        return MODEL_CATALOG["bielik_11b_26"]
+        return MODEL_CATALOG["bielik_11b_26"], 0.95
     if any('\u4e00' <= c <= '\u9fff' for c in q):
-        return MODEL_CATALOG["breeze_7b"]
+        return MODEL_CATALOG["breeze_7b"], 0.95
 
     # Intent routing
-    if any(k in q for k in ["qa", "retrieval", "question answer", "document", "rag"]):
-        return MODEL_CATALOG["nvidia_chatqa_70b"]
-
-    if any(k in q for k in ["math", "reasoning", "logic", "code", "analysis"]):
-        return MODEL_CATALOG["meta_llama_405b"]
-
-    if any(k in q for k in ["chat", "assistant", "conversation", "talk", "discuss"]):
-        return MODEL_CATALOG["chatglm3_6b"]
+    hits = {name: len(pattern.findall(q)) for name, pattern in _INTENT_PATTERNS.items()}
+    matched = {name: count for name, count in hits.items() if count}
+    if len(matched) == 1:
+        name, count = matched.popitem()
+        return resolve_model(name), min(0.9, 0.6 + 0.1 * (count - 1))
+    if matched:
+        # Competing intents: best guess, but not one to rely on.
+        name = max(matched, key=matched.get)
+        return resolve_model(name), 0.35
 
     # Default fallback
-    return MODEL_CATALOG["nvidia_chatqa_8b"]
+    return MODEL_CATALOG["nvidia_chatqa_8b"], 0.55
 
 
-def choose_model_with_agent(query: str) -> str:
+def choose_model(query: str) -> str:
     """
-    Uses a meta-agent to choose the best model for a given query.
+    Agentic model selection heuristics.
+    Can be extended to more advanced intent detection.
     """
-    model_options = "\n".join([f"- {name}: {path}" for name, path in MODEL_CATALOG.items()])
-    
-    prompt = f"""
+    return classify_model(query)[0]
+
+
+@lru_cache(maxsize=1)
+def _router_catalog() -> str:
+    # One short line per catalog model rather than the whole descriptions JSON.
+    details = {m["id"]: m for m in json.loads(descriptions)["models"]}
+    lines = []
+    for name, path in MODEL_CATALOG.items():
+        info = details.get(name, {})
+        summary = info.get("description", "").split(". ")[0]
+        lines.append(f"- {name} ({path}, {info.get('language', 'Multilingual')}): {summary}")
+    return "\n".join(lines)
+
+
+def _router_prompt(query: str) -> str:
+    return f"""
 You are an expert AI model router. Your task is to choose the best model to answer the following user query.
 Here are the available models:
-{model_options}
-
-{descriptions}
+{_router_catalog()}
 
 Based on the user's query, which model would be the most appropriate?
 User Query: "{query}"
 
 Return only the name of the best model (e.g., "nvidia_chatqa_8b").
 """
-    
+
+
+def _routed_model(response) -> Optional[str]:
+    chosen_model_name = getattr(response, "content", str(response)).strip()
+    logger.debug("Meta-agent chose model: %s", chosen_model_name)
+    return resolve_model(chosen_model_name)
+
+
+async def ask_meta_agent(query: str) -> Optional[str]:
+    """
+    The meta-agent's choice for `query`: a model id, or None if it named an
+    unknown model. Errors from the LLM call propagate.
+    """
+    # Use a powerful model for the meta-agent
+    meta_agent = get_llm(MODEL_CATALOG["meta_llama_405b"])
+    return _routed_model(await meta_agent.ainvoke(_router_prompt(query)))
+
+
+def choose_model_with_agent(query: str) -> str:
+    """
+    Uses a meta-agent to choose the best model for a given query.
+    """
     try:
-        # Use a powerful model for the meta-agent
-        meta_agent = ChatNVIDIA(model=MODEL_CATALOG["meta_llama_405b"])
-        response = meta_agent.invoke(prompt)
-        chosen_model_name = getattr(response, "content", str(response)).strip()
-        print(f"Meta-agent chose model: {chosen_model_name}")
-        # Validate the chosen model
-        if chosen_model_name in MODEL_CATALOG:
-            return MODEL_CATALOG[chosen_model_name]
-        else:
-            # Fallback to default if the model name is not valid
-            return MODEL_CATALOG["nvidia_chatqa_8b"]
-            
+        meta_agent = get_llm(MODEL_CATALOG["meta_llama_405b"])
+        # Fallback to default if the model name is not valid
+        return _routed_model(meta_agent.invoke(_router_prompt(query))) or MODEL_CATALOG["nvidia_chatqa_8b"]
     except Exception as e:
-        print(f"Meta-agent call failed: {e}")
+        logger.warning("Meta-agent call failed: %s", e)
         # Fallback to default model in case of an error
         return MODEL_CATALOG["nvidia_chatqa_8b"]
 
 
+async def achoose_model_with_agent(query: str) -> str:
+    """
+    Async variant of choose_model_with_agent for request handlers.
+    """
+    try:
+        return await ask_meta_agent(query) or MODEL_CATALOG["nvidia_chatqa_8b"]
+    except Exception as e:
+        logger.warning("Meta-agent call failed: %s", e)
+        return MODEL_CATALOG["nvidia_chatqa_8b"]
+
+
+# Tiered routing for agent mode: memoized decisions, then the local
+# classifier, and only for low-confidence queries the meta-agent.
+ROUTER_CACHE_SIZE = int(os.getenv("ROUTER_CACHE_SIZE", "10000"))
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.5"))
+
+_route_memo: "OrderedDict[str, str]" = OrderedDict()
+_route_memo_lock = threading.Lock()
+ROUTER_LATENCY = metrics.histogram("router_latency_seconds")
+ROUTER_TIER_HITS = metrics.counter("router_tier_hits")
+
+
+async def route_model(query: str) -> str:
+    """
+    Pick the model for `query` in agent mode.
+
+    Repeated queries are answered from the memo; the keyword classifier
+    handles the rest unless its confidence is below
+    ROUTER_CONFIDENCE_THRESHOLD, in which case the meta-agent decides. If the
+    meta-agent fails, the classifier's guess is used and not memoized.
+    """
+    started = time.perf_counter()
+    key = normalize_query(query)
+    with _route_memo_lock:
+        model_id = _route_memo.get(key)
+        if model_id is not None:
+            _route_memo.move_to_end(key)
+
+    tier = "memo"
+    if model_id is None:
+        model_id, confidence = classify_model(query)
+        tier = "classifier"
+        remember = True
+        if confidence < ROUTER_CONFIDENCE_THRESHOLD:
+            try:
+                model_id = await ask_meta_agent(query) or model_id
+                tier = "meta_agent"
+            except Exception as e:
+                logger.warning("Meta-agent call failed: %s", e)
+                tier = "meta_agent_failed"
+                remember = False
+        if remember:
+            with _route_memo_lock:
+                _route_memo[key] = model_id
+                while len(_route_memo) > ROUTER_CACHE_SIZE:
+                    _route_memo.popitem(last=False)
+
+    ROUTER_TIER_HITS.inc(tier)
+    ROUTER_LATENCY.observe(time.perf_counter() - started)
+    return model_id
+
+
 async def agent_respond(
     user_query: str,
     retrieved_docs: Optional[List[str]] = None,
@@ -106,7 +252,7 @@ async def agent_respond(
     safe_query = sanitize_query(user_query)
 
     # Step 2: pick model
-    model_id = choose_model_with_agent(safe_query) if agent_mode else (model or MODEL_CATALOG["nvidia_chatqa_70b"])
+    model_id = await route_model(safe_query) if agent_mode else (model or resolve_model("nvidia_chatqa_70b"))
 
     # Step 3: build context
     context_text = ""
@@ -124,11 +270,9 @@ Provided information:
 Question: {safe_query}
 """
 
-    # Step 5: call the LLM
+    # Step 5: call the LLM, falling back to an equivalent model if it is slow or failing
     try:
-        llm = ChatNVIDIA(model=model_id)
-        response = llm.invoke(prompt)
-        answer = getattr(response, "content", str(response))
+        model_id, answer = await llm_dispatch.ainvoke(model_id, prompt, fallback_models(model_id))
     except Exception as e:
         answer = f"LLM call failed: {e}"
 
@@ -0,0 +1,195 @@
+"""
+Password hashing, login throttling and session tokens.
+
+bcrypt is deliberately slow (~100-400 ms of CPU per hash), so it runs on its
+own pool of PASSWORD_HASH_WORKERS threads rather than the threadpool every
+other blocking call shares; a login burst then queues behind itself instead of
+starving retrieval and the LLM clients. At most PASSWORD_HASH_QUEUE hashes may
+be waiting or running; beyond that `HashQueueFull` is raised and the caller
+should answer 503 with Retry-After.
+
+Login attempts are counted per client IP, and failed ones per username, in
+sliding windows of LOGIN_WINDOW seconds. Once a limit is reached further
+attempts are refused before any bcrypt work is done.
+
+A successful login returns a short-lived signed session token (HS256 JWT).
+A still-valid token can be exchanged for a fresh one without verifying the
+password again; logging in always verifies it.
+"""
+import asyncio
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from jose import JWTError, jwt
+from passlib.context import CryptContext
+
+import metrics
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "16"))
+LOGIN_WINDOW = float(os.getenv("LOGIN_WINDOW", "60"))
+LOGIN_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_ATTEMPTS_PER_IP", "30"))
+LOGIN_FAILURES_PER_USERNAME = int(os.getenv("LOGIN_FAILURES_PER_USERNAME", "5"))
+# Without SESSION_SECRET every process signs with its own random key, so tokens
+# don't survive a restart or work across workers.
+SESSION_SECRET = os.getenv("SESSION_SECRET") or secrets.token_urlsafe(32)
+SESSION_TTL = int(os.getenv("SESSION_TTL", "900"))
+SESSION_ALGORITHM = "HS256"
+# Keys tracked per limiter; the least recently seen are forgotten first.
+THROTTLE_MAX_KEYS = 100_000
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+PASSWORD_HASH_LATENCY = metrics.histogram("password_hash_seconds")
+# "queue_full", "ip" or "username": why a login or registration was refused.
+AUTH_REJECTED = metrics.counter("auth_rejected")
+
+
+class HashQueueFull(Exception):
+    pass
+
+
+class Throttled(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Too many attempts; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class SlidingWindowLimiter:
+    """At most `limit` events per key in any `window` seconds."""
+
+    def __init__(self, limit: int, window: float, max_keys: int = THROTTLE_MAX_KEYS):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._events: "OrderedDict[str, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recent(self, key: str, now: float) -> deque:
+        events = self._events.get(key)
+        if events is None:
+            events = self._events[key] = deque()
+            while len(self._events) > self.max_keys:
+                self._events.popitem(last=False)
+        else:
+            self._events.move_to_end(key)
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        return events
+
+    def retry_after(self, key: str) -> float:
+        """Seconds until `key` may try again; 0 if it may now."""
+        now = time.monotonic()
+        with self._lock:
+            events = self._recent(key, now)
+            if len(events) < self.limit:
+                return 0.0
+            return events[len(events) - self.limit] + self.window - now
+
+    def hit(self, key: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._recent(key, now).append(now)
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._events.pop(key, None)
+
+
+ip_attempts = SlidingWindowLimiter(LOGIN_ATTEMPTS_PER_IP, LOGIN_WINDOW)
+username_failures = SlidingWindowLimiter(LOGIN_FAILURES_PER_USERNAME, LOGIN_WINDOW)
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+_queued = 0
+_queued_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+        return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def hash_queue_depth() -> int:
+    return _queued
+
+
+async def _run_bounded(fn, *args):
+    global _queued
+    with _queued_lock:
+        if _queued >= PASSWORD_HASH_QUEUE:
+            AUTH_REJECTED.inc("queue_full")
+            raise HashQueueFull()
+        _queued += 1
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), fn, *args)
+    finally:
+        with _queued_lock:
+            _queued -= 1
+        PASSWORD_HASH_LATENCY.observe(time.perf_counter() - started)
+
+
+async def hash_password(password: str) -> str:
+    return await _run_bounded(pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await _run_bounded(pwd_context.verify, password, hashed_password)
+
+
+def check_throttle(ip: Optional[str], username: Optional[str] = None) -> None:
+    """Count an attempt from `ip` and raise `Throttled` if it or `username` is over its limit."""
+    if ip:
+        wait = ip_attempts.retry_after(ip)
+        if wait > 0:
+            AUTH_REJECTED.inc("ip")
+            raise Throttled(wait)
+        ip_attempts.hit(ip)
+    if username:
+        wait = username_failures.retry_after(username)
+        if wait > 0:
+            AUTH_REJECTED.inc("username")
+            raise Throttled(wait)
+
+
+def record_login(username: str, success: bool) -> None:
+    if success:
+        username_failures.reset(username)
+    else:
+        username_failures.hit(username)
+
+
+def create_session_token(user_id: int, username: str) -> Dict[str, Any]:
+    expires = int(time.time()) + SESSION_TTL
+    token = jwt.encode({"sub": username, "uid": user_id, "exp": expires}, SESSION_SECRET, algorithm=SESSION_ALGORITHM)
+    return {"access_token": token, "token_type": "bearer", "expires_in": SESSION_TTL}
+
+
+def read_session_token(token: str) -> Optional[Dict[str, Any]]:
+    """The token's claims if it is ours and unexpired, else None."""
+    try:
+        return jwt.decode(token, SESSION_SECRET, algorithms=[SESSION_ALGORITHM])
+    except JWTError:
+        return None
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    scheme, _, token = (authorization or "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" and token.strip() else None
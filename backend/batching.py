@@ -0,0 +1,81 @@
+"""
+Micro-batching of concurrent async calls.
+
+A MicroBatcher collects the items submitted by concurrent requests for up to
+`window` seconds after the first one arrives, or until `max_size` items are
+waiting, and hands them to its handler as one list. The handler returns one
+result per item, in order; a result that is an exception is raised in that
+item's caller only.
+
+Each batcher records its batch sizes in `<name>_batch_size` and the time items
+spent waiting for their batch in `<name>_batch_wait_seconds`.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, List, Set, Tuple
+
+import metrics
+
+
+class MicroBatcher:
+    def __init__(self, name: str, handler: Callable[[List[Any]], Awaitable[List[Any]]], window: float, max_size: int):
+        self.name = name
+        self.window = window
+        self.max_size = max(1, max_size)
+        self._handler = handler
+        # (item, future, time queued), in arrival order
+        self._pending: List[Tuple[Any, asyncio.Future, float]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        # Running batches, referenced so they aren't garbage collected mid-flight.
+        self._running: Set[asyncio.Task] = set()
+        self.sizes = metrics.histogram(f"{name}_batch_size", metrics.BATCH_BUCKETS)
+        self.waits = metrics.histogram(f"{name}_batch_wait_seconds")
+
+    async def submit(self, item: Any) -> Any:
+        """Queue `item` for the next batch and return its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        # Callers that gave up (the request was cancelled) don't need a result.
+        batch = [entry for entry in batch if not entry[1].done()]
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future, float]]) -> None:
+        started = time.perf_counter()
+        self.sizes.observe(len(batch))
+        for _, _, queued in batch:
+            self.waits.observe(started - queued)
+        try:
+            results = await self._handler([item for item, _, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        except BaseException as e:
+            # Cancelled, e.g. at shutdown: fail the callers instead of leaving them waiting.
+            self._resolve(batch, [e] * len(batch))
+            raise
+        self._resolve(batch, results)
+
+    @staticmethod
+    def _resolve(batch: List[Tuple[Any, asyncio.Future, float]], results: List[Any]) -> None:
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            # BaseException, not Exception: a slot may hold a CancelledError.
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,100 @@
+"""
+Retrieval micro-batching: embedding and search calls vs. added queueing latency.
+
+Queries arrive open-loop (Poisson, `--rate` per second) spread over `--chats`
+chats, and each goes through retrieval.aembed_query and retrieval.aretrieve
+against the stub embedder and stub collection, which sleep like a remote
+round-trip per call. Every batching window in `--windows` is run once; 0 sends
+one embedding and one search call per query, as before batching.
+
+Reported per window: end-to-end latency p50/p95, embedding and store calls
+made, mean batch size and mean time a query waited for its batch. The vector
+searches are run without the keyword index (HYBRID_SEARCH off) so "store
+calls" counts only searches.
+
+Usage (from the backend directory):
+    python bench/bench_batching.py [--rate 400] [--queries 2000] [--chats 4] [--windows 0,1,2,5]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chroma_connection  # noqa: E402
+import retrieval  # noqa: E402
+from bench.fixtures import WORDS  # noqa: E402
+from bench.stubs import StubCollection, StubEmbedder  # noqa: E402
+from metrics import percentile  # noqa: E402
+
+
+def set_window(ms):
+    retrieval.RETRIEVAL_BATCH_WINDOW_MS = ms
+    retrieval._embed_batcher.window = retrieval._search_batcher.window = ms / 1000
+
+
+async def run(collection, args, seed):
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(64))
+    rng = random.Random(seed)
+    latencies = []
+
+    async def one(i):
+        chat = f"chat-{i % args.chats}"
+        query = " ".join(rng.choice(WORDS) for _ in range(6)) + f" {i}"
+        started = time.perf_counter()
+        embedding = await retrieval.aembed_query(query)
+        await retrieval.aretrieve(collection, query, 1, chat, embedding)
+        latencies.append(time.perf_counter() - started)
+
+    tasks = []
+    for i in range(args.queries):
+        tasks.append(asyncio.ensure_future(one(i)))
+        await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*tasks)
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=400, help="queries per second")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=4)
+    parser.add_argument("--windows", default="0,1,2,5", help="batching windows in ms")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per stub embedding or store call")
+    args = parser.parse_args()
+
+    embedder = StubEmbedder(latency=args.latency)
+    collection = StubCollection(embedder, latency=args.latency)
+    for chat in range(args.chats):
+        collection.add(
+            ids=[f"chat-{chat}-{i}" for i in range(50)],
+            documents=[f"passage {i}" for i in range(50)],
+            metadatas=[{"user_id": "1", "chat_id": f"chat-{chat}", "chunk_number": i} for i in range(50)],
+            embeddings=[embedder.vector(f"{chat}-{i}") for i in range(50)],
+        )
+    chroma_connection._query_embedding_function = embedder
+    retrieval.HYBRID_SEARCH = False
+
+    print(f"{args.queries} queries at {args.rate:.0f}/s over {args.chats} chats, {args.latency * 1000:.0f} ms per call")
+    print(f"{'window ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'embeds':>8}{'stores':>8}{'batch':>7}{'wait ms':>9}")
+    for ms in (float(w) for w in args.windows.split(",")):
+        set_window(ms)
+        embeds, stores = embedder.calls, collection.calls
+        sizes, waits = retrieval._embed_batcher.sizes, retrieval._embed_batcher.waits
+        count, total, wait_count, wait_sum = sizes.count, sizes.sum, waits.count, waits.sum
+        latencies = asyncio.run(run(collection, args, seed=0))
+        batches = sizes.count - count
+        mean_batch = (sizes.sum - total) / batches if batches else 1.0
+        mean_wait = (waits.sum - wait_sum) / (waits.count - wait_count) if waits.count > wait_count else 0.0
+        print(
+            f"{ms:>10g}{percentile(latencies, 0.50) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}"
+            f"{embedder.calls - embeds:>8}{collection.calls - stores:>8}{mean_batch:>7.1f}{mean_wait * 1000:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Chunking strategies: chunks/sec and retrieval hit rate on a fixture corpus.
+
+Each fixture document is a run of pages of filler paragraphs with "facts"
+planted at random positions ("The <attribute> of <entity> is <value>.").
+Every strategy chunks the same corpus; chunks and questions ("What is the
+<attribute> of <entity>?") are embedded with a bag-of-words stub, and a
+question is a hit when one of the top-k chunks contains its whole fact. A
+fact cut in two by a chunk boundary can't be a hit, which is what the
+sentence- and page-aware strategies avoid. "fixed/0" is the old chunker:
+fixed 400-token windows without overlap.
+
+Usage (from the backend directory):
+    python bench/bench_chunking.py [--docs 20] [--pages 10] [--facts 30] [--k 1]
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fixtures import paragraph  # noqa: E402
+from chunking import chunk_document, get_encoding  # noqa: E402
+
+DIM = 256
+STOP_WORDS = {"the", "of", "is", "what"}
+
+
+def word_vector(word, cache={}):
+    if word not in cache:
+        seed = int.from_bytes(hashlib.sha256(word.encode()).digest()[:8], "little")
+        cache[word] = np.random.default_rng(seed).standard_normal(DIM)
+    return cache[word]
+
+
+def embed(text):
+    # Each distinct word once, so the few filler words repeated all over a
+    # chunk don't drown out the rare ones a question is about.
+    vector = np.zeros(DIM)
+    for word in set(text.lower().replace(".", " ").replace("?", " ").split()) - STOP_WORDS:
+        vector += word_vector(word)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def rare_word(rng):
+    return "".join(rng.choice("bcdfghjklmnpqrstvwxz") + rng.choice("aeiou") for _ in range(3))
+
+
+def build_corpus(rng, docs, pages, facts_per_doc):
+    corpus, facts = [], []
+    for d in range(docs):
+        # Paragraphs as lists of words, so a planted fact is never cut by a later one.
+        page_texts = [[paragraph(rng, rng.randint(40, 120)).split(" ") for _ in range(rng.randint(3, 6))] for _ in range(pages)]
+        for _ in range(facts_per_doc):
+            attribute, entity, value = rare_word(rng), rare_word(rng), rare_word(rng)
+            sentence = f"The {attribute} of {entity} is {value}."
+            words = rng.choice(rng.choice(page_texts))
+            # Planted mid-paragraph, after a sentence boundary.
+            cut = rng.randrange(1, len(words))
+            words[cut - 1] = words[cut - 1].rstrip(".") + "."
+            words.insert(cut, sentence)
+            facts.append((d, sentence, f"What is the {attribute} of {entity}?"))
+        corpus.append([(i, "\n\n".join(" ".join(words) for words in paras) + "\n\n") for i, paras in enumerate(page_texts)])
+    return corpus, facts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--facts", type=int, default=30, help="facts planted per document")
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=400)
+    parser.add_argument("--overlap", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    corpus, facts = build_corpus(rng, args.docs, args.pages, args.facts)
+    get_encoding()  # load the encoder outside the timings
+    questions = np.array([embed(q) for _, _, q in facts])
+
+    variants = [("fixed", 0), ("fixed", args.overlap), ("sentence", args.overlap), ("page", args.overlap)]
+    print(f"{'strategy':<14}{'chunks':>8}{'chunks/s':>10}{'avg tok':>9}{'split':>7}{'hit@' + str(args.k):>8}")
+    for strategy, overlap in variants:
+        start = time.perf_counter()
+        chunks = [
+            (d, chunk)
+            for d, pages in enumerate(corpus)
+            for chunk in chunk_document(iter(pages), strategy, chunk_size=args.chunk_size, overlap=overlap)
+        ]
+        elapsed = time.perf_counter() - start
+
+        index = np.array([embed(chunk.text) for _, chunk in chunks])
+        split = sum(1 for d, sentence, _ in facts if not any(cd == d and sentence in c.text for cd, c in chunks))
+        hits = 0
+        for (d, sentence, _), question in zip(facts, questions):
+            top = np.argsort(-(index @ question))[:args.k]
+            hits += any(sentence in chunks[i][1].text for i in top)
+        avg_tokens = sum(c.tokens for _, c in chunks) / len(chunks)
+        print(
+            f"{strategy + '/' + str(overlap):<14}{len(chunks):>8}{len(chunks) / elapsed:>10.0f}"
+            f"{avg_tokens:>9.0f}{split:>7}{hits / len(facts):>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
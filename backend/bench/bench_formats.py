@@ -0,0 +1,145 @@
+"""
+Upload formats: extraction time, the parse cache, and rejected binaries.
+
+Writes the same `--paragraphs` of synthetic text as PDF, DOCX, HTML,
+Markdown, CSV and plain text, and parses each one twice through
+parsing.parse_document with its file hash: the first pass extracts and fills
+the parse cache, the second (a re-upload) reads the cache. Reported per
+format: sniffed type, extracted characters, chunks, and both extraction
+times (chunking is not included).
+
+The last row is a random binary file: it is rejected up front, where it used
+to be base64-encoded and ingested; "chunks" shows how many junk chunks that
+would have embedded and stored.
+
+Usage (from the backend directory):
+    python bench/bench_formats.py [--paragraphs 2000]
+"""
+import argparse
+import base64
+import hashlib
+import html
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parse_cache  # noqa: E402
+import parsing  # noqa: E402
+from bench.fixtures import WORDS, paragraph, write_pdf, write_text  # noqa: E402
+from chunking import chunk_document  # noqa: E402
+
+_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+def paragraphs(n):
+    rng = random.Random(0)
+    return [paragraph(rng) for _ in range(n)]
+
+
+def write_docx(path, texts):
+    body = "".join(f"<w:p><w:r><w:t>{html.escape(text)}</w:t></w:r></w:p>" for text in texts)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", '<?xml version="1.0"?><Types/>')
+        archive.writestr("word/document.xml", f'<?xml version="1.0"?><w:document xmlns:w="{_W}"><w:body>{body}</w:body></w:document>')
+
+
+def write_html(path, texts):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<!DOCTYPE html><html><head><title>Bench</title><style>p { margin: 0 }</style></head><body>\n")
+        for i, text in enumerate(texts):
+            if i % 20 == 0:
+                f.write(f"<h2>Section {i // 20}</h2>\n")
+            f.write(f'<p class="para">{html.escape(text)}</p>\n')
+        f.write("</body></html>\n")
+
+
+def write_markdown(path, texts):
+    with open(path, "w", encoding="utf-8") as f:
+        for i, text in enumerate(texts):
+            if i % 20 == 0:
+                f.write(f"## Section {i // 20}\n\n")
+            f.write(f"{text.replace(WORDS[0], f'**{WORDS[0]}**')}\n\n")
+
+
+def write_csv(path, texts):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("id,title,abstract\n")
+        for i, text in enumerate(texts):
+            f.write(f'{i},"{" ".join(text.split()[:4])}","{text}"\n')
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def parse(path, content_type):
+    """Time to pull every segment, and the segments; chunking is left out of the timing."""
+    started = time.perf_counter()
+    _, segments = parsing.parse_document(path, content_type, file_hash(path))
+    segments = list(segments)
+    return time.perf_counter() - started, segments
+
+
+def base64_chunks(path):
+    # What the pre-registry fallback fed to the chunker for a binary upload.
+    def blocks():
+        with open(path, "rb") as f:
+            i = 0
+            while block := f.read(parsing.TEXT_BLOCK_SIZE):
+                yield i, base64.b64encode(block).decode("ascii")
+                i += 1
+    return sum(1 for _ in chunk_document(blocks()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, default=2000)
+    parser.add_argument("--pdf-pages", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parse_cache.PARSE_CACHE_PATH = os.path.join(tmp, "parse_cache.sqlite3")
+        texts = paragraphs(args.paragraphs)
+        files = {
+            "pdf": ("doc.pdf", lambda p: write_pdf(p, args.pdf_pages)),
+            "docx": ("doc.docx", lambda p: write_docx(p, texts)),
+            "html": ("doc.html", lambda p: write_html(p, texts)),
+            "markdown": ("doc.md", lambda p: write_markdown(p, texts)),
+            "csv": ("doc.csv", lambda p: write_csv(p, texts)),
+            "text": ("doc.txt", lambda p: write_text(p, args.paragraphs)),
+        }
+        print(f"{'format':<10}{'sniffed as':<28}{'MB':>7}{'chars':>11}{'chunks':>8}{'parse ms':>10}{'cached ms':>11}")
+        for name, (filename, write) in files.items():
+            path = os.path.join(tmp, filename)
+            write(path)
+            content_type = parsing.sniff_content_type(path, "application/octet-stream", filename)
+            first, segments = parse(path, content_type)
+            second, cached = parse(path, content_type)
+            assert cached == segments, f"{name}: the cache returned different text than the parser"
+            chars = sum(len(text) for _, text in segments)
+            chunks = sum(1 for _ in chunk_document(segments))
+            print(
+                f"{name:<10}{content_type[:27]:<28}{os.path.getsize(path) / 1024 / 1024:>7.2f}{chars:>11}{chunks:>8}"
+                f"{first * 1000:>10.1f}{second * 1000:>11.1f}"
+            )
+        parsing.shutdown_pdf_pool()
+
+        path = os.path.join(tmp, "blob.bin")
+        with open(path, "wb") as f:
+            f.write(random.Random(0).randbytes(4 * 1024 * 1024))
+        try:
+            parsing.sniff_content_type(path, "application/octet-stream", "blob.bin")
+            status = "accepted"
+        except parsing.DocumentRejected:
+            status = "rejected"
+        print(f"{'binary':<10}{status:<28}{4.0:>7.2f}{'':>11}{base64_chunks(path):>8}  (base64 chunks avoided)")
+
+
+if __name__ == "__main__":
+    main()
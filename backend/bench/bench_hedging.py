@@ -0,0 +1,100 @@
+"""
+Hedged requests and circuit breakers in llm_dispatch against the fake LLM server.
+
+Two scenarios, each run with hedging off and on:
+
+  tail    the primary model answers quickly except for --tail-rate of
+          requests, which wait an extra --tail-latency before their first
+          token. Hedging sends those to the fallback once the primary's p95
+          deadline passes, which cuts the p99 time to first token.
+  outage  every request to the primary fails with HTTP 503. Failed requests
+          move to the fallback, and once the breaker opens the primary is
+          skipped instead of being tried first.
+
+Reported per run: time to first token p50/p95/p99, requests that failed
+outright, hedges launched and won, fallbacks, and requests the server saw
+(the extra load hedging costs).
+
+Usage (from the backend directory):
+    python bench/bench_hedging.py [--requests 400] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("NVIDIA_API_KEY", "nvapi-bench")
+
+import llm_clients  # noqa: E402
+import llm_dispatch  # noqa: E402
+from bench.fake_llm_server import FakeLLMServer  # noqa: E402
+from metrics import percentile  # noqa: E402
+
+PRIMARY = "meta/llama-3.1-405b-instruct"
+FALLBACK = "nvidia/llama3-chatqa-1.5-8b"
+
+
+async def run(requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    ttfts, failures = [], 0
+
+    async def one(i):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                _, stream = await llm_dispatch.open_stream(PRIMARY, f"question {i}", [FALLBACK])
+            except llm_dispatch.LLMUnavailable:
+                failures += 1
+                return
+            ttfts.append(time.perf_counter() - started)
+            async for _ in stream:
+                pass
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return sorted(ttfts), failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="usual time to first token in seconds")
+    parser.add_argument("--tail-rate", type=float, default=0.05)
+    parser.add_argument("--tail-latency", type=float, default=1.5)
+    args = parser.parse_args()
+
+    scenarios = {
+        "tail": dict(tail_rate=args.tail_rate, tail_latency=args.tail_latency),
+        "outage": dict(model_error_rate={PRIMARY: 1.0}),
+    }
+    llm_clients.LLM_POOL_SIZE = args.concurrency * 2
+    llm_dispatch.LLM_HEDGE_MIN_SAMPLES = 10
+
+    print(f"{'scenario':<10}{'hedging':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'failed':>8}{'hedges':>8}{'won':>6}{'fallbk':>8}{'upstream':>10}")
+    for scenario, options in scenarios.items():
+        for hedging in (False, True):
+            server = FakeLLMServer(first_token_latency=args.latency, token_latency=0.001, tokens=8, **options).start()
+            llm_clients.NVIDIA_BASE_URL = server.base_url
+            llm_dispatch.LLM_HEDGING = hedging
+            llm_dispatch._health.clear()
+            hedges = llm_dispatch.LLM_HEDGES.snapshot()
+            fallbacks = sum(llm_dispatch.LLM_FALLBACKS.snapshot().values())
+            try:
+                ttfts, failed = asyncio.run(run(args.requests, args.concurrency))
+            finally:
+                llm_clients.close_all()
+                server.stop()
+            after = llm_dispatch.LLM_HEDGES.snapshot()
+            print(
+                f"{scenario:<10}{'on' if hedging else 'off':>8}"
+                f"{percentile(ttfts, 0.50) * 1000:>9.1f}{percentile(ttfts, 0.95) * 1000:>9.1f}{percentile(ttfts, 0.99) * 1000:>9.1f}"
+                f"{failed:>8}{after.get('launched', 0) - hedges.get('launched', 0):>8}{after.get('won', 0) - hedges.get('won', 0):>6}"
+                f"{sum(llm_dispatch.LLM_FALLBACKS.snapshot().values()) - fallbacks:>8}{server.requests:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
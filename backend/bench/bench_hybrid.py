@@ -0,0 +1,124 @@
+"""
+Vector-only vs hybrid (BM25 + vector, RRF) retrieval: latency and recall@k.
+
+The corpus is synthetic: filler chunks about the usual topics, some of which
+mention an identifier ("invoice INV-48213-K", "error code E7741"). Questions
+come in two kinds:
+
+- identifier: "Which passage mentions INV-48213-K?"; the answer is the one
+  chunk carrying that identifier.
+- topic: a paraphrase of a chunk's distinctive words; the answer is that chunk.
+
+The dense stand-in embeds hashed word vectors of the alphabetic words only,
+which is roughly how a sentence embedder treats an unseen code: the
+identifier barely moves the vector. Chroma is replaced by the in-process
+StubCollection (exact cosine search), with a simulated round-trip latency.
+
+Usage (from the backend directory):
+    python bench/bench_hybrid.py [--chunks 5000] [--questions 400] [--k 5]
+"""
+import argparse
+import hashlib
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import retrieval  # noqa: E402
+from bench.fixtures import WORDS  # noqa: E402
+from bench.stubs import StubCollection  # noqa: E402
+
+DIM = 128
+
+
+class WordEmbedder:
+    def __init__(self):
+        self._vectors = {}
+
+    def vector(self, word):
+        if word not in self._vectors:
+            seed = int.from_bytes(hashlib.sha256(word.encode()).digest()[:8], "little")
+            self._vectors[word] = np.random.default_rng(seed).standard_normal(DIM)
+        return self._vectors[word]
+
+    def __call__(self, input):
+        out = []
+        for text in input:
+            words = [w for w in text.lower().replace(".", " ").replace("?", " ").split() if w.isalpha()]
+            vector = sum((self.vector(w) for w in words), np.zeros(DIM))
+            out.append((vector / (np.linalg.norm(vector) or 1.0)).tolist())
+        return out
+
+
+def identifier(rng):
+    kind = rng.choice(("invoice INV-{}-{}", "error code E{}{}", "part {}-{}"))
+    return kind.format(rng.randint(1000, 99999), rng.choice("ABCDEFGHJK"))
+
+
+def build_corpus(rng, chunks, questions):
+    documents, asked = [], []
+    extra = [f"{a}{b}" for a in ("alpha", "beta", "gamma", "delta", "omega") for b in ("ridge", "field", "stone", "brook", "vale")]
+    for i in range(chunks):
+        words = [rng.choice(WORDS) for _ in range(60)] + rng.sample(extra, 2)
+        rng.shuffle(words)
+        documents.append(" ".join(words) + ".")
+    targets = rng.sample(range(chunks), questions)
+    for n, target in enumerate(targets):
+        if n % 2 == 0:
+            code = identifier(rng)
+            words = documents[target].rstrip(".").split(" ")
+            words.insert(rng.randrange(len(words)), code)
+            documents[target] = " ".join(words) + "."
+            asked.append(("identifier", f"Which passage mentions {code.split(' ')[-1]}?", target))
+        else:
+            words = documents[target].rstrip(".").split(" ")
+            asked.append(("topic", " ".join(rng.sample(words, 12)) + "?", target))
+    return documents, asked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--questions", type=int, default=400)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--store-latency", type=float, default=0.01, help="simulated Chroma round-trip")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    documents, questions = build_corpus(rng, args.chunks, args.questions)
+    embedder = WordEmbedder()
+    collection = StubCollection(embedder, latency=args.store_latency)
+    ids = [f"chunk-{i}" for i in range(len(documents))]
+    metadatas = [{"user_id": "1", "chat_id": "bench", "filename": "corpus.txt", "chunk_number": i} for i in range(len(documents))]
+    collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embedder(documents))
+
+    start = time.perf_counter()
+    retrieval.lexical_search(collection, ["warm up"], 1, "bench", 1)
+    print(f"index build: {len(documents)} chunks in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    print(f"{'mode':<8}{'kind':<12}{'recall@' + str(args.k):>10}{'p50 ms':>9}{'p95 ms':>9}")
+    for mode, hybrid in (("vector", False), ("hybrid", True)):
+        retrieval.HYBRID_SEARCH = hybrid
+        found = {"identifier": [], "topic": []}
+        latencies = []
+        for kind, question, target in questions:
+            vector = embedder([question])
+            start = time.perf_counter()
+            result = retrieval.retrieve(collection, [question], 1, "bench", n_results=args.k, query_embeddings=vector)
+            latencies.append(time.perf_counter() - start)
+            found[kind].append(ids[target] in result["ids"][0])
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000
+        p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000
+        for kind, hits in found.items():
+            print(f"{mode:<8}{kind:<12}{sum(hits) / len(hits):>10.3f}{p50:>9.1f}{p95:>9.1f}")
+    retrieval.shutdown_executor()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Ingestion throughput: one add() per chunk vs. the batched pipeline.
+
+Usage (from the backend directory):
+    python bench/bench_ingestion.py [--chunks 800] [--embed-latency 0.02] [--write-latency 0.01]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stubs import StubCollection, StubEmbedder  # noqa: E402
+from ingestion import ingest_chunks  # noqa: E402
+
+
+def make_chunks(n):
+    for i in range(n):
+        yield f"doc-{i}", f"chunk {i} " * 50, {"user_id": "1", "chat_id": "bench", "chunk_number": i}
+
+
+def run_serial(args):
+    embedder = StubEmbedder(args.embed_latency, args.embed_per_item)
+    collection = StubCollection(embedder, args.write_latency)
+    start = time.perf_counter()
+    for id_, doc, meta in make_chunks(args.chunks):
+        collection.add(ids=[id_], documents=[doc], metadatas=[meta])
+    return time.perf_counter() - start, embedder.calls, collection.calls
+
+
+def run_batched(args, batch_size, in_flight):
+    embedder = StubEmbedder(args.embed_latency, args.embed_per_item)
+    collection = StubCollection(embedder, args.write_latency)
+    start = time.perf_counter()
+    ingest_chunks(collection, make_chunks(args.chunks), embedder, batch_size=batch_size, max_in_flight=in_flight)
+    return time.perf_counter() - start, embedder.calls, collection.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=800)
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    parser.add_argument("--embed-per-item", type=float, default=0.0005)
+    parser.add_argument("--write-latency", type=float, default=0.01)
+    parser.add_argument("--batch-sizes", default="16,32,64,128")
+    parser.add_argument("--in-flight", default="1,2,4,8")
+    args = parser.parse_args()
+
+    print(f"{'mode':<24}{'seconds':>10}{'chunks/s':>12}{'embed calls':>14}{'writes':>10}")
+    elapsed, embeds, writes = run_serial(args)
+    print(f"{'serial (per chunk)':<24}{elapsed:>10.2f}{args.chunks / elapsed:>12.1f}{embeds:>14}{writes:>10}")
+
+    for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+        for in_flight in [int(x) for x in args.in_flight.split(",")]:
+            elapsed, embeds, writes = run_batched(args, batch_size, in_flight)
+            label = f"batch={batch_size} inflight={in_flight}"
+            print(f"{label:<24}{elapsed:>10.2f}{args.chunks / elapsed:>12.1f}{embeds:>14}{writes:>10}")
+
+
+if __name__ == "__main__":
+    main()
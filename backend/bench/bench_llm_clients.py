@@ -0,0 +1,78 @@
+"""
+Per-request ChatNVIDIA construction vs. the pooled client registry.
+
+Starts the fake OpenAI-compatible server, then sends the same number of
+invoke() calls twice: once building a new ChatNVIDIA per request (what
+main.py used to do) and once through llm_clients.get_llm. The stub answers
+with a fixed latency, so the difference in ms/request is client overhead:
+object construction plus a fresh TCP connection per call. "connections" is
+what the server accepted, i.e. how many handshakes a real endpoint would pay.
+
+Usage (from the backend directory):
+    python bench/bench_llm_clients.py [--requests 200] [--concurrency 8]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("NVIDIA_API_KEY", "nvapi-bench")
+
+from langchain_nvidia_ai_endpoints import ChatNVIDIA  # noqa: E402
+
+import llm_clients  # noqa: E402
+from bench.fake_llm_server import FakeLLMServer  # noqa: E402
+
+MODEL = "nvidia/llama3-chatqa-1.5-8b"
+
+
+def run(make_llm, requests, concurrency):
+    def one(_):
+        start = time.perf_counter()
+        make_llm().invoke("ping")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(one, range(requests)))
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.01, help="stub response time in seconds")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(first_token_latency=args.latency, token_latency=0, tokens=8).start()
+    llm_clients.NVIDIA_BASE_URL = server.base_url
+    llm_clients.LLM_POOL_SIZE = args.concurrency
+    variants = {
+        "per-request": lambda: ChatNVIDIA(model=MODEL, base_url=server.base_url),
+        "pooled": lambda: llm_clients.get_llm(MODEL),
+    }
+
+    print(f"{'client':<14}{'wall s':>8}{'req/s':>8}{'p50 ms':>8}{'p95 ms':>8}{'conns':>7}")
+    try:
+        for name, make_llm in variants.items():
+            make_llm().invoke("warm-up")
+            connections = server.connections
+            elapsed, latencies = run(make_llm, args.requests, args.concurrency)
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            print(
+                f"{name:<14}{elapsed:>8.2f}{args.requests / elapsed:>8.1f}"
+                f"{statistics.median(latencies) * 1000:>8.1f}{p95 * 1000:>8.1f}"
+                f"{server.connections - connections:>7}"
+            )
+    finally:
+        llm_clients.close_all()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
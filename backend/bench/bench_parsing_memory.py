@@ -0,0 +1,77 @@
+"""
+Peak memory of upload parsing: whole-document vs. streaming.
+
+Builds synthetic PDFs of increasing size and measures peak Python heap
+(tracemalloc) while turning each into 400-token chunks. The whole-document
+path grows with the amount of text; the streaming path only grows with
+pypdf's page index (a few KB per page), independent of how much text each
+page holds.
+
+Usage (from the backend directory):
+    python bench/bench_parsing_memory.py [--pages 100,400,800] [--lines-per-page 40]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pypdf import PdfReader  # noqa: E402
+
+from bench.fixtures import write_pdf  # noqa: E402
+from chunking import chunk_document, get_encoding  # noqa: E402
+from parsing import parse_document  # noqa: E402
+
+
+def whole_document(path):
+    # The pre-streaming upload path: whole file in memory, one big string, one token list.
+    with open(path, "rb") as f:
+        contents = f.read()
+    document = ""
+    for page in PdfReader(io.BytesIO(contents)).pages:
+        document += page.extract_text()
+    encoding = get_encoding()
+    tokens = encoding.encode(document)
+    chunks = [tokens[i:i + 400] for i in range(0, len(tokens), 400)]
+    return sum(1 for chunk in chunks if encoding.decode(chunk))
+
+
+def streaming(path):
+    _, segments = parse_document(path, "application/pdf")
+    return sum(1 for _ in chunk_document(segments, "fixed", chunk_size=400, overlap=0))
+
+
+def measure(fn, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks = fn(path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return chunks, peak / 1024 / 1024, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="100,400,800")
+    parser.add_argument("--lines-per-page", type=int, default=40)
+    args = parser.parse_args()
+
+    get_encoding()  # load the BPE ranks before measuring
+    print(f"{'pages':>6}{'file MB':>10}{'mode':>12}{'chunks':>8}{'peak MB':>10}{'seconds':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in [int(x) for x in args.pages.split(",")]:
+            path = os.path.join(tmp, f"synthetic-{pages}.pdf")
+            write_pdf(path, pages, args.lines_per_page)
+            size = os.path.getsize(path) / 1024 / 1024
+            for name, fn in (("whole", whole_document), ("streaming", streaming)):
+                chunks, peak, elapsed = measure(fn, path)
+                print(f"{pages:>6}{size:>10.1f}{name:>12}{chunks:>8}{peak:>10.1f}{elapsed:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
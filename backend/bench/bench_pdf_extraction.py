@@ -0,0 +1,54 @@
+"""
+PDF text extraction: in-process vs. the sharded process pool.
+
+Reports wall time and the CPU time spent in the calling process, which is
+the time the extraction holds the GIL away from the event loop.
+
+Usage (from the backend directory):
+    python bench/bench_pdf_extraction.py [--pages 400] [--workers 0,1,2,4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parsing  # noqa: E402
+from bench.fixtures import write_pdf  # noqa: E402
+
+
+def run(path, workers):
+    parsing.PDF_EXTRACT_WORKERS = workers
+    parsing.shutdown_pdf_pool()
+    if workers:
+        # Start the worker processes outside the timed region, as the server does.
+        parsing.get_pdf_pool().submit(int).result()
+    wall, cpu = time.perf_counter(), time.process_time()
+    _, segments = parsing.parse_document(path, "application/pdf")
+    chars = sum(len(text) for _, text in segments)
+    result = time.perf_counter() - wall, time.process_time() - cpu, chars
+    parsing.shutdown_pdf_pool()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--lines-per-page", type=int, default=40)
+    parser.add_argument("--workers", default="0,1,2,4")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic.pdf")
+        write_pdf(path, args.pages, args.lines_per_page)
+        print(f"{args.pages} pages, {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+        print(f"{'workers':>8}{'wall s':>10}{'caller cpu s':>14}{'pages/s':>10}{'chars':>12}")
+        for workers in [int(x) for x in args.workers.split(",")]:
+            wall, cpu, chars = run(path, workers)
+            print(f"{workers:>8}{wall:>10.2f}{cpu:>14.2f}{args.pages / wall:>10.1f}{chars:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Query embeddings: passage-mode vs. query-mode, one call per query vs. batched.
+
+The stub embedder hashes words into random directions. In passage mode it
+embeds every word of a question, including the interrogative boilerplate
+("what does the document say about ..."); in query mode it discounts those
+words, the way an asymmetric retrieval model learns to. That is enough to show
+how much the boilerplate dilutes query vectors and what batching saves in
+round-trips; absolute recall numbers only describe this synthetic corpus.
+
+Usage (from the backend directory):
+    python bench/bench_query_embeddings.py [--passages 2000] [--queries 200] [--k 5]
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fixtures import WORDS  # noqa: E402
+
+QUESTION_WORDS = "what does the document say about how is are explain describe which in of tell me please".split()
+TEMPLATES = [
+    "what does the document say about {}",
+    "how is {} described",
+    "explain {} please",
+    "tell me about {}",
+    "which section describes {}",
+]
+DIM = 128
+
+
+class StubEmbedder:
+    def __init__(self, input_type, latency=0.03, per_item=0.001):
+        self.input_type = input_type
+        self.latency = latency
+        self.per_item = per_item
+        self.calls = 0
+        self._directions = {}
+
+    def _direction(self, word):
+        if word not in self._directions:
+            seed = int.from_bytes(hashlib.sha256(word.encode()).digest()[:8], "little")
+            self._directions[word] = np.random.default_rng(seed).standard_normal(DIM)
+        return self._directions[word]
+
+    def __call__(self, texts):
+        self.calls += 1
+        time.sleep(self.latency + self.per_item * len(texts))
+        out = []
+        for text in texts:
+            vector = np.zeros(DIM)
+            for word in text.lower().split():
+                weight = 0.1 if self.input_type == "query" and word in QUESTION_WORDS else 1.0
+                vector += weight * self._direction(word)
+            out.append(vector / (np.linalg.norm(vector) or 1.0))
+        return out
+
+
+def build_corpus(rng, passages):
+    vocabulary = [f"{a}{b}" for a in WORDS for b in ("", "s", "ing", "ed")]
+    corpus, topics = [], []
+    for _ in range(passages):
+        topic = rng.sample(vocabulary, 3)
+        filler = [rng.choice(WORDS) for _ in range(12)]
+        corpus.append(" ".join(topic * 2 + filler))
+        topics.append(topic)
+    return corpus, topics
+
+
+def recall_at_k(index, query_vectors, gold, k):
+    hits = 0
+    for vector, target in zip(query_vectors, gold):
+        top = np.argsort(-(index @ vector))[:k]
+        hits += target in top
+    return hits / len(gold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--passages", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.03)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    corpus, topics = build_corpus(rng, args.passages)
+    index = np.array(StubEmbedder("passage", latency=0)(corpus))
+
+    gold = [rng.randrange(args.passages) for _ in range(args.queries)]
+    queries = [rng.choice(TEMPLATES).format(" ".join(rng.sample(topics[g], 2))) for g in gold]
+
+    print(f"{'mode':<10}{'batching':<10}{'recall@' + str(args.k):>10}{'embed s':>10}{'ms/query':>10}")
+    for input_type in ("passage", "query"):
+        for batching in ("single", "batched"):
+            embedder = StubEmbedder(input_type, latency=args.latency)
+            start = time.perf_counter()
+            if batching == "single":
+                vectors = [embedder([q])[0] for q in queries]
+            else:
+                vectors = embedder(queries)
+            elapsed = time.perf_counter() - start
+            recall = recall_at_k(index, vectors, gold, args.k)
+            print(f"{input_type:<10}{batching:<10}{recall:>10.3f}{elapsed:>10.2f}{elapsed / len(queries) * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
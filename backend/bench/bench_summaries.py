@@ -0,0 +1,145 @@
+"""
+Flat vs. two-stage (summary, then chunk) retrieval: latency, precision and prompt size.
+
+One chat holds `--files` synthetic files of `--chunks` chunks each. Every file
+mixes the shared filler vocabulary with words of its own topic, so a question
+built from one file's topic words has exactly one right file. Summaries are
+the extractive kind (the opening sentences), embedded like the chunks with
+the hashed word-vector embedder from bench_hybrid.py; chunks and summaries
+live in two in-process NumpyCollections that sleep `--store-latency` per call
+like a Chroma round-trip.
+
+Reported per mode: retrieval latency p50/p95, the share of retrieved chunks
+that come from the right file, and the prompt-context tokens build_context
+produces. "overview" asks to summarize the documents: two-stage answers it
+from the summaries alone, flat retrieval from whichever chunks come up.
+
+Usage (from the backend directory):
+    python bench/bench_summaries.py [--files 40] [--chunks 30] [--questions 300]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chroma_connection  # noqa: E402
+import retrieval  # noqa: E402
+import summaries  # noqa: E402
+from bench.bench_hybrid import WordEmbedder  # noqa: E402
+from bench.fixtures import WORDS  # noqa: E402
+from chunking import chunk_document  # noqa: E402
+from context import build_context  # noqa: E402
+from metrics import percentile  # noqa: E402
+from vector_store import NumpyCollection  # noqa: E402
+
+MODEL = "nvidia/llama3-chatqa-1.5-8b"
+
+
+class SlowCollection(NumpyCollection):
+    def __init__(self, name, latency):
+        super().__init__(name)
+        self.latency = latency
+
+    def query(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().query(*args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().get(*args, **kwargs)
+
+
+def topic_words(rng, n):
+    return ["".join(rng.choice("bcdfghjklmnprstvz") + rng.choice("aeiou") for _ in range(3)) for _ in range(n)]
+
+
+def build_chat(rng, args, embedder, chunks):
+    topics = []
+    for f in range(args.files):
+        topic = topic_words(rng, 12)
+        topics.append(topic)
+        filename = f"file-{f}.txt"
+        sentences = []
+        for _ in range(args.chunks * 12):
+            words = [rng.choice(WORDS) for _ in range(10)] + rng.sample(topic, 3)
+            rng.shuffle(words)
+            sentences.append(" ".join(words).capitalize() + ".")
+        text = " ".join(sentences)
+        source = summaries.SourceText()
+        ids, documents, metadatas = [], [], []
+        for i, chunk in enumerate(chunk_document([(0, text)], "sentence")):
+            source.add(chunk)
+            ids.append(f"{filename}-{i}")
+            documents.append(chunk.text)
+            metadatas.append({
+                "user_id": "1", "chat_id": "bench", "filename": filename, "chunk_number": i,
+                "char_start": chunk.start, "char_end": chunk.end,
+            })
+        chunks.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embedder(documents))
+        summaries.store_summary(1, "bench", filename, source, embedder)
+    return topics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--chunks", type=int, default=30, help="approximate chunks per file")
+    parser.add_argument("--questions", type=int, default=300)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--store-latency", type=float, default=0.01, help="simulated Chroma round-trip")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    embedder = WordEmbedder()
+    chunks = SlowCollection("chunks", args.store_latency)
+    chroma_connection._summary_collection = SlowCollection("summaries", args.store_latency)
+    chroma_connection._query_embedding_function = embedder
+    summaries.SUMMARY_MODE = "extractive"
+    topics = build_chat(rng, args, embedder, chunks)
+
+    questions = []
+    for _ in range(args.questions):
+        f = rng.randrange(args.files)
+        questions.append((f"file-{f}.txt", " ".join(rng.sample(topics[f], 4) + rng.sample(WORDS, 4)) + "?"))
+    retrieval.lexical_search(chunks, ["warm up"], 1, "bench", 1)
+
+    print(f"{args.files} files, {chunks.count()} chunks, {args.questions} questions, top-{args.k}")
+    print(f"{'mode':<12}{'p50 ms':>9}{'p95 ms':>9}{'precision':>11}{'ctx tokens':>12}")
+    for two_stage in (False, True):
+        retrieval.TWO_STAGE_RETRIEVAL = two_stage
+        latencies, hits, total, tokens = [], 0, 0, []
+        for filename, question in questions:
+            vector = embedder([question])
+            started = time.perf_counter()
+            result = retrieval.retrieve(chunks, [question], 1, "bench", n_results=args.k, query_embeddings=vector)
+            latencies.append(time.perf_counter() - started)
+            files = [m["filename"] for m in result["metadatas"][0]]
+            hits += files.count(filename)
+            total += len(files)
+            tokens.append(build_context(result, MODEL)[1]["context_tokens"])
+        latencies.sort()
+        tokens.sort()
+        print(
+            f"{'two-stage' if two_stage else 'flat':<12}{percentile(latencies, 0.50) * 1000:>9.1f}"
+            f"{percentile(latencies, 0.95) * 1000:>9.1f}{hits / max(total, 1):>11.2f}{percentile(tokens, 0.50):>12}"
+        )
+
+    question = "Summarize the documents"
+    vector = embedder([question])[0]
+    for two_stage in (False, True):
+        retrieval.TWO_STAGE_RETRIEVAL = two_stage
+        started = time.perf_counter()
+        result = asyncio.run(retrieval.aretrieve(chunks, question, 1, "bench", vector, n_results=args.k))
+        elapsed = time.perf_counter() - started
+        context_tokens = build_context(result, MODEL)[1]["context_tokens"]
+        name = "overview" + ("/sum" if two_stage else "/flat")
+        print(f"{name:<12}{elapsed * 1000:>9.1f}{'':>9}{'':>11}{context_tokens:>12}")
+    retrieval.shutdown_executor()
+
+
+if __name__ == "__main__":
+    main()
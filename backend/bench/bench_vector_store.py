@@ -0,0 +1,100 @@
+"""
+Vector-store backends: ingest throughput and chat-filtered query latency.
+
+Every backend gets the same random unit vectors spread over `--chats` chats of
+one user, added in batches of `--batch` the way ingestion writes them, then
+answers `--queries` nearest-neighbour queries filtered to one chat. "memory" is
+the in-process NumpyCollection, "local" a persistent Chroma in a temp
+directory, and "cloud" Chroma Cloud (only with CHROMA_API_KEY, CHROMA_TENANT
+and CHROMA_DATABASE set; it writes to and then deletes a scratch collection).
+
+Usage (from the backend directory):
+    python bench/bench_vector_store.py [--chunks 20000] [--chats 20] [--dim 1024] [--backends memory,local]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import percentile  # noqa: E402
+from vector_store import NumpyCollection  # noqa: E402
+
+
+def open_backend(name):
+    """Return (collection, cleanup) for a backend."""
+    if name == "memory":
+        return NumpyCollection("bench"), lambda: None
+    import chromadb
+
+    collection_name = f"bench-{uuid.uuid4().hex[:8]}"
+    if name == "local":
+        path = tempfile.mkdtemp(prefix="querion-chroma-")
+        client = chromadb.PersistentClient(path=path)
+        return client.create_collection(collection_name, embedding_function=None), lambda: shutil.rmtree(path, ignore_errors=True)
+    client = chromadb.CloudClient(
+        api_key=os.getenv("CHROMA_API_KEY"), tenant=os.getenv("CHROMA_TENANT"), database=os.getenv("CHROMA_DATABASE")
+    )
+    return client.create_collection(collection_name, embedding_function=None), lambda: client.delete_collection(collection_name)
+
+
+def run(name, args, vectors, queries):
+    collection, cleanup = open_backend(name)
+    try:
+        start = time.perf_counter()
+        for offset in range(0, len(vectors), args.batch):
+            batch = range(offset, min(offset + args.batch, len(vectors)))
+            collection.add(
+                ids=[f"chunk-{i}" for i in batch],
+                embeddings=vectors[offset:offset + len(batch)].tolist(),
+                documents=[f"chunk {i}" for i in batch],
+                metadatas=[{"user_id": "1", "chat_id": f"chat-{i % args.chats}", "chunk_number": i} for i in batch],
+            )
+        ingest = len(vectors) / (time.perf_counter() - start)
+
+        latencies = []
+        for n, query in enumerate(queries):
+            where = {"$and": [{"user_id": "1"}, {"chat_id": f"chat-{n % args.chats}"}]}
+            start = time.perf_counter()
+            collection.query(query_embeddings=[query.tolist()], n_results=args.k, where=where)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        return ingest, percentile(latencies, 0.50), percentile(latencies, 0.99)
+    finally:
+        cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--dim", type=int, default=1024, help="nv-embedqa-e5-v5 vectors are 1024-d")
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--backends", default="memory,local,cloud")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.chunks, args.dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    print(f"{args.chunks} chunks over {args.chats} chats, dim {args.dim}, top-{args.k}")
+    print(f"{'backend':<10}{'ingest/s':>10}{'p50 ms':>9}{'p99 ms':>9}")
+    for name in args.backends.split(","):
+        if name == "cloud" and not os.getenv("CHROMA_API_KEY"):
+            print(f"{name:<10}{'skipped (no CHROMA_API_KEY)':>28}")
+            continue
+        ingest, p50, p99 = run(name, args, vectors, queries)
+        print(f"{name:<10}{ingest:>10.0f}{p50 * 1000:>9.2f}{p99 * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
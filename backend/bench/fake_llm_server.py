@@ -0,0 +1,197 @@
+"""
+OpenAI-compatible stand-in for the NVIDIA chat completions endpoint.
+
+Serves POST /v1/chat/completions, both plain and streamed as SSE, and
+GET /v1/models. Every answer is made of `tokens` fake tokens; the server
+waits `first_token_latency` before the first one and `token_latency`
+between tokens, so TTFT and generation speed can be set per run. Latency
+can also be overridden per model, and `error_rate` makes a share of
+requests fail with HTTP 503 (`model_error_rate` per model). `tail_rate`
+makes a share of requests wait an extra `tail_latency` before their first
+token, for a slow tail like a loaded endpoint's.
+
+Run standalone (from the backend directory):
+    python bench/fake_llm_server.py --port 8765 --first-token-latency 0.2 --token-latency 0.01
+and point the backend at it with NVIDIA_BASE_URL=http://127.0.0.1:8765/v1.
+"""
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+
+class FakeLLMServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        first_token_latency: float = 0.05,
+        token_latency: float = 0.005,
+        tokens: int = 40,
+        model_latency: Optional[Dict[str, float]] = None,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        model_error_rate: Optional[Dict[str, float]] = None,
+        tail_rate: float = 0.0,
+        tail_latency: float = 0.0,
+    ):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.tokens = tokens
+        # model id -> first-token latency override
+        self.model_latency = dict(model_latency or {})
+        self.error_rate = error_rate
+        self.model_error_rate = dict(model_error_rate or {})
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.connections = 0
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes; without this,
+                # Nagle + delayed ACK adds ~40 ms to every keep-alive response.
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with server._lock:
+                    server.connections += 1
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    models = [{"id": m, "object": "model"} for m in server.model_latency] or [{"id": "fake", "object": "model"}]
+                    self._send_json(200, {"object": "list", "data": models})
+                else:
+                    self._send_json(404, {"detail": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                model = payload.get("model", "fake")
+                with server._lock:
+                    server.requests += 1
+                    failed = server._random.random() < server.model_error_rate.get(model, server.error_rate)
+                    slow = server._random.random() < server.tail_rate
+                if failed:
+                    self._send_json(503, {"status": 503, "title": "Service Unavailable", "detail": "fake failure"})
+                    return
+                first = server.model_latency.get(model, server.first_token_latency)
+                if slow:
+                    first += server.tail_latency
+                words = [f"tok{i} " for i in range(server.tokens)]
+                if payload.get("stream"):
+                    self._stream(model, words, first)
+                else:
+                    time.sleep(first + server.token_latency * len(words))
+                    self._send_json(200, {
+                        "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+                    })
+
+            def _chunk(self, text):
+                data = text.encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def _stream(self, model, words, first):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(first)
+                try:
+                    for i, word in enumerate(words):
+                        if i:
+                            time.sleep(server.token_latency)
+                        last = i == len(words) - 1
+                        event = {
+                            "id": "fake", "object": "chat.completion.chunk", "model": model,
+                            "choices": [{"index": 0, "delta": {"role": "assistant", "content": word}, "finish_reason": "stop" if last else None}],
+                        }
+                        self._chunk(f"data: {json.dumps(event)}\n\n")
+                    self._chunk("data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client went away mid-stream (e.g. a cancelled hedge).
+                    self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--tokens", type=int, default=80)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-latency", type=float, default=0.0)
+    parser.add_argument("--model-latency", action="append", default=[], help="model=seconds, may repeat")
+    args = parser.parse_args()
+
+    model_latency = {}
+    for item in args.model_latency:
+        name, _, seconds = item.rpartition("=")
+        model_latency[name] = float(seconds)
+    server = FakeLLMServer(
+        args.host, args.port, args.first_token_latency, args.token_latency, args.tokens, model_latency, args.error_rate,
+        tail_rate=args.tail_rate, tail_latency=args.tail_latency,
+    )
+    print(f"Fake LLM server on {server.base_url}")
+    server._server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Synthetic documents for the benchmarks.
+"""
+import random
+
+WORDS = (
+    "retrieval augmented generation vector embedding chunk token context model "
+    "latency throughput document upload query answer index search budget cache "
+    "stream parser page section table figure summary result method dataset"
+).split()
+
+
+def paragraph(rng: random.Random, words: int = 60) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)) + "."
+
+
+def write_pdf(path: str, pages: int, lines_per_page: int = 40, seed: int = 0) -> None:
+    """Write a plain-text PDF with `pages` pages using only the standard Helvetica font."""
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for p in range(pages):
+        lines = [f"Page {p + 1}."] + [" ".join(rng.choice(WORDS) for _ in range(10)) for _ in range(lines_per_page)]
+        text = "\n".join(f"({line}) Tj T*" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 780 Td\n{text}\nET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for i, obj in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % i + obj + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def write_text(path: str, paragraphs: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(paragraphs):
+            f.write(paragraph(rng) + "\n\n")
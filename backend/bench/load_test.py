@@ -0,0 +1,151 @@
+"""
+Concurrent requests/sec for one uvicorn worker with stubbed backends.
+
+The worker runs in a child process against the fake LLM server, a stub
+query embedder and a stub Chroma collection, with a throwaway SQLite
+database. The response cache is disabled, so every request goes through
+embedding, retrieval and the LLM. Each concurrency level sends `--requests`
+distinct queries. With an async request path, throughput should grow with
+concurrency until ASYNC_OFFLOAD_THREADS or the CPU becomes the limit. A worker
+that blocks its event loop stays near 1 / (LLM latency) req/s.
+
+Usage (from the backend directory; needs aiosqlite):
+    python bench/load_test.py [--concurrency 1,8,32,64] [--requests 200] [--endpoint query|stream]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.fake_llm_server import FakeLLMServer  # noqa: E402
+
+
+def serve(port, llm_url, db_path, store_latency, env=None):
+    """Child process: the app on one uvicorn worker with every backend stubbed."""
+    os.environ.update(env or {})
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "NVIDIA_BASE_URL": llm_url,
+        "NVIDIA_API_KEY": os.environ.get("NVIDIA_API_KEY", "nvapi-bench"),
+        "LLM_WARMUP": "false",
+        "EMBEDDING_CACHE_PATH": "",
+        "PARSE_CACHE_PATH": "",
+        "RESPONSE_CACHE_MAX_ENTRIES": "0",
+        # Keep the report readable.
+        "LOG_LEVEL": "WARNING",
+    })
+    sys.path.insert(0, BACKEND_DIR)
+    import uvicorn
+
+    import chroma_connection
+    import main
+    from bench.stubs import StubCollection, StubEmbedder
+
+    embedder = StubEmbedder(latency=store_latency)
+    collection = StubCollection(embedder, latency=store_latency)
+    collection.add(
+        ids=[f"doc-{i}" for i in range(5)],
+        documents=[f"Stub passage number {i}." for i in range(5)],
+        metadatas=[{"user_id": "1", "chat_id": "bench", "filename": "stub.txt", "chunk_number": i} for i in range(5)],
+        embeddings=[embedder.vector(str(i)) for i in range(5)],
+    )
+    chroma_connection._query_embedding_function = embedder
+    main.app.dependency_overrides[main.get_chroma_collection] = lambda: collection
+    uvicorn.run(main.app, host="127.0.0.1", port=port, workers=1, log_level="warning")
+
+
+async def wait_ready(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(base_url + "/")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError("worker did not start")
+
+
+async def run_level(base_url, endpoint, concurrency, requests, offset):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, first_bytes, errors = [], [], 0
+
+    async def one(client, i):
+        nonlocal errors
+        body = {"query": f"load test question {offset + i}", "user_id": 1, "chat_id": "bench", "version": "Free"}
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if endpoint == "stream":
+                    async with client.stream("POST", base_url + "/query/stream/", json=body) as response:
+                        response.raise_for_status()
+                        data_lines = 0
+                        async for line in response.aiter_lines():
+                            if line.startswith("data:"):
+                                data_lines += 1
+                                # The first data line names the model; the second is the first token.
+                                if data_lines == 2:
+                                    first_bytes.append(time.perf_counter() - start)
+                else:
+                    response = await client.post(base_url + "/query/", json=body)
+                    response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors += 1
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+    return elapsed, sorted(latencies), first_bytes, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32,64")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--endpoint", choices=("query", "stream"), default="query")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fake LLM time to first token")
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--store-latency", type=float, default=0.01, help="stub embedder/Chroma round-trip")
+    args = parser.parse_args()
+
+    llm = FakeLLMServer(first_token_latency=args.llm_latency, token_latency=args.token_latency, tokens=50).start()
+    db_path = os.path.join(tempfile.mkdtemp(prefix="querion-load-"), "app.sqlite3")
+    worker = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(args.port, llm.base_url, db_path, args.store_latency), daemon=True
+    )
+    worker.start()
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(wait_ready(base_url))
+        print(f"{'conc':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'ttft ms':>9}{'errors':>8}")
+        offset = 0
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            elapsed, latencies, first_bytes, errors = asyncio.run(
+                run_level(base_url, args.endpoint, concurrency, args.requests, offset)
+            )
+            offset += args.requests
+            p50 = statistics.median(latencies) if latencies else 0.0
+            p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)] if latencies else 0.0
+            ttft = statistics.median(first_bytes) * 1000 if first_bytes else float("nan")
+            print(f"{concurrency:>5}{len(latencies) / elapsed:>9.1f}{p50 * 1000:>9.0f}{p95 * 1000:>9.0f}{ttft:>9.0f}{errors:>8}")
+    finally:
+        worker.terminate()
+        worker.join()
+        llm.stop()
+
+
+if __name__ == "__main__":
+    main()
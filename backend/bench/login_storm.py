@@ -0,0 +1,142 @@
+"""
+Login throughput, and /query/ latency while a login storm is running.
+
+One uvicorn worker runs with stubbed backends (see load_test.py). A steady
+stream of `--query-concurrency` /query/ clients runs through three phases of
+`--duration` seconds each:
+
+- baseline: queries only.
+- storm: `--storm-concurrency` clients log in over and over with the
+  password, so every login costs a bcrypt verify.
+- tokens: the same storm, but after its first login each client renews
+  its session token through /session/refresh/, which skips bcrypt.
+
+bcrypt runs on PASSWORD_HASH_WORKERS threads with at most PASSWORD_HASH_QUEUE
+waiting; logins beyond that get 503. Every client shares 127.0.0.1, so the
+per-IP login limit is lifted for the run.
+
+Usage (from the backend directory; needs aiosqlite):
+    python bench/login_storm.py [--users 16] [--storm-concurrency 32] [--duration 10] [--hash-workers 1]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_llm_server import FakeLLMServer  # noqa: E402
+from bench.load_test import serve, wait_ready  # noqa: E402
+
+
+def summarize(latencies):
+    if not latencies:
+        return float("nan"), float("nan")
+    latencies = sorted(latencies)
+    return statistics.median(latencies) * 1000, latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000
+
+
+async def query_loop(client, base_url, deadline, latencies, errors, worker):
+    n = 0
+    while time.monotonic() < deadline:
+        body = {"query": f"storm question {worker}-{n}-{time.monotonic()}", "user_id": 1, "chat_id": "bench", "version": "Free"}
+        start = time.perf_counter()
+        try:
+            response = await client.post(base_url + "/query/", json=body)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            errors.append(1)
+        n += 1
+
+
+async def login_loop(client, base_url, deadline, username, use_token, latencies, statuses):
+    token = None
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            if token and use_token:
+                response = await client.post(base_url + "/session/refresh/", headers={"Authorization": f"Bearer {token}"})
+            else:
+                response = await client.post(base_url + "/login/", json={"username": username, "password": "storm-password"})
+        except httpx.HTTPError:
+            statuses.append("error")
+            continue
+        statuses.append(response.status_code)
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+            token = response.json().get("access_token")
+        elif response.status_code in (429, 503):
+            await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+
+
+async def run_phase(base_url, args, users, storm, use_token=False):
+    limits = httpx.Limits(max_connections=args.storm_concurrency + args.query_concurrency + 4)
+    query_latencies, query_errors, login_latencies, statuses = [], [], [], []
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        deadline = time.monotonic() + args.duration
+        tasks = [query_loop(client, base_url, deadline, query_latencies, query_errors, i) for i in range(args.query_concurrency)]
+        if storm:
+            tasks += [
+                login_loop(client, base_url, deadline, users[i % len(users)], use_token, login_latencies, statuses)
+                for i in range(args.storm_concurrency)
+            ]
+        await asyncio.gather(*tasks)
+    return query_latencies, query_errors, login_latencies, statuses
+
+
+async def register(base_url, users):
+    async with httpx.AsyncClient(timeout=120) as client:
+        for username in users:
+            response = await client.post(base_url + "/register/", json={"username": username, "password": "storm-password"})
+            response.raise_for_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--storm-concurrency", type=int, default=32)
+    parser.add_argument("--query-concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--hash-workers", type=int, default=1, help="PASSWORD_HASH_WORKERS for the worker")
+    parser.add_argument("--hash-queue", type=int, default=16, help="PASSWORD_HASH_QUEUE for the worker")
+    parser.add_argument("--port", type=int, default=8791)
+    args = parser.parse_args()
+
+    llm = FakeLLMServer(first_token_latency=0.05, token_latency=0.001, tokens=20).start()
+    db_path = os.path.join(tempfile.mkdtemp(prefix="querion-login-"), "app.sqlite3")
+    env = {
+        "PASSWORD_HASH_WORKERS": str(args.hash_workers),
+        "PASSWORD_HASH_QUEUE": str(args.hash_queue),
+        "LOGIN_ATTEMPTS_PER_IP": "1000000000",
+    }
+    worker = multiprocessing.get_context("spawn").Process(target=serve, args=(args.port, llm.base_url, db_path, 0.01, env), daemon=True)
+    worker.start()
+    base_url = f"http://127.0.0.1:{args.port}"
+    users = [f"storm-user-{i}" for i in range(args.users)]
+    try:
+        asyncio.run(wait_ready(base_url))
+        asyncio.run(register(base_url, users))
+        print(f"{'phase':<10}{'logins/s':>9}{'login p50':>10}{'login p95':>10}{'503s':>6}{'query p50':>10}{'query p95':>10}{'q errs':>7}")
+        for phase, storm, use_token in (("baseline", False, False), ("storm", True, False), ("tokens", True, True)):
+            query_latencies, query_errors, login_latencies, statuses = asyncio.run(run_phase(base_url, args, users, storm, use_token))
+            login_p50, login_p95 = summarize(login_latencies)
+            query_p50, query_p95 = summarize(query_latencies)
+            print(
+                f"{phase:<10}{len(login_latencies) / args.duration:>9.1f}{login_p50:>10.0f}{login_p95:>10.0f}"
+                f"{statuses.count(503):>6}{query_p50:>10.0f}{query_p95:>10.0f}{len(query_errors):>7}"
+            )
+    finally:
+        worker.terminate()
+        worker.join()
+        llm.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Local stand-ins for the NVIDIA embedder and the Chroma collection.
+
+They only simulate network latency and return deterministic data, so the
+benchmarks in this directory run offline and give repeatable numbers.
+"""
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+
+class StubEmbedder:
+    """Sleeps like a remote embedding call, then returns a hash-derived vector per text."""
+
+    def __init__(self, latency: float = 0.02, per_item: float = 0.0005, dim: int = 8):
+        self.latency = latency
+        self.per_item = per_item
+        self.dim = dim
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + self.per_item * len(input))
+        return [self.vector(text) for text in input]
+
+    def vector(self, text: str) -> List[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [b / 255.0 for b in digest[: self.dim]]
+
+
+class StubCollection:
+    """Records writes and sleeps like a Chroma Cloud round-trip on every call."""
+
+    def __init__(self, embedder: StubEmbedder, latency: float = 0.01):
+        self.embedder = embedder
+        self.latency = latency
+        self.calls = 0
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, ids, documents=None, metadatas=None, embeddings=None):
+        time.sleep(self.latency)
+        if embeddings is None:
+            # Chroma embeds the documents itself when no vectors are given.
+            embeddings = self.embedder(documents)
+        with self._lock:
+            self.calls += 1
+            for i, id_ in enumerate(ids):
+                self.records[id_] = {
+                    "document": documents[i] if documents else None,
+                    "metadata": metadatas[i] if metadatas else None,
+                    "embedding": embeddings[i],
+                }
+
+    def _matching(self, where) -> List[tuple]:
+        with self._lock:
+            self.calls += 1
+            return [(id_, r) for id_, r in self.records.items() if _matches(r["metadata"] or {}, where)]
+
+    def query(self, query_embeddings=None, n_results=5, where=None, **kwargs):
+        """Exact cosine search over the stored records matching `where`."""
+        time.sleep(self.latency)
+        records = self._matching(where)
+        if not query_embeddings or not records:
+            rows = len(query_embeddings or [None])
+            hits = [[(id_, r, 0.0) for id_, r in records[:n_results]] for _ in range(rows)]
+        else:
+            matrix = np.array([r["embedding"] for _, r in records], dtype=np.float64)
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+            hits = []
+            for vector in query_embeddings:
+                vector = np.asarray(vector, dtype=np.float64)
+                similarity = matrix @ (vector / (np.linalg.norm(vector) + 1e-12))
+                top = np.argsort(-similarity, kind="stable")[:n_results]
+                hits.append([(records[i][0], records[i][1], float(1 - similarity[i])) for i in top])
+        return {
+            "ids": [[id_ for id_, _, _ in row] for row in hits],
+            "documents": [[r["document"] for _, r, _ in row] for row in hits],
+            "metadatas": [[r["metadata"] for _, r, _ in row] for row in hits],
+            "distances": [[d for _, _, d in row] for row in hits],
+        }
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=0):
+        time.sleep(self.latency)
+        records = self._matching(where)
+        if ids is not None:
+            wanted = set(ids)
+            records = [(id_, r) for id_, r in records if id_ in wanted]
+        records = records[offset:None if limit is None else offset + limit]
+        return {
+            "ids": [id_ for id_, _ in records],
+            "documents": [r["document"] for _, r in records] if "documents" in include else None,
+            "metadatas": [r["metadata"] for _, r in records] if "metadatas" in include else None,
+        }
+
+    def delete(self, ids=None, where=None):
+        time.sleep(self.latency)
+        doomed = {id_ for id_, _ in self._matching(where)}
+        if ids is not None:
+            doomed &= set(ids)
+        with self._lock:
+            for id_ in doomed:
+                self.records.pop(id_, None)
+
+
+def _matches(metadata: Dict[str, Any], where) -> bool:
+    """The subset of Chroma's `where` syntax the app uses: equality and $and."""
+    if not where:
+        return True
+    if "$and" in where:
+        return all(_matches(metadata, clause) for clause in where["$and"])
+    return all(metadata.get(key) == value for key, value in where.items())
@@ -0,0 +1,368 @@
+"""
+End-to-end benchmark suite with a JSON report that can be compared between runs.
+
+One uvicorn worker runs in a child process with every remote service replaced
+locally: chat completions go to the fake LLM server (bench/fake_llm_server.py)
+with configurable time to first token and per-token latency, embeddings come
+from the deterministic StubEmbedder, chunks are stored in the in-process
+vector store (VECTOR_STORE=memory) and users/jobs in a throwaway SQLite file.
+
+Scenarios, each run at every `--concurrency` level with `--requests` requests:
+
+- upload: POST /uploadfile/ with a distinct generated text file, then poll
+  /jobs/{job_id} until ingestion finishes ("completion" latency).
+- query: POST /query/ against chats filled by a setup upload.
+- stream: POST /query/stream/; "ttft" is the time to the first token event.
+- delete: POST /delete_chat/ for freshly uploaded chats, then poll
+  /deletions/{deletion_id} until the chunks are gone.
+
+For every run the report records throughput, p50/p95/p99 latency, errors and
+the worker's peak RSS during the run. With `--compare` the new report is
+printed side by side with an earlier one.
+
+Usage (from the backend directory; needs aiosqlite):
+    python bench/suite.py [--scenarios upload,query,stream,delete] [--concurrency 1,8,32]
+        [--requests 100] [--token-latency 0.005] [--output report.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.fake_llm_server import FakeLLMServer  # noqa: E402
+from bench.fixtures import paragraph  # noqa: E402
+from bench.load_test import wait_ready  # noqa: E402
+from metrics import percentile  # noqa: E402
+
+SCENARIOS = ("upload", "query", "stream", "delete")
+POLL_INTERVAL = 0.05
+# Seconds an upload or deletion may take before it counts as an error.
+COMPLETION_TIMEOUT = 300
+
+
+def serve(port, llm_url, db_path, embed_latency):
+    """Child process: the app on one uvicorn worker with local stand-ins."""
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "VECTOR_STORE": "memory",
+        "VECTOR_STORE_PATH": "",
+        "NVIDIA_BASE_URL": llm_url,
+        "NVIDIA_API_KEY": os.environ.get("NVIDIA_API_KEY", "nvapi-bench"),
+        "LLM_WARMUP": "false",
+        "EMBEDDING_CACHE_PATH": "",
+        "PARSE_CACHE_PATH": "",
+        "RESPONSE_CACHE_MAX_ENTRIES": "0",
+        "LOG_LEVEL": "WARNING",
+    })
+    sys.path.insert(0, BACKEND_DIR)
+    import uvicorn
+
+    import chroma_connection
+    import main
+    from bench.stubs import StubEmbedder
+
+    # Same vectors for passages and queries, so questions find their passages.
+    embedder = StubEmbedder(latency=embed_latency)
+    chroma_connection._embedding_function = embedder
+    chroma_connection._query_embedding_function = embedder
+    uvicorn.run(main.app, host="127.0.0.1", port=port, workers=1, log_level="warning")
+
+
+class RSSSampler:
+    """Peak resident set size of a process while it runs, sampled from /proc (Linux only)."""
+
+    def __init__(self, pid, interval=0.05):
+        self.path = f"/proc/{pid}/status"
+        self.interval = interval
+        self.peak_kb = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def read(self, field="VmRSS"):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.startswith(field + ":"):
+                        return int(line.split()[1])
+        except OSError:
+            return None
+        return None
+
+    def _run(self):
+        while True:
+            rss = self.read()
+            if rss is not None:
+                self.peak_kb = max(self.peak_kb or 0, rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def document(seed, paragraphs):
+    rng = random.Random(seed)
+    return "\n\n".join(paragraph(rng) for _ in range(paragraphs)).encode("utf-8")
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "mean": round(sum(values) / len(values) * 1000, 2),
+        "p50": round(percentile(values, 0.50) * 1000, 2),
+        "p95": round(percentile(values, 0.95) * 1000, 2),
+        "p99": round(percentile(values, 0.99) * 1000, 2),
+        "max": round(values[-1] * 1000, 2),
+    }
+
+
+async def poll(client, path, params, done_statuses):
+    deadline = time.monotonic() + COMPLETION_TIMEOUT
+    while time.monotonic() < deadline:
+        response = await client.get(path, params=params)
+        response.raise_for_status()
+        status = response.json()["status"]
+        if status in done_statuses:
+            return status
+        await asyncio.sleep(POLL_INTERVAL)
+    raise TimeoutError(f"{path} still running after {COMPLETION_TIMEOUT}s")
+
+
+async def upload(client, chat_id, seed, paragraphs, wait=True):
+    """Upload one generated file; returns (request seconds, seconds until ingested)."""
+    started = time.perf_counter()
+    files = {"file": (f"doc-{seed}.txt", document(seed, paragraphs), "text/plain")}
+    response = await client.post("/uploadfile/", params={"user_id": 1, "chat_id": chat_id}, files=files)
+    response.raise_for_status()
+    accepted = time.perf_counter() - started
+    if wait:
+        status = await poll(client, f"/jobs/{response.json()['job_id']}", {"user_id": 1}, ("completed", "failed", "cancelled"))
+        if status != "completed":
+            raise RuntimeError(f"ingestion {status}")
+    return accepted, time.perf_counter() - started
+
+
+def query_body(i, chat_id):
+    return {"query": f"Question {i}: what does the document say about item {i % 50}?", "user_id": 1, "chat_id": chat_id, "version": "Free"}
+
+
+async def run_level(base_url, scenario, concurrency, args, level_seed):
+    """Send `args.requests` requests of `scenario`, `concurrency` at a time."""
+    limits = httpx.Limits(max_connections=concurrency + 4)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=COMPLETION_TIMEOUT) as client:
+        chats = [f"{scenario}-{level_seed}-{i}" for i in range(args.requests if scenario == "delete" else args.chats)]
+        if scenario in ("query", "stream", "delete"):
+            # Setup, not measured: the chats the requests read or delete.
+            setup = asyncio.Semaphore(8)
+
+            async def fill(i, chat_id):
+                async with setup:
+                    await upload(client, chat_id, level_seed * 100_000 + i, args.paragraphs)
+
+            await asyncio.gather(*(fill(i, chat_id) for i, chat_id in enumerate(chats)))
+
+        latencies, completions, ttfts, errors = [], [], [], []
+
+        async def one(i):
+            chat_id = chats[i % len(chats)]
+            started = time.perf_counter()
+            if scenario == "upload":
+                accepted, completed = await upload(client, chat_id, level_seed * 100_000 + i, args.paragraphs)
+                latencies.append(accepted)
+                completions.append(completed)
+            elif scenario == "query":
+                response = await client.post("/query/", json=query_body(i, chat_id))
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+            elif scenario == "stream":
+                first_token = None
+                async with client.stream("POST", "/query/stream/", json=query_body(i, chat_id)) as response:
+                    response.raise_for_status()
+                    event = "message"
+                    async for line in response.aiter_lines():
+                        if line.startswith("event:"):
+                            event = line[6:].strip()
+                        elif line.startswith("data:") and event == "message" and first_token is None:
+                            first_token = time.perf_counter() - started
+                        elif line.startswith("data:") and event == "error":
+                            raise RuntimeError(line[5:].strip())
+                        elif not line:
+                            event = "message"
+                latencies.append(time.perf_counter() - started)
+                if first_token is not None:
+                    ttfts.append(first_token)
+            else:
+                response = await client.post("/delete_chat/", params={"user_id": 1, "chat_id": chat_id})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+                status = await poll(client, f"/deletions/{response.json()['deletion_id']}", {"user_id": 1}, ("completed", "failed"))
+                if status != "completed":
+                    raise RuntimeError(f"deletion {status}")
+                completions.append(time.perf_counter() - started)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(i):
+            async with semaphore:
+                try:
+                    await one(i)
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    result = {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "errors": len(errors),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round((args.requests - len(errors)) / elapsed, 2),
+        "latency_ms": summarize(latencies),
+    }
+    if completions:
+        result["completion_ms"] = summarize(completions)
+    if ttfts:
+        result["ttft_ms"] = summarize(ttfts)
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def row(result):
+    latency = result["latency_ms"] or {}
+    ttft = (result.get("ttft_ms") or {}).get("p50")
+    completion = (result.get("completion_ms") or {}).get("p95")
+    return (
+        f"{result['scenario']:<8}{result['concurrency']:>6}{result['throughput_rps']:>9.1f}"
+        f"{latency.get('p50', float('nan')):>9.1f}{latency.get('p95', float('nan')):>9.1f}{latency.get('p99', float('nan')):>9.1f}"
+        f"{ttft if ttft is not None else float('nan'):>9.1f}{completion if completion is not None else float('nan'):>10.1f}"
+        f"{result['peak_rss_mb'] if result.get('peak_rss_mb') is not None else float('nan'):>8.0f}{result['errors']:>6}"
+    )
+
+
+HEADER = f"{'scenario':<8}{'conc':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ttft ms':>9}{'done p95':>10}{'rss MB':>8}{'errs':>6}"
+
+
+def compare(baseline, report):
+    """Print throughput and p95 of matching runs in `baseline` and `report`."""
+    old = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\ncompared with {baseline['meta'].get('commit') or 'baseline'} ({baseline['meta'].get('started_at')}):", file=sys.stderr)
+    print(f"{'scenario':<8}{'conc':>6}{'req/s':>24}{'p95 ms':>24}{'ttft p50 ms':>24}", file=sys.stderr)
+    for result in report["results"]:
+        before = old.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+
+        def pair(key, sub=None):
+            a, b = before.get(key), result.get(key)
+            if sub:
+                a, b = (a or {}).get(sub), (b or {}).get(sub)
+            if a is None or b is None:
+                return f"{'-':>24}"
+            change = f"{(b - a) / a * 100:+.0f}%" if a else ""
+            return f"{a:>9.1f} ->{b:>9.1f}{change:>6}"
+
+        print(f"{result['scenario']:<8}{result['concurrency']:>6}{pair('throughput_rps')}{pair('latency_ms', 'p95')}{pair('ttft_ms', 'p50')}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario and concurrency level")
+    parser.add_argument("--chats", type=int, default=4, help="chats the query and stream scenarios spread over")
+    parser.add_argument("--paragraphs", type=int, default=40, help="size of each uploaded file")
+    parser.add_argument("--first-token-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="seconds per stub embedding call")
+    parser.add_argument("--port", type=int, default=8793)
+    parser.add_argument("--output", help="write the JSON report here (default: print it)")
+    parser.add_argument("--compare", help="an earlier report to compare against")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    llm = FakeLLMServer(first_token_latency=args.first_token_latency, token_latency=args.token_latency, tokens=args.tokens).start()
+    db_path = os.path.join(tempfile.mkdtemp(prefix="querion-suite-"), "app.sqlite3")
+    worker = multiprocessing.get_context("spawn").Process(target=serve, args=(args.port, llm.base_url, db_path, args.embed_latency), daemon=True)
+    worker.start()
+    base_url = f"http://127.0.0.1:{args.port}"
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": [],
+    }
+    try:
+        asyncio.run(wait_ready(base_url))
+        sampler = RSSSampler(worker.pid)
+        print(HEADER, file=sys.stderr)
+        for level_seed, (scenario, concurrency) in enumerate((s, c) for s in scenarios for c in levels):
+            with RSSSampler(worker.pid) as rss:
+                result = asyncio.run(run_level(base_url, scenario, concurrency, args, level_seed))
+            result["peak_rss_mb"] = round(rss.peak_kb / 1024, 1) if rss.peak_kb else None
+            report["results"].append(result)
+            print(row(result), file=sys.stderr)
+        peak = sampler.read("VmHWM")
+        report["meta"]["worker_peak_rss_mb"] = round(peak / 1024, 1) if peak else None
+    finally:
+        worker.terminate()
+        worker.join()
+        llm.stop()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
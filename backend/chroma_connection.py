@@ -2,13 +2,24 @@
 import chromadb
 from chromadb.api import ClientAPI
 from chromadb.api.models.Collection import Collection
-from fastapi import Depends
 from dotenv import load_dotenv
 import os
 from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from embedding_cache import get_embedding_cache
+from vector_store import NumpyCollection
 
 load_dotenv()
 
+# Where chunks are stored: "cloud" (Chroma Cloud), "local" (persistent Chroma
+# on disk at CHROMA_PATH) or "memory" (vector_store.NumpyCollection in this
+# process, saved to VECTOR_STORE_PATH on shutdown if set).
+VECTOR_STORE = os.getenv("VECTOR_STORE", "cloud")
+VECTOR_STORES = ("cloud", "local", "memory")
+CHROMA_PATH = os.getenv("CHROMA_PATH", "chroma_data")
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH") or None
+COLLECTION_NAME = "user_files"
+SUMMARY_COLLECTION_NAME = "user_file_summaries"
+
 class NVIDIAEmbeddingFunction(EmbeddingFunction[Documents]):
     def __init__(self, model_name: str = "nvidia/nv-embedqa-e5-v5", input_type: str = "passage"):
         try:
@@ -18,34 +29,112 @@ class NVIDIAEmbeddingFunction(EmbeddingFunction[Documents]):
                 "Could not import langchain_nvidia_ai_endpoints. "
                 "Please install it with `pip install langchain-nvidia-ai-endpoints`."
             )
-        self.client = NVIDIAEmbeddings(model=model_name, input_type=input_type)
+        if input_type == "query":
+            # NVIDIAEmbeddings.embed_documents always sends input_type="passage"
+            # unless model_type is set; this keeps batched calls for queries.
+            self.client = NVIDIAEmbeddings(model=model_name, model_type="query")
+        else:
+            self.client = NVIDIAEmbeddings(model=model_name)
+        self.model_name = model_name
+        self.input_type = input_type
 
     def __call__(self, input: Documents) -> Embeddings:
-        # The input is a list of documents (strings).
-        # The NVIDIAEmbeddings client expects a list of strings for embedding.
-        embeddings = self.client.embed_documents(input)
-        return embeddings
+        # The input is a list of documents (strings). Only texts the cache has
+        # not seen for this model/input_type go to the NVIDIAEmbeddings client.
+        cache = get_embedding_cache()
+        keys = [cache.key(self.model_name, self.input_type, text) for text in input]
+        found = cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, input) if key not in found}
+        if missing:
+            embeddings = self.client.embed_documents(list(missing.values()))
+            fresh = list(zip(missing.keys(), embeddings))
+            cache.put_many(fresh)
+            found.update(fresh)
+        return [found[key] for key in keys]
 
 _client: ClientAPI | None = None
-_collection: Collection | None = None
+_collection: Collection | NumpyCollection | None = None
+_summary_collection: Collection | NumpyCollection | None = None
+_embedding_function: NVIDIAEmbeddingFunction | None = None
+_query_embedding_function: NVIDIAEmbeddingFunction | None = None
 
 def get_chroma_client() -> ClientAPI:
 	global _client
 	if _client is None:
-		_client = chromadb.CloudClient(
-            api_key=os.getenv("CHROMA_API_KEY"),
-            tenant=os.getenv("CHROMA_TENANT"),
-            database=os.getenv("CHROMA_DATABASE")
-        )
+		if VECTOR_STORE == "local":
+			_client = chromadb.PersistentClient(path=CHROMA_PATH)
+		else:
+			_client = chromadb.CloudClient(
+				api_key=os.getenv("CHROMA_API_KEY"),
+				tenant=os.getenv("CHROMA_TENANT"),
+				database=os.getenv("CHROMA_DATABASE")
+			)
 	return _client
 
-def get_chroma_collection(client: ClientAPI = Depends(get_chroma_client)) -> Collection:
+def get_embedding_function() -> NVIDIAEmbeddingFunction:
+	"""
+	Shared passage embedder. The ingestion pipeline calls it directly so it can
+	embed batches concurrently and hand the vectors to a single bulk `add`.
+	"""
+	global _embedding_function
+	if _embedding_function is None:
+		_embedding_function = NVIDIAEmbeddingFunction()
+	return _embedding_function
+
+def get_query_embedding_function() -> NVIDIAEmbeddingFunction:
+	"""
+	Query-mode embedder for user questions. The collection's own embedding
+	function is passage-mode, so retrieval embeds queries here and passes
+	`query_embeddings` to Chroma.
+	"""
+	global _query_embedding_function
+	if _query_embedding_function is None:
+		_query_embedding_function = NVIDIAEmbeddingFunction(input_type="query")
+	return _query_embedding_function
+
+def get_chroma_collection() -> Collection:
+	"""
+	The user_files collection of the configured VECTOR_STORE. Every backend
+	answers the same add/update/get/query/delete calls.
+	"""
 	global _collection
 	if _collection is None:
+		if VECTOR_STORE not in VECTOR_STORES:
+			raise ValueError(f"Unknown VECTOR_STORE {VECTOR_STORE!r}; expected one of {VECTOR_STORES}")
 
-		embedding_function = NVIDIAEmbeddingFunction()
-		_collection = client.get_or_create_collection(
-		    name="user_files",
-		    embedding_function=embedding_function
-		)
+		embedding_function = get_embedding_function()
+		if VECTOR_STORE == "memory":
+			_collection = NumpyCollection(COLLECTION_NAME, embedding_function=embedding_function, path=VECTOR_STORE_PATH)
+		else:
+			_collection = get_chroma_client().get_or_create_collection(
+			    name=COLLECTION_NAME,
+			    embedding_function=embedding_function
+			)
 	return _collection
+
+def get_summary_collection() -> Collection:
+	"""
+	One summary per uploaded file (see summaries.py), in the same VECTOR_STORE
+	as the chunks but a collection of its own, so chunk searches never see them.
+	"""
+	global _summary_collection
+	if _summary_collection is None:
+		if VECTOR_STORE not in VECTOR_STORES:
+			raise ValueError(f"Unknown VECTOR_STORE {VECTOR_STORE!r}; expected one of {VECTOR_STORES}")
+
+		embedding_function = get_embedding_function()
+		if VECTOR_STORE == "memory":
+			path = os.path.join(VECTOR_STORE_PATH, "summaries") if VECTOR_STORE_PATH else None
+			_summary_collection = NumpyCollection(SUMMARY_COLLECTION_NAME, embedding_function=embedding_function, path=path)
+		else:
+			_summary_collection = get_chroma_client().get_or_create_collection(
+			    name=SUMMARY_COLLECTION_NAME,
+			    embedding_function=embedding_function
+			)
+	return _summary_collection
+
+def close_vector_store() -> None:
+	"""Save the in-process stores, if they are the ones in use and have a path."""
+	for collection in (_collection, _summary_collection):
+		if isinstance(collection, NumpyCollection):
+			collection.save()
@@ -0,0 +1,93 @@
+"""
+Which chunk ids are stored for each (user, chat).
+
+Ingestion records every chunk it adds and removes the ones it deletes, so
+deleting a chat or purging a user can go straight to `delete(ids=...)` in
+batches instead of first asking Chroma to list them. Chunks stored before the
+manifest existed aren't in it; deletions sweep for those afterwards.
+"""
+from typing import Iterable, List, Optional, Sequence
+
+from sqlalchemy import Column, Index, String, delete, func, insert, select
+
+from database import Base, SessionLocal
+from ingestion import batched
+
+# Rows per INSERT/DELETE statement.
+WRITE_BATCH = 500
+
+
+class ChunkManifestEntry(Base):
+    __tablename__ = "chunk_manifest"
+    __table_args__ = (Index("ix_chunk_manifest_user_chat", "user_id", "chat_id"),)
+
+    chunk_id = Column(String, primary_key=True)
+    user_id = Column(String, nullable=False)
+    chat_id = Column(String, nullable=False)
+    job_id = Column(String, index=True)
+
+
+def record(user_id, chat_id: str, job_id: Optional[str], chunk_ids: Sequence[str]) -> None:
+    db = SessionLocal()
+    try:
+        for ids in batched(chunk_ids, WRITE_BATCH):
+            # Replace rows a previous, partly failed run may have left.
+            db.execute(delete(ChunkManifestEntry).where(ChunkManifestEntry.chunk_id.in_(ids)))
+            db.execute(insert(ChunkManifestEntry), [
+                {"chunk_id": id_, "user_id": str(user_id), "chat_id": chat_id, "job_id": job_id} for id_ in ids
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def forget(chunk_ids: Iterable[str]) -> None:
+    db = SessionLocal()
+    try:
+        for ids in batched(chunk_ids, WRITE_BATCH):
+            db.execute(delete(ChunkManifestEntry).where(ChunkManifestEntry.chunk_id.in_(ids)))
+        db.commit()
+    finally:
+        db.close()
+
+
+def forget_job(job_id: str) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(delete(ChunkManifestEntry).where(ChunkManifestEntry.job_id == job_id))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _scope(statement, user_id, chat_id: Optional[str]):
+    statement = statement.where(ChunkManifestEntry.user_id == str(user_id))
+    if chat_id is not None:
+        statement = statement.where(ChunkManifestEntry.chat_id == chat_id)
+    return statement
+
+
+def count(user_id, chat_id: Optional[str] = None) -> int:
+    db = SessionLocal()
+    try:
+        return db.execute(_scope(select(func.count()).select_from(ChunkManifestEntry), user_id, chat_id)).scalar_one()
+    finally:
+        db.close()
+
+
+def chunk_ids(user_id, chat_id: Optional[str] = None, page_size: int = 1000) -> Iterable[List[str]]:
+    """Pages of the chunk ids stored for the chat, or for all the user's chats with `chat_id=None`."""
+    after = ""
+    while True:
+        db = SessionLocal()
+        try:
+            statement = _scope(select(ChunkManifestEntry.chunk_id), user_id, chat_id)
+            page = list(db.execute(
+                statement.where(ChunkManifestEntry.chunk_id > after).order_by(ChunkManifestEntry.chunk_id).limit(page_size)
+            ).scalars())
+        finally:
+            db.close()
+        if not page:
+            return
+        yield page
+        after = page[-1]
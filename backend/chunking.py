@@ -0,0 +1,282 @@
+"""
+Incremental tokenization and chunking of extracted text.
+
+Three strategies:
+
+- fixed: windows of CHUNK_SIZE tokens, each overlapping the previous one by
+  CHUNK_OVERLAP tokens, running across page boundaries.
+- sentence: whole sentences packed up to CHUNK_SIZE tokens, ending a chunk
+  early at a paragraph break once it is at least half full; the last
+  sentences of a chunk (up to CHUNK_OVERLAP tokens) open the next one.
+- page: like sentence, but a chunk never spans two pages, so every chunk can
+  be cited by page.
+
+Chunk text is always a slice of the extracted text cut at token boundaries
+mapped back to character offsets, so a multi-byte character is never split.
+Segments are tokenized CHUNK_ENCODE_BATCH at a time with encode_ordinary_batch.
+"""
+import os
+import re
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, NamedTuple, Tuple
+
+import tiktoken
+
+from parsing import Segment
+
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "400"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+# fixed, sentence, page, or auto: page for PDFs and sentence for everything else.
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "auto")
+CHUNK_ENCODE_BATCH = int(os.getenv("CHUNK_ENCODE_BATCH", "16"))
+
+STRATEGIES = ("fixed", "sentence", "page")
+
+# A unit ends after a blank line (paragraph) or after sentence punctuation and
+# any closing quotes/brackets, including the whitespace that follows.
+_UNIT_END = re.compile(r"\n[ \t]*\n\s*|[.!?][\"')\]]*\s+")
+
+_encoding: tiktoken.Encoding | None = None
+
+
+class TextChunk(NamedTuple):
+    text: str
+    # Character offsets into the document's extracted text.
+    start: int
+    end: int
+    # Segment (page) numbers of the first and last character.
+    page_start: int
+    page_end: int
+    tokens: int
+
+
+class _Unit(NamedTuple):
+    text: str
+    start: int
+    page: int
+    tokens: List[int]
+    paragraph_end: bool
+    # A sentence carried over a page break: where in `text` the next page starts, and its number.
+    split: int
+    end_page: int
+
+    def page_at(self, offset: int) -> int:
+        return self.page if offset < self.split else self.end_page
+
+
+def get_encoding() -> tiktoken.Encoding:
+    """The cl100k_base encoder, loaded once per process."""
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def resolve_strategy(strategy: str | None, content_type: str | None) -> str:
+    strategy = strategy or CHUNK_STRATEGY
+    if strategy == "auto":
+        return "page" if content_type == "application/pdf" else "sentence"
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown chunking strategy {strategy!r}; expected one of {STRATEGIES} or 'auto'")
+    return strategy
+
+
+def _batches(segments: Iterable[Segment], size: int) -> Iterator[List[Segment]]:
+    batch: List[Segment] = []
+    for segment in segments:
+        batch.append(segment)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _windows(encoding, text: str, tokens: List[int], size: int, overlap: int) -> Iterator[Tuple[int, int, int]]:
+    """(char start, char end, token count) of overlapping token windows over `text`."""
+    _, offsets = encoding.decode_with_offsets(tokens)
+    step = max(1, size - overlap)
+    i = 0
+    while i < len(tokens):
+        j = min(i + size, len(tokens))
+        yield offsets[i], offsets[j] if j < len(tokens) else len(text), j - i
+        if j == len(tokens):
+            break
+        i += step
+
+
+def _fixed_chunks(segments: Iterable[Segment], size: int, overlap: int, batch_size: int) -> Iterator[TextChunk]:
+    encoding = get_encoding()
+    step = max(1, size - overlap)
+    # Pending text starting at document offset `base`, its tokens and each
+    # token's character offset into `text`, and where each segment starts.
+    text, base = "", 0
+    tokens: List[int] = []
+    offsets: List[int] = []
+    seg_starts: List[int] = []
+    seg_pages: List[int] = []
+    emitted = False
+
+    def page_at(offset: int) -> int:
+        return seg_pages[max(0, bisect_right(seg_starts, offset) - 1)]
+
+    def chunk(i: int, j: int) -> TextChunk:
+        start = offsets[i]
+        end = offsets[j] if j < len(tokens) else len(text)
+        return TextChunk(text[start:end], base + start, base + end, page_at(start), page_at(max(start, end - 1)), j - i)
+
+    for batch in _batches(segments, batch_size):
+        encoded = encoding.encode_ordinary_batch([t for _, t in batch])
+        for (page, segment_text), segment_tokens in zip(batch, encoded):
+            if not segment_text:
+                continue
+            _, segment_offsets = encoding.decode_with_offsets(segment_tokens)
+            seg_starts.append(len(text))
+            seg_pages.append(page)
+            offsets.extend(len(text) + o for o in segment_offsets)
+            tokens.extend(segment_tokens)
+            text += segment_text
+
+        i = 0
+        while len(tokens) - i >= size:
+            yield chunk(i, i + size)
+            emitted = True
+            i += step
+        if i >= len(tokens):
+            # Every token was sent (no overlap, and the windows ended on the last one).
+            text, base = "", base + len(text)
+            tokens, offsets, seg_starts, seg_pages = [], [], [], []
+        elif i:
+            # Drop what no later window can reach.
+            cut = offsets[i]
+            text, base = text[cut:], base + cut
+            del tokens[:i]
+            offsets = [o - cut for o in offsets[i:]]
+            keep = max(0, bisect_right(seg_starts, cut) - 1)
+            seg_starts = [max(0, s - cut) for s in seg_starts[keep:]]
+            seg_pages = seg_pages[keep:]
+
+    # The tail, unless it is only the overlap already sent with the last window.
+    if tokens and (len(tokens) > overlap or not emitted):
+        yield chunk(0, len(tokens))
+
+
+def _split_units(text: str) -> Tuple[List[Tuple[int, int, bool]], int]:
+    """
+    (start, end, ends a paragraph) of each complete sentence in `text`, and the
+    offset where the unterminated rest of the text begins.
+    """
+    units = []
+    start = 0
+    for match in _UNIT_END.finditer(text):
+        units.append((start, match.end(), match.group().startswith("\n")))
+        start = match.end()
+    return units, start
+
+
+def _sentence_chunks(segments: Iterable[Segment], size: int, overlap: int, batch_size: int, per_page: bool) -> Iterator[TextChunk]:
+    encoding = get_encoding()
+    # Longest unterminated sentence carried over into the next page.
+    carry_limit = size * 8
+    current: List[_Unit] = []
+    current_tokens = 0
+    fresh = 0  # units in `current` not yet sent as part of a chunk
+
+    def emit(keep_overlap: bool) -> Iterator[TextChunk]:
+        nonlocal current, current_tokens, fresh
+        if fresh:
+            first, last = current[0], current[-1]
+            yield TextChunk(
+                "".join(u.text for u in current), first.start, last.start + len(last.text),
+                first.page, last.end_page, current_tokens,
+            )
+        tail: List[_Unit] = []
+        if keep_overlap:
+            tail_tokens = 0
+            for unit in reversed(current):
+                if tail_tokens + len(unit.tokens) > overlap:
+                    break
+                tail.insert(0, unit)
+                tail_tokens += len(unit.tokens)
+        current = tail
+        current_tokens = sum(len(u.tokens) for u in tail)
+        fresh = 0
+
+    def add(unit: _Unit) -> Iterator[TextChunk]:
+        nonlocal current_tokens, fresh
+        if len(unit.tokens) > size:
+            # A single sentence too long for a chunk gets token windows of its own.
+            yield from emit(keep_overlap=False)
+            for start, end, count in _windows(encoding, unit.text, unit.tokens, size, overlap):
+                yield TextChunk(unit.text[start:end], unit.start + start, unit.start + end, unit.page_at(start), unit.page_at(max(start, end - 1)), count)
+            return
+        if current_tokens + len(unit.tokens) > size:
+            yield from emit(keep_overlap=True)
+            if current_tokens + len(unit.tokens) > size:
+                yield from emit(keep_overlap=False)
+        current.append(unit)
+        current_tokens += len(unit.tokens)
+        fresh += 1
+        if unit.paragraph_end and current_tokens >= size // 2:
+            yield from emit(keep_overlap=False)
+
+    offset = 0
+    carry: Tuple[str, int, int, int, int] | None = None  # text, document offset, page, split, end page
+    for batch in _batches(segments, batch_size):
+        pieces: List[Tuple[str, int, int, bool, int, int, bool]] = []
+        for page, text in batch:
+            text_start = offset
+            offset += len(text)
+            # Units starting before `carried` began on the previous page.
+            carried, carry_page = 0, page
+            if carry is not None:
+                carried, carry_page = len(carry[0]), carry[2]
+                text, text_start = carry[0] + text, carry[1]
+                carry = None
+            units, rest = _split_units(text)
+            if rest < len(text):
+                if not per_page and len(text) - rest <= carry_limit:
+                    # The sentence continues on the next page.
+                    carry = (text[rest:], text_start + rest, carry_page if rest < carried else page, max(0, carried - rest), page)
+                else:
+                    units.append((rest, len(text), False))
+            for k, (start, end, paragraph_end) in enumerate(units):
+                if start < carried:
+                    unit_page, split = carry_page, carried - start
+                else:
+                    unit_page, split = page, end - start
+                pieces.append((text[start:end], text_start + start, unit_page, paragraph_end, split, page, k == len(units) - 1))
+        encoded = encoding.encode_ordinary_batch([p[0] for p in pieces])
+        for (text, start, page, paragraph_end, split, end_page, page_end), tokens in zip(pieces, encoded):
+            yield from add(_Unit(text, start, page, tokens, paragraph_end, split, end_page))
+            if per_page and page_end:
+                yield from emit(keep_overlap=False)
+
+    if carry is not None:
+        text, start, page, split, end_page = carry
+        yield from add(_Unit(text, start, page, encoding.encode_ordinary(text), False, split or len(text), end_page))
+    yield from emit(keep_overlap=False)
+
+
+def chunk_document(
+    segments: Iterable[Segment],
+    strategy: str = "sentence",
+    chunk_size: int | None = None,
+    overlap: int | None = None,
+    batch_size: int | None = None,
+) -> Iterator[TextChunk]:
+    """
+    Turn a stream of (page, text) segments into chunks of at most `chunk_size` tokens.
+
+    Segments are consumed as they arrive and only the text not yet chunked is
+    kept, so the whole document is never held as one string or token list.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    overlap = CHUNK_OVERLAP if overlap is None else overlap
+    overlap = max(0, min(overlap, chunk_size - 1))
+    batch_size = batch_size or CHUNK_ENCODE_BATCH
+    if strategy == "fixed":
+        return _fixed_chunks(segments, chunk_size, overlap, batch_size)
+    if strategy in ("sentence", "page"):
+        return _sentence_chunks(segments, chunk_size, overlap, batch_size, per_page=strategy == "page")
+    raise ValueError(f"Unknown chunking strategy {strategy!r}; expected one of {STRATEGIES}")
@@ -0,0 +1,131 @@
+"""
+Prompt context assembly for RAG answers.
+
+Retrieved chunks are deduplicated (exact and near-identical copies, e.g. the
+same file uploaded twice), taken in relevance order until the model's token
+budget is spent, then grouped under one header per file with neighbouring
+chunks of the same file merged back into continuous text.
+"""
+import os
+from typing import Any, Dict, List, Set, Tuple
+
+from chunking import get_encoding
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Per-model overrides: CONTEXT_TOKEN_BUDGETS="meta/llama-3.1-405b-instruct=6000,...".
+CONTEXT_TOKEN_BUDGETS = os.getenv("CONTEXT_TOKEN_BUDGETS", "")
+# Token-trigram Jaccard similarity above which a chunk counts as a duplicate.
+CONTEXT_DEDUPE_SIMILARITY = float(os.getenv("CONTEXT_DEDUPE_SIMILARITY", "0.9"))
+
+SHINGLE_SIZE = 3
+
+
+def token_budget(model_id: str) -> int:
+    for item in CONTEXT_TOKEN_BUDGETS.split(","):
+        name, _, size = item.strip().rpartition("=")
+        if name == model_id and size.isdigit():
+            return int(size)
+    return CONTEXT_TOKEN_BUDGET
+
+
+def _shingles(tokens: List[int]) -> Set[Tuple[int, ...]]:
+    if len(tokens) < SHINGLE_SIZE:
+        return {tuple(tokens)}
+    return {tuple(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def _jaccard(a: Set, b: Set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def build_context(results: Dict[str, Any], model_id: str, budget: int | None = None) -> Tuple[str, Dict[str, int]]:
+    """
+    Build the prompt context from a Chroma query result.
+
+    Returns the context text and a report comparing its size with the old
+    approach of listing every filename and then every chunk verbatim.
+    """
+    budget = budget or token_budget(model_id)
+    encoding = get_encoding()
+    documents = [doc for docs in results.get("documents") or [] for doc in docs]
+    metadatas = [meta for metas in results.get("metadatas") or [] for meta in metas]
+
+    naive_tokens = 0
+    accepted: List[Dict[str, Any]] = []
+    seen_shingles: List[Set] = []
+    seen_keys: Set[Tuple[str, Any]] = set()
+    headers: Set[str] = set()
+    used = 0
+    duplicates = 0
+    for rank, document in enumerate(documents):
+        meta = metadatas[rank] if rank < len(metadatas) and isinstance(metadatas[rank], dict) else {}
+        filename = meta.get("filename", "")
+        tokens = encoding.encode_ordinary(document or "")
+        naive_tokens += len(tokens) + len(encoding.encode_ordinary(filename)) + 2
+
+        # Several queries can return the same chunk; then check for near-copies.
+        key = (filename, meta.get("chunk_number", rank))
+        shingles = _shingles(tokens)
+        if key in seen_keys or any(_jaccard(shingles, s) >= CONTEXT_DEDUPE_SIMILARITY for s in seen_shingles):
+            duplicates += 1
+            continue
+        seen_keys.add(key)
+        seen_shingles.append(shingles)
+
+        header_cost = 0 if filename in headers else len(encoding.encode_ordinary(filename)) + 3
+        cost = len(tokens) + 2 + header_cost
+        if used + cost > budget:
+            if accepted:
+                continue
+            # Nothing fits yet: keep the top chunk, cut down to the budget.
+            tokens = tokens[:max(0, budget - 2 - header_cost)]
+            document = encoding.decode(tokens)
+            cost = len(tokens) + 2 + header_cost
+            meta = {**meta, "char_end": None}
+        headers.add(filename)
+        used += cost
+        accepted.append({
+            "rank": rank, "filename": filename, "chunk_number": meta.get("chunk_number"), "text": document,
+            "start": meta.get("char_start"), "end": meta.get("char_end"),
+        })
+
+    # One section per file, files in order of their best hit, chunks in document order.
+    files: Dict[str, List[Dict[str, Any]]] = {}
+    for chunk in accepted:
+        files.setdefault(chunk["filename"], []).append(chunk)
+    sections = []
+    merged = 0
+    for filename, chunks in files.items():
+        chunks.sort(key=lambda c: (c["chunk_number"] is None, c["chunk_number"] if c["chunk_number"] is not None else c["rank"]))
+        passages: List[str] = []
+        previous = None
+        for chunk in chunks:
+            number = chunk["chunk_number"]
+            if passages and previous is not None and number == previous["chunk_number"] + 1:
+                # Neighbouring chunks share their overlap, if any; their offsets
+                # say how much of the next one is already in the passage.
+                text = chunk["text"]
+                if chunk["start"] is not None and previous["end"] is not None:
+                    text = text[max(0, previous["end"] - chunk["start"]):]
+                passages[-1] += text
+                merged += 1
+            else:
+                passages.append(chunk["text"])
+            previous = chunk if number is not None else None
+        header = f"### {filename}\n" if filename else ""
+        sections.append(header + "\n\n".join(passages))
+
+    context = "\n\n".join(sections)
+    context_tokens = len(encoding.encode_ordinary(context))
+    return context, {
+        "chunks_retrieved": len(documents),
+        "chunks_used": len(accepted),
+        "duplicates": duplicates,
+        "merged": merged,
+        "budget": budget,
+        "context_tokens": context_tokens,
+        "naive_tokens": naive_tokens,
+        "saved_tokens": naive_tokens - context_tokens,
+    }
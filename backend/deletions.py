@@ -0,0 +1,211 @@
+"""
+Background deletion of a chat's, or a whole user's, stored chunks.
+
+`/delete_chat/` and `/logout/?purge=true` record a `DeletionJob` row and return
+its id straight away; `/deletions/{deletion_id}` reports progress. The worker
+takes the chunk ids from the manifest (see chunk_manifest.py), deletes them in
+DELETE_BATCH_SIZE batches with up to DELETE_CONCURRENCY `delete(ids=...)` calls
+in flight, then sweeps with `get(where=..., include=[])` for chunks the
+manifest doesn't know about. Deleting is idempotent, so deletions interrupted
+by a restart are simply run again.
+"""
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import Column, DateTime, Integer, String, Text
+
+import chunk_manifest
+import jobs
+import lexical
+import summaries
+from database import Base, SessionLocal
+from ingestion import batched
+from parse_cache import get_parse_cache
+from response_cache import get_response_cache
+from retrieval import chat_filter
+
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "500"))
+DELETE_CONCURRENCY = int(os.getenv("DELETE_CONCURRENCY", "4"))
+DELETE_JOB_WORKERS = int(os.getenv("DELETE_JOB_WORKERS", "2"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionJob(Base):
+    __tablename__ = "deletion_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(Integer, index=True)
+    # None when all of the user's chats are being deleted.
+    chat_id = Column(String, nullable=True)
+    status = Column(String, default="queued")
+    chunks_total = Column(Integer, default=0)
+    chunks_deleted = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DELETE_JOB_WORKERS, thread_name_prefix="delete")
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _update_job(job_id: str, **fields: Any) -> None:
+    db = SessionLocal()
+    try:
+        db.query(DeletionJob).filter(DeletionJob.id == job_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _forget(user_id: int, chat_id: Optional[str]) -> None:
+    """Stop answering from the deleted chunks: drop cached answers and keyword indexes."""
+    if chat_id is None:
+        get_response_cache().invalidate(user_id)
+    else:
+        get_response_cache().invalidate(user_id, chat_id)
+    lexical.drop(user_id, chat_id)
+
+
+def start_deletion(collection, user_id: int, chat_id: Optional[str] = None) -> str:
+    """Queue deletion of the chat's chunks (or all of the user's with `chat_id=None`); returns the job id."""
+    job_id = uuid.uuid4().hex
+    db = SessionLocal()
+    try:
+        db.add(DeletionJob(id=job_id, user_id=user_id, chat_id=chat_id, status="queued"))
+        db.commit()
+    finally:
+        db.close()
+    jobs.cancel_chat_jobs(user_id, chat_id)
+    _forget(user_id, chat_id)
+    get_executor().submit(_run_job, job_id, collection, user_id, chat_id)
+    return job_id
+
+
+def _delete_batch(collection, ids: List[str]) -> int:
+    collection.delete(ids=ids)
+    chunk_manifest.forget(ids)
+    return len(ids)
+
+
+def delete_ids(collection, pages: Iterable[List[str]], on_progress: Optional[Callable[[int], None]] = None) -> int:
+    """Delete every id in `pages`, DELETE_CONCURRENCY batches at a time; returns how many."""
+    deleted = 0
+    executor = ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY)
+    pending = set()
+
+    def collect(done) -> None:
+        nonlocal deleted
+        for future in done:
+            deleted += future.result()
+        if on_progress and done:
+            on_progress(deleted)
+
+    try:
+        for page in pages:
+            for ids in batched(page, DELETE_BATCH_SIZE):
+                if len(pending) >= DELETE_CONCURRENCY:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(_delete_batch, collection, ids))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return deleted
+
+
+def _sweep(collection, where: Dict[str, Any], on_progress: Callable[[int], None]) -> int:
+    """Delete whatever still matches `where`, one page at a time; returns how many."""
+    deleted = 0
+    previous = None
+    while True:
+        ids = collection.get(where=where, include=[], limit=DELETE_BATCH_SIZE * DELETE_CONCURRENCY)["ids"]
+        if not ids:
+            return deleted
+        if ids == previous:
+            raise RuntimeError("Chunks are still listed after being deleted")
+        previous = ids
+        # The whole page is gone before the next one is read.
+        deleted += delete_ids(collection, [ids], lambda count: on_progress(deleted + count))
+
+
+def _run_job(job_id: str, collection, user_id: int, chat_id: Optional[str]) -> None:
+    try:
+        _update_job(job_id, status="running", started_at=datetime.utcnow(), chunks_total=chunk_manifest.count(user_id, chat_id))
+        # Gone first, so overview questions stop being answered from the deleted files.
+        summaries.delete_summaries(user_id, chat_id)
+        parse_cache = get_parse_cache()
+        if parse_cache is not None:
+            # Another chat's upload of the same file just gets extracted again.
+            parse_cache.forget(jobs.file_hashes(user_id, chat_id))
+        last_update = time.monotonic()
+        deleted = 0
+
+        def on_progress(count: int) -> None:
+            nonlocal last_update
+            if time.monotonic() - last_update >= jobs.PROGRESS_INTERVAL:
+                _update_job(job_id, chunks_deleted=deleted + count)
+                last_update = time.monotonic()
+
+        deleted = delete_ids(collection, chunk_manifest.chunk_ids(user_id, chat_id), on_progress)
+        where = chat_filter(user_id, chat_id) if chat_id is not None else {"user_id": str(user_id)}
+        deleted += _sweep(collection, where, on_progress)
+        _update_job(job_id, status="completed", chunks_total=deleted, chunks_deleted=deleted, finished_at=datetime.utcnow())
+    except Exception as e:
+        logger.exception("Deletion job %s failed: %s", job_id, e)
+        _update_job(job_id, status="failed", error=str(e), finished_at=datetime.utcnow())
+    finally:
+        # An answer cached while the deletion ran may quote deleted chunks.
+        _forget(user_id, chat_id)
+
+
+def resume_interrupted_deletions(get_collection: Callable[[], Any]) -> None:
+    """Re-run deletions a previous process didn't finish."""
+    db = SessionLocal()
+    try:
+        interrupted = db.query(DeletionJob).filter(DeletionJob.status.in_(ACTIVE_STATUSES)).all()
+    finally:
+        db.close()
+    if not interrupted:
+        return
+    collection = get_collection()
+    for job in interrupted:
+        _update_job(job.id, status="queued")
+        get_executor().submit(_run_job, job.id, collection, job.user_id, job.chat_id)
+
+
+def deletion_status(job: DeletionJob) -> Dict[str, Any]:
+    return {
+        "deletion_id": job.id,
+        "chat_id": job.chat_id,
+        "status": job.status,
+        "chunks_total": job.chunks_total,
+        "chunks_deleted": job.chunks_deleted,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
@@ -0,0 +1,166 @@
+"""
+Content-addressed embedding cache.
+
+Vectors are keyed by sha256(model, input_type, text), so the same chunk
+uploaded twice, or the same question asked twice, is only sent to the
+embedding endpoint once. There are two tiers: an in-process LRU and an
+on-disk SQLite table that survives restarts and is trimmed by total size,
+least recently used first.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "20000"))
+# Set to an empty string to disable the disk tier.
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_DISK_MB = float(os.getenv("EMBEDDING_CACHE_DISK_MB", "512"))
+
+Vector = List[float]
+
+
+def _pack(vector: Iterable[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> Vector:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    def __init__(self, path: Optional[str], memory_items: int, disk_bytes: int):
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        self._memory: "OrderedDict[str, Vector]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions_disk = 0
+
+        self._db = None
+        self._disk_used = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._db.commit()
+            self._disk_used = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, input_type: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{input_type}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Vector]:
+        found: Dict[str, Vector] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.hits_memory += len(found)
+
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            if missing and self._db is not None:
+                now = time.time()
+                # SQLite caps bound parameters per statement, so look up in slices.
+                for i in range(0, len(missing), 500):
+                    part = missing[i:i + 500]
+                    placeholders = ",".join("?" * len(part))
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                    ).fetchall()
+                    for key, blob in rows:
+                        found[key] = _unpack(blob)
+                        self._remember(key, found[key])
+                    self.hits_disk += len(rows)
+                    if rows:
+                        self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key, _ in rows])
+                self._db.commit()
+
+            self.misses += sum(1 for key in missing if key not in found)
+        return found
+
+    def put_many(self, items: List[Tuple[str, Vector]]) -> None:
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+            if self._db is None or not items:
+                return
+            now = time.time()
+            for key, vector in items:
+                blob = _pack(vector)
+                # Keys are content hashes, so an existing row already holds this vector.
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+                    (key, blob, len(blob), now),
+                )
+                if cursor.rowcount:
+                    self._disk_used += len(blob)
+            if self._disk_used > self.disk_bytes:
+                self._evict_disk()
+            self._db.commit()
+
+    def _remember(self, key: str, vector: Vector) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self) -> None:
+        # Trim to 90% so we don't evict again on the very next insert.
+        target = int(self.disk_bytes * 0.9)
+        while self._disk_used > target:
+            rows = self._db.execute("SELECT key, size FROM embeddings ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                self._disk_used = 0
+                return
+            victims = []
+            for key, size in rows:
+                victims.append((key,))
+                self._disk_used -= size
+                if self._disk_used <= target:
+                    break
+            self._db.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+            self.evictions_disk += len(victims)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": round((self.hits_memory + self.hits_disk) / lookups, 4) if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_bytes": self._disk_used,
+                "evictions_disk": self.evictions_disk,
+            }
+
+
+_cache: EmbeddingCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(
+                EMBEDDING_CACHE_PATH or None,
+                EMBEDDING_CACHE_MEMORY_ITEMS,
+                int(EMBEDDING_CACHE_DISK_MB * 1024 * 1024),
+            )
+    return _cache
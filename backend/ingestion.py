@@ -0,0 +1,149 @@
+"""
+Batched ingestion pipeline for uploaded documents.
+
+Chunks are grouped into batches of `INGEST_BATCH_SIZE`. Each batch is embedded
+on a worker thread (at most `INGEST_MAX_IN_FLIGHT` embedding requests at a time)
+and written to Chroma with one bulk `add`, so a large upload costs
+len(chunks) / batch_size round-trips instead of one per chunk.
+
+With `reuse=True` chunk ids are expected to be deterministic: each batch first
+looks its ids up in Chroma, and only the chunks not stored yet are embedded and
+added. Chunks that already exist only get their metadata refreshed (e.g. a new
+chunk_number after an edit earlier in the document).
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import metrics
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_MAX_IN_FLIGHT = int(os.getenv("INGEST_MAX_IN_FLIGHT", "4"))
+
+# (id, document, metadata)
+Chunk = Tuple[str, str, Dict[str, Any]]
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Yield lists of up to `size` items without materializing the whole iterable."""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _split_existing(collection, batch: List[Chunk], preserve: Sequence[str]):
+    """
+    Split a batch into chunks that still need embedding and metadata updates for
+    the ones already stored. Keys in `preserve` keep their stored value.
+    """
+    found = collection.get(ids=[chunk[0] for chunk in batch], include=["metadatas"])
+    stored = dict(zip(found["ids"], found["metadatas"] or [{}] * len(found["ids"])))
+    new: List[Chunk] = []
+    updates: List[Tuple[str, Dict[str, Any]]] = []
+    for chunk in batch:
+        if chunk[0] not in stored:
+            new.append(chunk)
+            continue
+        old = stored[chunk[0]] or {}
+        metadata = {**chunk[2], **{key: old[key] for key in preserve if key in old}}
+        if metadata != old:
+            updates.append((chunk[0], metadata))
+    return new, updates
+
+
+def _embed_batch(collection, embed: Callable[[List[str]], Any], batch: List[Chunk], reuse: bool, preserve: Sequence[str]):
+    updates: List[Tuple[str, Dict[str, Any]]] = []
+    if reuse:
+        batch, updates = _split_existing(collection, batch, preserve)
+    ids = [chunk[0] for chunk in batch]
+    documents = [chunk[1] for chunk in batch]
+    metadatas = [chunk[2] for chunk in batch]
+    return ids, documents, metadatas, embed(documents) if documents else [], updates
+
+
+def ingest_chunks(
+    collection,
+    chunks: Iterable[Chunk],
+    embed: Callable[[List[str]], Any],
+    batch_size: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    on_batch: Optional[Callable[[int, int], None]] = None,
+    on_error: Optional[Callable[[int, Exception], None]] = None,
+    on_write: Optional[Callable[[List[str], List[str]], None]] = None,
+    reuse: bool = False,
+    preserve: Sequence[str] = (),
+    labels: Optional[Dict[str, Any]] = None,
+) -> Dict[str, int]:
+    """
+    Embed and store `chunks` in `collection`.
+
+    - chunks: iterable of (id, document, metadata); consumed lazily, one batch at a time
+    - embed: callable turning a list of documents into a list of vectors
+    - on_batch: optional callback invoked with (chunks embedded, chunks reused) for
+      every batch once it is written
+    - on_error: optional callback invoked with (batch size, exception) for a batch that
+      failed to embed or write; without it the first failure is raised
+    - on_write: optional callback invoked with the ids and documents of the chunks
+      each batch added
+    - reuse: skip embedding chunks whose id is already in the collection
+    - preserve: metadata keys a reused chunk keeps from its stored copy
+    - labels: user/chat labels for the upload_write span timing each batch's writes
+    Returns dict with keys: 'chunks' (embedded and written), 'reused', 'batches', 'failed'
+    """
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    max_in_flight = max_in_flight or INGEST_MAX_IN_FLIGHT
+
+    written = 0
+    reused = 0
+    batches = 0
+    failed = 0
+
+    def write(done) -> None:
+        nonlocal written, reused, batches, failed
+        for future in done:
+            size = sizes.pop(future)
+            try:
+                ids, documents, metadatas, embeddings, updates = future.result()
+                with metrics.span("upload_write", **(labels or {})):
+                    if ids:
+                        collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+                        if on_write:
+                            on_write(ids, documents)
+                    if updates:
+                        collection.update(ids=[u[0] for u in updates], metadatas=[u[1] for u in updates])
+            except Exception as e:
+                if on_error is None:
+                    raise
+                failed += size
+                on_error(size, e)
+                continue
+            written += len(ids)
+            reused += size - len(ids)
+            batches += 1
+            if on_batch:
+                on_batch(len(ids), size - len(ids))
+
+    # Writes happen on the calling thread while later batches are still being
+    # embedded, so embedding and storage overlap.
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    pending = set()
+    sizes = {}
+    try:
+        for batch in batched(chunks, batch_size):
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write(done)
+            future = executor.submit(_embed_batch, collection, embed, batch, reuse, preserve)
+            sizes[future] = len(batch)
+            pending.add(future)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            write(done)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return {"chunks": written, "reused": reused, "batches": batches, "failed": failed}
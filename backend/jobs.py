@@ -0,0 +1,460 @@
+"""
+Background ingestion jobs.
+
+`/uploadfile/` spools the upload to disk, records an `IngestionJob` row and
+returns its id straight away. Parsing, chunking and embedding run on a small
+worker pool, and progress is written back to the row so `/jobs/{job_id}` can
+report it. Every chunk a job writes carries its `job_id` in the metadata, which
+is what cancellation uses to remove them again.
+
+Chunk ids are derived from the user, chat, filename and a hash of the chunk
+text, so uploading the same file again embeds nothing, and re-uploading an
+edited version only embeds the chunks whose text changed. Chunks of the
+previous version that no longer occur are deleted once the job completes.
+The text extracted from a file is cached by its hash as well (see
+parse_cache.py), so an unchanged re-upload skips extraction too.
+
+A completed job also stores a summary of the file (see summaries.py).
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, String, Text
+
+from database import Base, SessionLocal
+from chunking import chunk_document, resolve_strategy
+import chunk_manifest
+import lexical
+import metrics
+import summaries
+from ingestion import batched, ingest_chunks
+from parsing import parse_document
+from response_cache import get_response_cache
+from retrieval import chat_filter
+
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+# Minimum seconds between page-progress writes, so a 300-page PDF doesn't cost 300 UPDATEs.
+PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", "0.5"))
+# Where uploads are spooled until their job picks them up (defaults to the system temp dir).
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR") or None
+SPOOL_BLOCK_SIZE = 1024 * 1024
+
+ACTIVE_STATUSES = ("queued", "running", "cancelling")
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(Integer, index=True)
+    chat_id = Column(String, index=True)
+    filename = Column(String)
+    # As sniffed from the file, not as the client declared it (see parsing.sniff_content_type).
+    content_type = Column(String)
+    # sha256 of the uploaded bytes.
+    file_hash = Column(String, nullable=True, index=True)
+    status = Column(String, default="queued")
+    # Pages for PDFs, TEXT_BLOCK_SIZE blocks (of the XML, for DOCX) for other uploads.
+    pages_total = Column(Integer, default=0)
+    pages_parsed = Column(Integer, default=0)
+    chunks_total = Column(Integer, default=0)
+    chunks_embedded = Column(Integer, default=0)
+    # Chunks already stored from an earlier upload of the file, and stale ones removed.
+    chunks_reused = Column(Integer, default=0)
+    chunks_deleted = Column(Integer, default=0)
+    failures = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    # Why the file's summary couldn't be stored; the file is then searched in full on every query.
+    summary_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+_executor: ThreadPoolExecutor | None = None
+_cancel_events: Dict[str, threading.Event] = {}
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=INGEST_JOB_WORKERS, thread_name_prefix="ingest")
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _update_job(job_id: str, **fields: Any) -> None:
+    db = SessionLocal()
+    try:
+        db.query(IngestionJob).filter(IngestionJob.id == job_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+
+def spool_upload(fileobj) -> Tuple[str, str]:
+    """
+    Copy an upload stream to a temp file, hashing it on the way; returns the
+    path and the sha256 hex digest. The job deletes the file when done.
+    """
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(delete=False, dir=INGEST_SPOOL_DIR, prefix="upload-") as tmp:
+        while True:
+            block = fileobj.read(SPOOL_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            tmp.write(block)
+    return tmp.name, digest.hexdigest()
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(user_id: int, chat_id: str, filename: str, chunk_hash: str, occurrence: int = 0) -> str:
+    """
+    Deterministic id of a chunk. `occurrence` tells apart identical chunks
+    within one file (repeated boilerplate, say).
+    """
+    key = f"{user_id}\0{chat_id}\0{filename}\0{chunk_hash}\0{occurrence}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def create_job(user_id: int, chat_id: str, filename: str, content_type: Optional[str], file_hash: Optional[str] = None) -> str:
+    job_id = uuid.uuid4().hex
+    db = SessionLocal()
+    try:
+        db.add(IngestionJob(
+            id=job_id, user_id=user_id, chat_id=chat_id, filename=filename, content_type=content_type,
+            file_hash=file_hash, status="queued",
+        ))
+        db.commit()
+    finally:
+        db.close()
+    return job_id
+
+
+def file_hashes(user_id: int, chat_id: Optional[str] = None) -> Set[str]:
+    """Hashes of the files uploaded to the chat, or by the user with `chat_id=None`."""
+    db = SessionLocal()
+    try:
+        query = db.query(IngestionJob.file_hash).filter(IngestionJob.user_id == user_id, IngestionJob.file_hash.isnot(None))
+        if chat_id is not None:
+            query = query.filter(IngestionJob.chat_id == chat_id)
+        return {file_hash for (file_hash,) in query}
+    finally:
+        db.close()
+
+
+def submit_job(job_id: str, path: str, collection, embed: Callable) -> None:
+    _cancel_events[job_id] = threading.Event()
+    get_executor().submit(_run_job, job_id, path, collection, embed)
+
+
+def _check_cancelled(job_id: str) -> None:
+    event = _cancel_events.get(job_id)
+    if event is not None and event.is_set():
+        raise JobCancelled()
+
+
+def _timed(iterable, seconds: Dict[str, float], key: str):
+    """Yield from `iterable`, adding the time spent producing each item to seconds[key]."""
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            seconds[key] += time.perf_counter() - started
+        yield item
+
+
+def _run_job(job_id: str, path: str, collection, embed: Callable) -> None:
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        user_id, chat_id, filename, content_type = job.user_id, job.chat_id, job.filename, job.content_type
+        file_hash = job.file_hash
+    finally:
+        db.close()
+
+    try:
+        _check_cancelled(job_id)
+        _update_job(job_id, status="running", started_at=datetime.utcnow())
+        labels = {"user": user_id, "chat": chat_id}
+
+        parse_started = time.perf_counter()
+        pages_total, segments = parse_document(path, content_type, file_hash)
+        opened = time.perf_counter() - parse_started
+        _update_job(job_id, pages_total=pages_total)
+        # Parsing and chunking are pulled lazily, interleaved with embedding, so
+        # their spans are the time spent producing pages and chunks, summed per job.
+        seconds = {"parse": 0.0, "chunk": 0.0}
+
+        def track_pages(segments):
+            last_update = time.monotonic()
+            for number, text in _timed(segments, seconds, "parse"):
+                _check_cancelled(job_id)
+                yield number, text
+                if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+                    _update_job(job_id, pages_parsed=number + 1)
+                    last_update = time.monotonic()
+            _update_job(job_id, pages_parsed=pages_total)
+
+        # Parsing, tokenization and embedding are all pulled lazily by
+        # ingest_chunks, so only the batches in flight are held in memory.
+        chunks_total = 0
+        # Ids of every chunk of this version of the file; anything else stored
+        # under its filename is stale once the job completes.
+        chunk_ids: Set[str] = set()
+        occurrences: Dict[str, int] = {}
+
+        strategy = resolve_strategy(None, content_type)
+        summary_source = summaries.SourceText()
+
+        def iter_chunks():
+            nonlocal chunks_total
+            for i, chunk in enumerate(_timed(chunk_document(track_pages(segments), strategy), seconds, "chunk")):
+                chunks_total = i + 1
+                summary_source.add(chunk)
+                digest = chunk_hash(chunk.text)
+                occurrence = occurrences.get(digest, 0)
+                occurrences[digest] = occurrence + 1
+                id_ = chunk_id(user_id, chat_id, filename, digest, occurrence)
+                chunk_ids.add(id_)
+                metadata = {
+                    "user_id": str(user_id), "chat_id": chat_id, "filename": filename, "chunk_number": i,
+                    "content_type": content_type, "job_id": job_id,
+                    # Offsets into the extracted text, so neighbouring chunks can be stitched back together.
+                    "char_start": chunk.start, "char_end": chunk.end,
+                }
+                if content_type == "application/pdf":
+                    # 1-based, as a reader would cite them.
+                    metadata["page_start"] = chunk.page_start + 1
+                    metadata["page_end"] = chunk.page_end + 1
+                if file_hash:
+                    metadata["file_hash"] = file_hash
+                yield id_, chunk.text, metadata
+
+        embedded = 0
+        reused = 0
+        failures = 0
+
+        def on_batch(written: int, existing: int) -> None:
+            nonlocal embedded, reused
+            embedded += written
+            reused += existing
+            if written:
+                # New chunks are searchable as soon as they're written.
+                get_response_cache().invalidate(user_id, chat_id)
+            _update_job(job_id, chunks_embedded=embedded, chunks_reused=reused, chunks_total=chunks_total)
+            _check_cancelled(job_id)
+
+        def on_error(size: int, e: Exception) -> None:
+            nonlocal failures
+            failures += size
+            logger.warning("Ingestion job %s: batch of %d chunks failed: %s", job_id, size, e)
+            _update_job(job_id, failures=failures, error=str(e))
+            _check_cancelled(job_id)
+
+        # Reused chunks keep the job_id they were written with until the job
+        # completes, so cancelling it midway only removes what it added itself.
+        written_ids: Set[str] = set()
+
+        def on_write(ids, documents) -> None:
+            written_ids.update(ids)
+            chunk_manifest.record(user_id, chat_id, job_id, ids)
+            lexical.add_chunks(user_id, chat_id, ids, documents)
+
+        def timed_embed(documents):
+            with metrics.span("upload_embed", **labels):
+                return embed(documents)
+
+        ingest_chunks(
+            collection, iter_chunks(), timed_embed,
+            on_batch=on_batch, on_error=on_error, on_write=on_write, reuse=True, preserve=("job_id",), labels=labels,
+        )
+        metrics.record_span("upload_parse", opened + seconds["parse"], **labels)
+        # Producing a chunk includes pulling pages from the parser.
+        metrics.record_span("upload_chunk", max(0.0, seconds["chunk"] - seconds["parse"]), **labels)
+        _check_cancelled(job_id)
+        try:
+            with metrics.span("upload_summary", **labels):
+                summaries.store_summary(
+                    user_id, chat_id, filename, summary_source, embed, job_id=job_id, file_hash=file_hash,
+                    content_type=content_type, chunks=chunks_total, pages=pages_total,
+                )
+        except Exception as e:
+            # Files without a summary are never left out of a search, so the job still completes.
+            logger.warning("Ingestion job %s: storing the summary of %s failed: %s", job_id, filename, e)
+            _update_job(job_id, summary_error=str(e))
+        _adopt_chunks(collection, user_id, chat_id, job_id, chunk_ids - written_ids)
+        deleted = 0
+        if not failures:
+            # With failed batches some of the old version may still be needed.
+            deleted = _delete_stale_chunks(collection, user_id, chat_id, filename, chunk_ids)
+            if deleted:
+                get_response_cache().invalidate(user_id, chat_id)
+        _update_job(job_id, status="completed", chunks_total=chunks_total, chunks_deleted=deleted, finished_at=datetime.utcnow())
+    except JobCancelled:
+        _delete_job_chunks(collection, job_id)
+        get_response_cache().invalidate(user_id, chat_id)
+        lexical.drop(user_id, chat_id)
+        _update_job(job_id, status="cancelled", finished_at=datetime.utcnow())
+    except Exception as e:
+        logger.exception("Ingestion job %s failed: %s", job_id, e)
+        _update_job(job_id, status="failed", error=str(e), finished_at=datetime.utcnow())
+    finally:
+        _cancel_events.pop(job_id, None)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _delete_job_chunks(collection, job_id: str) -> None:
+    collection.delete(where={"job_id": job_id})
+    chunk_manifest.forget_job(job_id)
+    summaries.forget_job(job_id)
+
+
+def _adopt_chunks(collection, user_id: int, chat_id: str, job_id: str, ids: Set[str]) -> None:
+    """
+    Stamp the chunks a completed job reused with its job_id, so cancelling the
+    job that first wrote them doesn't delete chunks this version still uses.
+    """
+    for batch in batched(sorted(ids), 500):
+        found = collection.get(ids=batch, include=["metadatas"])
+        stamped = [
+            id_ for id_, metadata in zip(found["ids"], found["metadatas"] or [{}] * len(found["ids"]))
+            if (metadata or {}).get("job_id") != job_id
+        ]
+        if stamped:
+            collection.update(ids=stamped, metadatas=[{"job_id": job_id}] * len(stamped))
+            chunk_manifest.record(user_id, chat_id, job_id, stamped)
+
+
+def _delete_stale_chunks(collection, user_id: int, chat_id: str, filename: str, keep: Set[str]) -> int:
+    """Delete chunks stored under `filename` in the chat that aren't in `keep`; returns how many."""
+    where = {"$and": chat_filter(user_id, chat_id)["$and"] + [{"filename": filename}]}
+    stale = [id_ for id_ in collection.get(where=where, include=[])["ids"] if id_ not in keep]
+    for ids in batched(stale, 500):
+        collection.delete(ids=ids)
+    chunk_manifest.forget(stale)
+    lexical.remove_chunks(user_id, chat_id, stale)
+    return len(stale)
+
+
+def _eta_seconds(job: IngestionJob) -> Optional[float]:
+    if job.status != "running" or job.started_at is None:
+        return None
+    elapsed = (datetime.utcnow() - job.started_at).total_seconds()
+    # Parsing and embedding are pipelined, so page progress tracks overall progress.
+    if not (job.pages_total and job.pages_parsed):
+        return None
+    done, total = job.pages_parsed, job.pages_total
+    return round(elapsed / done * max(total - done, 0), 1)
+
+
+def job_status(job: IngestionJob) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "pages_total": job.pages_total,
+        "pages_parsed": job.pages_parsed,
+        "chunks_total": job.chunks_total,
+        "chunks_embedded": job.chunks_embedded,
+        "chunks_reused": job.chunks_reused,
+        "chunks_deleted": job.chunks_deleted,
+        "failures": job.failures,
+        "error": job.error,
+        "summary_error": job.summary_error,
+        "eta_seconds": _eta_seconds(job),
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def cancel_job(job: IngestionJob, collection) -> str:
+    """
+    Cancel a job and remove whatever it already wrote.
+
+    A running job is only flagged here; its worker notices between batches,
+    deletes its chunks and marks the row cancelled. Jobs that already finished
+    are cleaned up right away.
+    """
+    event = _cancel_events.get(job.id)
+    if job.status in ("queued", "running") and event is not None:
+        event.set()
+        if job.status == "queued":
+            # The worker will skip it when it gets picked up.
+            _update_job(job.id, status="cancelled", finished_at=datetime.utcnow())
+            return "cancelled"
+        _update_job(job.id, status="cancelling")
+        return "cancelling"
+    if job.status in ACTIVE_STATUSES:
+        return job.status
+    if job.status != "cancelled":
+        _delete_job_chunks(collection, job.id)
+        get_response_cache().invalidate(job.user_id, job.chat_id)
+        lexical.drop(job.user_id, job.chat_id)
+        _update_job(job.id, status="cancelled", finished_at=datetime.utcnow())
+    return "cancelled"
+
+
+def cancel_chat_jobs(user_id: int, chat_id: Optional[str] = None) -> None:
+    """Stop the chat's (or all the user's) queued and running jobs, so nothing is written after a delete."""
+    db = SessionLocal()
+    try:
+        query = db.query(IngestionJob).filter(IngestionJob.user_id == user_id, IngestionJob.status.in_(("queued", "running")))
+        if chat_id is not None:
+            query = query.filter(IngestionJob.chat_id == chat_id)
+        active = query.all()
+    finally:
+        db.close()
+    for job in active:
+        event = _cancel_events.get(job.id)
+        if event is None:
+            continue
+        event.set()
+        if job.status == "queued":
+            _update_job(job.id, status="cancelled", finished_at=datetime.utcnow())
+        else:
+            _update_job(job.id, status="cancelling")
+
+
+def fail_interrupted_jobs() -> None:
+    """Jobs left active by a previous process will never finish; mark them failed."""
+    db = SessionLocal()
+    try:
+        db.query(IngestionJob).filter(IngestionJob.status.in_(ACTIVE_STATUSES)).update(
+            {"status": "failed", "error": "Interrupted by server restart", "finished_at": datetime.utcnow()},
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,216 @@
+"""
+BM25 keyword search over a chat's chunks.
+
+Dense retrieval blurs exact identifiers, codes and names; a per-(user, chat)
+inverted index catches them. Postings are kept as packed `array`s (chunk
+positions and term frequencies), so an index costs a few bytes per token
+occurrence rather than a Python object each. Removed chunks are tombstoned and
+the arrays are compacted once more than half the chunks are dead.
+
+Indexes live in this process only. A chat's index is built from the chunks
+stored in Chroma the first time it is searched, kept up to date by ingestion
+jobs afterwards, and dropped (to be rebuilt on demand) whenever chunks are
+deleted in bulk. At most LEXICAL_INDEX_MAX_CHATS indexes are kept, least
+recently used first out.
+"""
+import math
+import os
+import re
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+LEXICAL_INDEX_MAX_CHATS = int(os.getenv("LEXICAL_INDEX_MAX_CHATS", "256"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Words, numbers and identifiers such as "INV-2024-0042", "v2.3.1" or "user_id".
+_TOKEN = re.compile(r"\w+(?:[-./:]\w+)*")
+_PART = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; a compound identifier is indexed whole and by its parts."""
+    terms = []
+    for match in _TOKEN.finditer(text.lower()):
+        token = match.group()
+        terms.append(token)
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+class LexicalIndex:
+    def __init__(self):
+        self.ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._lengths = array("I")
+        self._alive = bytearray()
+        self._dead = 0
+        self._total_length = 0
+        # term -> (chunk positions, term frequencies)
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids) - self._dead
+
+    def add(self, ids: Sequence[str], documents: Sequence[str]) -> None:
+        """Index chunks; ids already in the index are skipped."""
+        with self._lock:
+            for id_, document in zip(ids, documents):
+                if id_ in self._positions:
+                    continue
+                position = len(self.ids)
+                terms = Counter(tokenize(document or ""))
+                self.ids.append(id_)
+                self._positions[id_] = position
+                length = sum(terms.values())
+                self._lengths.append(length)
+                self._alive.append(1)
+                self._total_length += length
+                for term, tf in terms.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("I"), array("H"))
+                    postings[0].append(position)
+                    postings[1].append(min(tf, 0xFFFF))
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for id_ in ids:
+                position = self._positions.pop(id_, None)
+                if position is None:
+                    continue
+                self._alive[position] = 0
+                self._total_length -= self._lengths[position]
+                self._dead += 1
+            if self._dead > len(self.ids) // 2:
+                self._compact()
+
+    def _compact(self) -> None:
+        keep = [p for p in range(len(self.ids)) if self._alive[p]]
+        remap = {old: new for new, old in enumerate(keep)}
+        self.ids = [self.ids[p] for p in keep]
+        self._positions = {id_: p for p, id_ in enumerate(self.ids)}
+        self._lengths = array("I", (self._lengths[p] for p in keep))
+        self._alive = bytearray(b"\x01" * len(keep))
+        self._dead = 0
+        postings = {}
+        for term, (positions, tfs) in self._postings.items():
+            live = [(remap[p], tf) for p, tf in zip(positions, tfs) if p in remap]
+            if live:
+                postings[term] = (array("I", (p for p, _ in live)), array("H", (tf for _, tf in live)))
+        self._postings = postings
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """The `k` best (id, BM25 score) matches for `query`, best first."""
+        with self._lock:
+            live = len(self)
+            if not live:
+                return []
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float64)
+            alive = np.frombuffer(bytes(self._alive), dtype=np.uint8).astype(bool)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (self._total_length / live or 1.0))
+            scores = np.zeros(len(self.ids))
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                positions = np.frombuffer(postings[0], dtype=np.uint32)
+                tfs = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float64)
+                mask = alive[positions]
+                df = int(mask.sum())
+                if not df:
+                    continue
+                positions, tfs = positions[mask], tfs[mask]
+                idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+                scores[positions] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[positions])
+            hits = np.flatnonzero(scores)
+            if len(hits) > k:
+                hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+            hits = hits[np.argsort(-scores[hits], kind="stable")]
+            return [(self.ids[p], float(scores[p])) for p in hits]
+
+
+_indexes: "OrderedDict[Tuple[str, str], LexicalIndex]" = OrderedDict()
+# A chat's build lock lives while its index is in memory or being built.
+_building: Dict[Tuple[str, str], threading.Lock] = {}
+_lock = threading.Lock()
+
+
+def _key(user_id, chat_id) -> Tuple[str, str]:
+    return str(user_id), str(chat_id)
+
+
+def _forget(key: Tuple[str, str]) -> None:
+    """Drop the chat's index and, unless a build holds it, its lock. Call with `_lock` held."""
+    _indexes.pop(key, None)
+    building = _building.get(key)
+    if building is not None and not building.locked():
+        del _building[key]
+
+
+def get_index(user_id, chat_id, load: Callable[[], Iterable[Tuple[List[str], List[str]]]]) -> LexicalIndex:
+    """
+    The chat's index, built from `load()` (batches of ids and documents) if it
+    isn't in memory yet.
+    """
+    key = _key(user_id, chat_id)
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+        building = _building.setdefault(key, threading.Lock())
+    # One build per chat at a time; ingestion adds wait for it (see add_chunks).
+    with building:
+        with _lock:
+            index = _indexes.get(key)
+        if index is None:
+            index = LexicalIndex()
+            try:
+                for ids, documents in load():
+                    index.add(ids, documents)
+            except BaseException:
+                with _lock:
+                    if key not in _indexes:
+                        _building.pop(key, None)
+                raise
+            with _lock:
+                _indexes[key] = index
+                while len(_indexes) > LEXICAL_INDEX_MAX_CHATS:
+                    _forget(next(iter(_indexes)))
+    return index
+
+
+def add_chunks(user_id, chat_id, ids: Sequence[str], documents: Sequence[str]) -> None:
+    """Index newly stored chunks, if the chat's index is in memory (otherwise its next build picks them up)."""
+    key = _key(user_id, chat_id)
+    with _lock:
+        building = _building.get(key)
+    if building is None:
+        return
+    with building:
+        with _lock:
+            index = _indexes.get(key)
+        if index is not None:
+            index.add(ids, documents)
+
+
+def remove_chunks(user_id, chat_id, ids: Iterable[str]) -> None:
+    with _lock:
+        index = _indexes.get(_key(user_id, chat_id))
+    if index is not None:
+        index.remove(ids)
+
+
+def drop(user_id, chat_id=None) -> None:
+    """Forget the chat's index, or all of the user's with `chat_id=None`; rebuilt on next search."""
+    with _lock:
+        for key in [k for k in _building if k[0] == str(user_id) and (chat_id is None or k[1] == str(chat_id))]:
+            _forget(key)
@@ -0,0 +1,150 @@
+"""
+Long-lived ChatNVIDIA clients, one per model id.
+
+Building a ChatNVIDIA runs pydantic validation and model resolution, and the
+client opens a fresh requests.Session (so a fresh TCP/TLS connection) for every
+call. The registry builds each client once and points it at a shared
+keep-alive session whose connection pool is sized per model.
+"""
+import contextvars
+import logging
+import os
+import threading
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from langchain_nvidia_ai_endpoints import ChatNVIDIA
+
+logger = logging.getLogger(__name__)
+
+# Connections kept alive per model; override individual models with
+# LLM_POOL_SIZES="meta/llama-3.1-405b-instruct=32,nvidia/llama3-chatqa-1.5-8b=16".
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+LLM_POOL_SIZES = os.getenv("LLM_POOL_SIZES", "")
+# Point the clients at a local NIM or an OpenAI-compatible stand-in instead of the hosted API.
+NVIDIA_BASE_URL = os.getenv("NVIDIA_BASE_URL") or None
+# Build the clients (and open one connection each) when the app starts.
+LLM_WARMUP = os.getenv("LLM_WARMUP", "true").lower() in ("1", "true", "yes")
+
+_clients: Dict[str, ChatNVIDIA] = {}
+_sessions: Dict[str, requests.Session] = {}
+_lock = threading.Lock()
+# Streaming HTTP responses opened on behalf of the current astream_text() call.
+# langchain runs the blocking stream in an executor with a copy of the caller's
+# context, so the session hook below sees the list set by the caller.
+_open_streams: contextvars.ContextVar[Optional[List[requests.Response]]] = contextvars.ContextVar("llm_open_streams", default=None)
+
+
+def pool_size(model_id: str) -> int:
+    for item in LLM_POOL_SIZES.split(","):
+        name, _, size = item.strip().rpartition("=")
+        if name == model_id and size.isdigit():
+            return int(size)
+    return LLM_POOL_SIZE
+
+
+def _track_stream(response: requests.Response, *args, **kwargs) -> requests.Response:
+    streams = _open_streams.get()
+    if streams is not None:
+        streams.append(response)
+    return response
+
+
+def _make_session(size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(_track_stream)
+    return session
+
+
+def _abort(response: requests.Response) -> None:
+    # close() alone doesn't wake the worker thread blocked reading the body, and
+    # the server keeps generating until the socket is actually shut down.
+    try:
+        response.raw.shutdown()
+    except Exception:
+        pass
+    response.close()
+
+
+def _share_session(llm: ChatNVIDIA, session: requests.Session) -> None:
+    # langchain-nvidia-ai-endpoints asks NVEModel.get_session_fn for a new
+    # session on every request; hand it ours instead.
+    client = getattr(getattr(llm, "_client", None), "client", None)
+    if client is not None and hasattr(client, "get_session_fn"):
+        client.get_session_fn = lambda: session
+
+
+def get_llm(model_id: str) -> ChatNVIDIA:
+    """Return the shared client for `model_id`, creating it on first use."""
+    llm = _clients.get(model_id)
+    if llm is not None:
+        return llm
+    with _lock:
+        llm = _clients.get(model_id)
+        if llm is None:
+            kwargs = {"model": model_id}
+            if NVIDIA_BASE_URL:
+                kwargs["base_url"] = NVIDIA_BASE_URL
+            llm = ChatNVIDIA(**kwargs)
+            session = _sessions.get(model_id) or _make_session(pool_size(model_id))
+            _share_session(llm, session)
+            _sessions[model_id] = session
+            _clients[model_id] = llm
+    return llm
+
+
+async def astream_text(llm: ChatNVIDIA, prompt: str) -> AsyncIterator[str]:
+    """
+    Yield the text of each chunk of `llm.astream(prompt)` as it arrives.
+
+    Nothing is read ahead: the next chunk is only requested once the caller asks
+    for it. If the caller stops early (the client disconnected, the request was
+    cancelled), the upstream HTTP response is shut down so generation stops
+    instead of running to completion in a worker thread.
+    """
+    streams: List[requests.Response] = []
+    token = _open_streams.set(streams)
+    stream = llm.astream(prompt)
+    finished = False
+    try:
+        async for chunk in stream:
+            text = getattr(chunk, "content", None)
+            if text:
+                yield text
+        finished = True
+    finally:
+        try:
+            _open_streams.reset(token)
+        except ValueError:
+            # Finalized from another context (e.g. garbage collection); nothing to restore.
+            pass
+        if not finished:
+            for response in streams:
+                _abort(response)
+        await stream.aclose()
+
+
+def warm_up(model_ids: Iterable[str], connect: bool = True) -> None:
+    """
+    Build a client for every model in `model_ids` and, if `connect`, open one
+    pooled connection each so the first user request skips the TLS handshake.
+    """
+    for model_id in model_ids:
+        try:
+            llm = get_llm(model_id)
+            if connect:
+                _sessions[model_id].head(llm.base_url, timeout=5)
+        except Exception as e:
+            logger.warning("LLM client warm-up failed for %s: %s", model_id, e)
+
+
+def close_all() -> None:
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _clients.clear()
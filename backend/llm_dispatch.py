@@ -0,0 +1,292 @@
+"""
+Latency-aware dispatch of chat requests, with hedging and circuit breakers.
+
+Every model keeps a rolling window of its recent time-to-first-token samples
+and failures. A request streams from the chosen model; if no token arrives
+within that model's hedge delay (its recent p95 TTFT, times
+LLM_HEDGE_P95_FACTOR), the same prompt is also sent to the fastest healthy
+fallback. Whichever answers first is used and the other stream is cancelled,
+which shuts its HTTP response down. A model that fails is replaced by the next
+fallback straight away.
+
+A model with LLM_BREAKER_FAILURES consecutive failures, or an error rate above
+LLM_BREAKER_ERROR_RATE over the window, has its breaker opened and is skipped
+for LLM_BREAKER_COOLDOWN seconds. After that a single request is let through
+as a probe; its outcome closes or reopens the breaker.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import llm_clients
+import metrics
+from metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+LLM_HEDGING = os.getenv("LLM_HEDGING", "true").lower() in ("1", "true", "yes")
+# Hedge delay: the model's recent p95 TTFT times this factor, clamped below.
+LLM_HEDGE_P95_FACTOR = float(os.getenv("LLM_HEDGE_P95_FACTOR", "1.0"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.2"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "10"))
+# Used until a model has LLM_HEDGE_MIN_SAMPLES TTFT samples in its window.
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "2.0"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Requests in flight at once for one query, the original included.
+LLM_HEDGE_MAX_IN_FLIGHT = int(os.getenv("LLM_HEDGE_MAX_IN_FLIGHT", "2"))
+LLM_HEALTH_WINDOW = int(os.getenv("LLM_HEALTH_WINDOW", "200"))
+LLM_HEALTH_WINDOW_SECONDS = float(os.getenv("LLM_HEALTH_WINDOW_SECONDS", "300"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_MIN_REQUESTS = int(os.getenv("LLM_BREAKER_MIN_REQUESTS", "10"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+LLM_HEDGES = metrics.counter("llm_hedges")
+LLM_FALLBACKS = metrics.counter("llm_fallbacks")
+LLM_BREAKER_EVENTS = metrics.counter("llm_breaker_events")
+
+
+class LLMUnavailable(Exception):
+    """Neither the requested model nor any of its fallbacks produced an answer."""
+
+
+class ModelHealth:
+    """Recent TTFTs and failures of one model, and the state of its breaker."""
+
+    def __init__(self, model_id: str, window: int = LLM_HEALTH_WINDOW):
+        self.model_id = model_id
+        # (timestamp, TTFT in seconds, or None for a failure)
+        self._samples: deque = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def _recent(self, now: float) -> List[Optional[float]]:
+        cutoff = now - LLM_HEALTH_WINDOW_SECONDS
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return [ttft for _, ttft in self._samples]
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """Whether a request may go to this model: breaker closed, or cooled down and not already probed."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.open_until == 0.0:
+                return True
+            return now >= self.open_until and not self.probing
+
+    def begin(self) -> None:
+        with self._lock:
+            if self.open_until and time.monotonic() >= self.open_until:
+                self.probing = True
+
+    def cancelled(self) -> None:
+        """The request was dropped before answering (it lost a hedge); no verdict either way."""
+        with self._lock:
+            self.probing = False
+
+    def record_success(self, ttft: float) -> None:
+        with self._lock:
+            self._samples.append((time.monotonic(), ttft))
+            self.consecutive_failures = 0
+            if self.open_until:
+                LLM_BREAKER_EVENTS.inc("closed")
+            self.open_until = 0.0
+            self.probing = False
+
+    def record_failure(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, None))
+            self.consecutive_failures += 1
+            recent = self._recent(now)
+            failures = sum(1 for ttft in recent if ttft is None)
+            tripped = self.consecutive_failures >= LLM_BREAKER_FAILURES or (
+                len(recent) >= LLM_BREAKER_MIN_REQUESTS and failures / len(recent) > LLM_BREAKER_ERROR_RATE
+            )
+            if tripped or self.probing:
+                if not self.open_until or now >= self.open_until:
+                    LLM_BREAKER_EVENTS.inc("opened")
+                    logger.warning("Circuit breaker opened for %s after %d consecutive failures", self.model_id, self.consecutive_failures)
+                self.open_until = now + LLM_BREAKER_COOLDOWN
+            self.probing = False
+
+    def ttfts(self) -> List[float]:
+        with self._lock:
+            return sorted(ttft for ttft in self._recent(time.monotonic()) if ttft is not None)
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for this model's first token before hedging."""
+        ttfts = self.ttfts()
+        if len(ttfts) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return min(LLM_HEDGE_MAX_DELAY, max(LLM_HEDGE_MIN_DELAY, percentile(ttfts, 0.95) * LLM_HEDGE_P95_FACTOR))
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            recent = self._recent(now)
+            ttfts = sorted(ttft for ttft in recent if ttft is not None)
+            state = "closed" if not self.open_until else ("open" if now < self.open_until else "half_open")
+            return {
+                "requests": len(recent),
+                "error_rate": round((len(recent) - len(ttfts)) / len(recent), 4) if recent else 0.0,
+                "ttft_p50": round(percentile(ttfts, 0.50), 6),
+                "ttft_p95": round(percentile(ttfts, 0.95), 6),
+                "breaker": state,
+            }
+
+
+_health: Dict[str, ModelHealth] = {}
+_health_lock = threading.Lock()
+
+
+def health(model_id: str) -> ModelHealth:
+    """Return the health record of `model_id`, creating it on first use."""
+    with _health_lock:
+        if model_id not in _health:
+            _health[model_id] = ModelHealth(model_id)
+        return _health[model_id]
+
+
+def candidates(model_id: str, fallbacks: Sequence[str] = ()) -> List[str]:
+    """
+    Models to try for a request to `model_id`, in order.
+
+    `model_id` comes first unless its breaker is open; the available fallbacks
+    follow, fastest recent median TTFT first; fallbacks not yet measured go
+    last, in their given order. If every breaker is open, all of them are tried anyway.
+    """
+    now = time.monotonic()
+    alternates = [m for m in dict.fromkeys(fallbacks) if m != model_id]
+
+    def median_ttft(m: str) -> Tuple[bool, float]:
+        ttfts = health(m).ttfts()
+        return (not ttfts, percentile(ttfts, 0.50))
+
+    ordered = [m for m in [model_id] + sorted(alternates, key=median_ttft) if health(m).available(now)]
+    if model_id not in ordered:
+        LLM_BREAKER_EVENTS.inc("skipped")
+    return ordered or [model_id] + alternates
+
+
+async def _first_token(model_id: str, prompt: str) -> Tuple[AsyncIterator[str], str, float]:
+    """Open a stream from `model_id` and wait for its first piece of text."""
+    started = time.perf_counter()
+    stream = llm_clients.astream_text(llm_clients.get_llm(model_id), prompt)
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first = ""
+    except BaseException:
+        await stream.aclose()
+        raise
+    return stream, first, time.perf_counter() - started
+
+
+async def _discard(task: "asyncio.Task", model_id: str) -> None:
+    """Cancel a losing attempt, or close its stream if it already answered."""
+    task.cancel()
+    try:
+        stream, _, _ = await task
+    except BaseException:
+        pass
+    else:
+        await stream.aclose()
+    health(model_id).cancelled()
+
+
+async def _relay(model_id: str, stream: AsyncIterator[str], first: str) -> AsyncIterator[str]:
+    try:
+        if first:
+            yield first
+        async for text in stream:
+            yield text
+    except Exception:
+        health(model_id).record_failure()
+        raise
+    finally:
+        await stream.aclose()
+
+
+async def open_stream(model_id: str, prompt: str, fallbacks: Sequence[str] = ()) -> Tuple[str, AsyncIterator[str]]:
+    """
+    Start generating an answer to `prompt` and return `(model used, text stream)`.
+
+    Returns once some model has produced its first token; the stream yields
+    that token and the rest. Raises LLMUnavailable if `model_id` and all of
+    `fallbacks` fail.
+    """
+    order = candidates(model_id, fallbacks)
+    loop = asyncio.get_running_loop()
+    pending: Dict["asyncio.Task", str] = {}
+    errors: List[str] = []
+    hedged = set()
+    deadline = 0.0
+
+    def launch() -> None:
+        nonlocal deadline
+        model = order.pop(0)
+        health(model).begin()
+        pending[asyncio.ensure_future(_first_token(model, prompt))] = model
+        deadline = loop.time() + health(model).hedge_delay()
+
+    launch()
+    try:
+        while pending:
+            can_hedge = LLM_HEDGING and order and len(pending) < LLM_HEDGE_MAX_IN_FLIGHT
+            timeout = max(0.0, deadline - loop.time()) if can_hedge else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                LLM_HEDGES.inc("launched")
+                hedged.add(order[0])
+                launch()
+                continue
+
+            winner = None
+            for task in done:
+                model = pending.pop(task)
+                if winner is not None:
+                    pending[task] = model  # discarded below with the other losers
+                    continue
+                try:
+                    stream, first, ttft = task.result()
+                except Exception as e:
+                    health(model).record_failure()
+                    errors.append(f"{model}: {e}")
+                    logger.warning("LLM request to %s failed: %s", model, e)
+                    continue
+                health(model).record_success(ttft)
+                winner = (model, stream, first)
+
+            if winner is not None:
+                model, stream, first = winner
+                if model in hedged:
+                    LLM_HEDGES.inc("won")
+                return model, _relay(model, stream, first)
+            if order and len(pending) < LLM_HEDGE_MAX_IN_FLIGHT:
+                LLM_FALLBACKS.inc(order[0])
+                launch()
+    finally:
+        for task, model in list(pending.items()):
+            await _discard(task, model)
+    raise LLMUnavailable("; ".join(errors) or f"no model available for {model_id}")
+
+
+async def ainvoke(model_id: str, prompt: str, fallbacks: Sequence[str] = ()) -> Tuple[str, str]:
+    """The complete answer to `prompt` as `(model used, text)`, dispatched like open_stream."""
+    model, stream = await open_stream(model_id, prompt, fallbacks)
+    parts = [text async for text in stream]
+    return model, "".join(parts)
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """Rolling TTFT, error rate and breaker state per model, for /stats/."""
+    with _health_lock:
+        records = list(_health.values())
+    return {record.model_id: record.snapshot() for record in records}
@@ -0,0 +1,209 @@
+"""
+In-process latency and throughput histograms, labelled counters and timing spans.
+
+Each histogram keeps cumulative bucket counts plus a window of the most recent
+METRICS_WINDOW samples, from which /stats/ reports p50/p95/p99. /metrics
+exposes the same histograms and counters in the Prometheus text format.
+
+`span(name, user=..., chat=..., model=...)` times a block into the
+`<name>_seconds` histogram. Only the labels named in METRICS_SPAN_LABELS are
+exported; user and chat are left out by default because every chat would get
+its own set of series. The full label set goes to the debug log with each span.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "2048"))
+SPAN_LABEL_NAMES = ("user", "chat", "model")
+METRICS_SPAN_LABELS = tuple(
+    name.strip() for name in os.getenv("METRICS_SPAN_LABELS", "model").split(",") if name.strip() in SPAN_LABEL_NAMES
+)
+# Label sets per histogram; further ones are counted under "other".
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "1000"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+TOKEN_BUCKETS = (0, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Histogram:
+    def __init__(
+        self, name: str, buckets: Sequence[float] = LATENCY_BUCKETS, window: int = METRICS_WINDOW,
+        label_names: Sequence[str] = (),
+    ):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        # One count per bucket upper bound, plus +Inf.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._recent: deque = deque(maxlen=window)
+        # Per label set, for /metrics; observations also land in self for /stats/.
+        self._children: Dict[Tuple[str, ...], "Histogram"] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self._recent.append(value)
+
+    def labels(self, **labels: Any) -> "Histogram":
+        """The series for `labels` (only this histogram's label names are kept)."""
+        key = tuple("" if labels.get(name) is None else str(labels[name]) for name in self.label_names)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                if len(self._children) >= METRICS_MAX_SERIES:
+                    key = ("other",) * len(key)
+                    child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = Histogram(self.name, self.buckets, window=0)
+            return child
+
+    def series(self) -> List[Tuple[Dict[str, str], List[int], int, float]]:
+        """(labels, bucket counts, count, sum) per exported series."""
+        with self._lock:
+            if not self._children:
+                return [({}, list(self.counts), self.count, self.sum)]
+            children = list(self._children.items())
+        result = []
+        for key, child in children:
+            with child._lock:
+                result.append((dict(zip(self.label_names, key)), list(child.counts), child.count, child.sum))
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            recent = sorted(self._recent)
+            return {
+                "count": self.count,
+                "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+                "p50": round(percentile(recent, 0.50), 6),
+                "p95": round(percentile(recent, 0.95), 6),
+                "p99": round(percentile(recent, 0.99), 6),
+            }
+
+
+class Counter:
+    """Event counts per label, e.g. which routing tier answered."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.values: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label: str = "", amount: int = 1) -> None:
+        with self._lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.values)
+
+
+_histograms: Dict[str, Histogram] = {}
+_counters: Dict[str, Counter] = {}
+_lock = threading.Lock()
+
+
+def histogram(name: str, buckets: Sequence[float] = LATENCY_BUCKETS, label_names: Sequence[str] = ()) -> Histogram:
+    """Return the histogram registered as `name`, creating it on first use."""
+    with _lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name, buckets, label_names=label_names)
+        return _histograms[name]
+
+
+def counter(name: str) -> Counter:
+    """Return the counter registered as `name`, creating it on first use."""
+    with _lock:
+        if name not in _counters:
+            _counters[name] = Counter(name)
+        return _counters[name]
+
+
+def record_span(name: str, seconds: float, **labels: Any) -> None:
+    """Record a `seconds`-long `name` span, labelled with user, chat and/or model."""
+    series = histogram(f"{name}_seconds", label_names=METRICS_SPAN_LABELS)
+    series.observe(seconds)
+    if series.label_names:
+        series.labels(**labels).observe(seconds)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s took %.1f ms %s", name, seconds * 1000, labels, extra={"span": name, "seconds": seconds, **labels})
+
+
+@contextmanager
+def span(name: str, **labels: Any) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started, **labels)
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    with _lock:
+        histograms = list(_histograms.values())
+        counters = list(_counters.values())
+    return {
+        "histograms": {h.name: h.snapshot() for h in histograms},
+        "counters": {c.name: c.snapshot() for c in counters},
+    }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus() -> str:
+    """Every histogram and counter in the Prometheus text exposition format."""
+    with _lock:
+        histograms = sorted(_histograms.values(), key=lambda h: h.name)
+        counters = sorted(_counters.values(), key=lambda c: c.name)
+    lines: List[str] = []
+    for h in histograms:
+        lines.append(f"# TYPE {h.name} histogram")
+        for labels, counts, count, total in h.series():
+            cumulative = 0
+            for bound, bucket_count in zip(h.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f"{h.name}_bucket{_labels({**labels, 'le': _number(bound)})} {cumulative}")
+            lines.append(f"{h.name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{h.name}_count{_labels(labels)} {count}")
+    for c in counters:
+        lines.append(f"# TYPE {c.name}_total counter")
+        for label, value in sorted(c.snapshot().items()):
+            lines.append(f"{c.name}_total{_labels({'label': label} if label else {})} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,192 @@
+"""
+Parsed-text cache.
+
+The text extracted from an upload is stored on disk keyed by the file's
+sha256 (plus its content type and the parser version), so uploading the same
+file again, to the same chat or another one, reads its segments back instead
+of extracting them. Segments are written as the
+parser produces them and read back a slice at a time, so neither side holds
+the whole document in memory.
+
+An entry only becomes visible once its document was parsed to the end; a
+parse that fails or is cancelled leaves nothing behind. The table is trimmed
+by total size, least recently used first.
+"""
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Set to an empty string to disable the cache.
+PARSE_CACHE_PATH = os.getenv("PARSE_CACHE_PATH", "parse_cache.sqlite3")
+PARSE_CACHE_DISK_MB = float(os.getenv("PARSE_CACHE_DISK_MB", "1024"))
+# Segments written, or read back, per statement.
+PARSE_CACHE_BATCH = 32
+
+
+class ParseCache:
+    def __init__(self, path: str, disk_bytes: int):
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents "
+            "(key TEXT PRIMARY KEY, file_hash TEXT NOT NULL, segments_total INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, complete INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS segments "
+            "(key TEXT NOT NULL, number INTEGER NOT NULL, text BLOB NOT NULL, PRIMARY KEY (key, number))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS documents_last_used ON documents (last_used)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS documents_file_hash ON documents (file_hash)")
+        # Left over by a process that stopped mid-parse.
+        self._delete("complete = 0")
+        self._db.commit()
+        self._disk_used = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+
+    def _delete(self, where: str, params: Sequence = ()) -> None:
+        """Delete the documents matching `where`, and their segments."""
+        self._db.execute(f"DELETE FROM segments WHERE key IN (SELECT key FROM documents WHERE {where})", params)
+        self._db.execute(f"DELETE FROM documents WHERE {where}", params)
+
+    def open(self, key: str) -> Optional[Tuple[int, Iterator[Tuple[int, str]]]]:
+        """(segments_total, segments) of a cached document, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT segments_total FROM documents WHERE key = ? AND complete = 1", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE documents SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return row[0], self._read(key)
+
+    def _read(self, key: str) -> Iterator[Tuple[int, str]]:
+        after = -1
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT number, text FROM segments WHERE key = ? AND number > ? ORDER BY number LIMIT ?",
+                    (key, after, PARSE_CACHE_BATCH),
+                ).fetchall()
+            if not rows:
+                return
+            for number, blob in rows:
+                yield number, zlib.decompress(blob).decode("utf-8")
+            after = rows[-1][0]
+
+    def store(self, key: str, file_hash: str, segments_total: int, segments: Iterable[Tuple[int, str]]) -> Iterator[Tuple[int, str]]:
+        """
+        Pass `segments` through, writing them to the cache on the way.
+
+        The entry is published once the last segment has been pulled. If
+        another job is already writing the same document, this one just
+        passes its segments through.
+        """
+        with self._lock:
+            claimed = self._db.execute(
+                "INSERT OR IGNORE INTO documents (key, file_hash, segments_total, size, complete, last_used) VALUES (?, ?, ?, 0, 0, ?)",
+                (key, file_hash, segments_total, time.time()),
+            ).rowcount
+            self._db.commit()
+        if not claimed:
+            yield from segments
+            return
+
+        complete = False
+        size = 0
+        pending: List[Tuple[str, int, bytes]] = []
+        try:
+            for number, text in segments:
+                blob = zlib.compress(text.encode("utf-8"), 1)
+                pending.append((key, number, blob))
+                size += len(blob)
+                if len(pending) >= PARSE_CACHE_BATCH:
+                    self._write(pending)
+                    pending = []
+                yield number, text
+            self._write(pending)
+            complete = True
+        finally:
+            with self._lock:
+                # The row is gone if the file was forgotten while it was being parsed.
+                if complete and self._db.execute("UPDATE documents SET complete = 1, size = ? WHERE key = ?", (size, key)).rowcount:
+                    self._disk_used += size
+                    if self._disk_used > self.disk_bytes:
+                        self._evict()
+                else:
+                    self._db.execute("DELETE FROM segments WHERE key = ?", (key,))
+                    self._db.execute("DELETE FROM documents WHERE key = ?", (key,))
+                self._db.commit()
+
+    def _write(self, rows: List[Tuple[str, int, bytes]]) -> None:
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO segments (key, number, text) VALUES (?, ?, ?)", rows)
+            self._db.commit()
+
+    def _evict(self) -> None:
+        # Trim to 90% so we don't evict again on the very next document.
+        target = int(self.disk_bytes * 0.9)
+        while self._disk_used > target:
+            rows = self._db.execute(
+                "SELECT key, size FROM documents WHERE complete = 1 ORDER BY last_used LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self._disk_used = 0
+                return
+            for key, size in rows:
+                self._delete("key = ?", (key,))
+                self._disk_used -= size
+                self.evictions += 1
+                if self._disk_used <= target:
+                    break
+
+    def forget(self, file_hashes: Iterable[str]) -> None:
+        """Drop the cached text of these files."""
+        hashes = list(dict.fromkeys(file_hashes))
+        with self._lock:
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                self._disk_used -= self._db.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM documents WHERE complete = 1 AND file_hash IN ({placeholders})", part
+                ).fetchone()[0]
+                self._delete(f"file_hash IN ({placeholders})", part)
+            self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "documents": self._db.execute("SELECT COUNT(*) FROM documents WHERE complete = 1").fetchone()[0],
+                "disk_bytes": self._disk_used,
+                "evictions": self.evictions,
+            }
+
+
+_cache: ParseCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_parse_cache() -> Optional[ParseCache]:
+    """The process-wide cache, or None when PARSE_CACHE_PATH is empty."""
+    global _cache
+    if not PARSE_CACHE_PATH:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ParseCache(PARSE_CACHE_PATH, int(PARSE_CACHE_DISK_MB * 1024 * 1024))
+    return _cache
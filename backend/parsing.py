@@ -0,0 +1,610 @@
+"""
+Streaming text extraction for uploaded files.
+
+Parsers work on a file on disk and yield text one segment at a time (a PDF
+page, or a block of a text file), so memory use does not grow with the size
+of the upload.
+
+Parsers are registered per content type with `register_parser`. Uploads are
+routed by the type sniffed from their bytes (sniff_content_type), not by
+what the client declared: PDF and DOCX by their signatures, HTML by its
+opening tag, and Markdown and CSV by declared type or file extension. Other
+text is read as plain text; binary files no parser recognizes are rejected
+rather than ingested as noise. Extracted text is cached by file hash (see
+parse_cache.py), so uploading the same file again skips extraction.
+
+PDF text extraction is CPU-bound pure Python, so it runs in a process pool:
+the page range is split into shards, shards are extracted in parallel and
+their pages are yielded back in order.
+"""
+import codecs
+import csv
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from xml.etree import ElementTree
+
+from pypdf import PdfReader
+
+from parse_cache import get_parse_cache
+
+# Bytes read per step for text uploads (and for the XML inside a DOCX).
+TEXT_BLOCK_SIZE = 64 * 1024
+# Bytes looked at to tell a file's type, and whether it is text at all.
+SNIFF_BYTES = 8192
+# Bump when a parser's output changes, so cached text from the old one isn't reused.
+PARSER_VERSION = 3
+
+# Worker processes for PDF extraction; 0 extracts in the calling process.
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Smallest page range handed to one worker. Every shard re-opens the PDF and walks
+# its page tree, so tiny shards cost more than they save.
+PDF_MIN_PAGES_PER_SHARD = int(os.getenv("PDF_MIN_PAGES_PER_SHARD", "16"))
+# Seconds a single document may spend waiting on text extraction.
+PDF_EXTRACT_TIMEOUT = float(os.getenv("PDF_EXTRACT_TIMEOUT", "300"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "2000"))
+
+# (segment number, text). Segment numbers are page numbers for PDFs and block numbers otherwise.
+Segment = Tuple[int, str]
+# Opens a file for extraction: (segments_total, segments).
+Parser = Callable[[str], Tuple[int, Iterator[Segment]]]
+
+
+class DocumentRejected(ValueError):
+    """The upload cannot be ingested (unsupported file type, too many pages, extraction timed out, ...)."""
+
+
+class _Format:
+    def __init__(self, content_type: str, parse: Parser, sniff: Optional[Callable[[str, bytes], bool]], text: bool):
+        self.content_type = content_type
+        self.parse = parse
+        self.sniff = sniff
+        # Text formats are also chosen by declared type or extension; binary ones only by their signature.
+        self.text = text
+
+
+_FORMATS: Dict[str, _Format] = {}
+# Declared content types and file extensions -> registered content type.
+_ALIASES: Dict[str, str] = {}
+_EXTENSIONS: Dict[str, str] = {}
+
+
+def register_parser(
+    content_type: str,
+    aliases: Iterable[str] = (),
+    extensions: Iterable[str] = (),
+    sniff: Optional[Callable[[str, bytes], bool]] = None,
+    text: bool = True,
+) -> Callable[[Parser], Parser]:
+    """
+    Register the decorated function as the parser for `content_type`.
+
+    `sniff(path, head)` recognizes the format from the file's first
+    SNIFF_BYTES; sniffers run in registration order, before the declared type
+    or extension is considered. A format registered with `text=False` is only
+    ever chosen by its sniffer.
+    """
+    def decorator(parse: Parser) -> Parser:
+        _FORMATS[content_type] = _Format(content_type, parse, sniff, text)
+        for alias in (content_type, *aliases):
+            _ALIASES[alias] = content_type
+        for extension in extensions:
+            _EXTENSIONS[extension.lower()] = content_type
+        return parse
+    return decorator
+
+
+def _iter_pdf_pages(reader: PdfReader, start: int, stop: int) -> Iterator[Segment]:
+    for i in range(start, stop):
+        text = reader.pages[i].extract_text() or ""
+        # pypdf keeps every parsed page and resolved object alive for the life of
+        # the reader. Pages are only read once, front to back, so drop them as we go.
+        reader.flattened_pages[i] = None
+        reader.resolved_objects.clear()
+        yield i, text + "\n"
+
+
+def _extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    # Runs in a worker process.
+    return [text for _, text in _iter_pdf_pages(PdfReader(path), start, stop)]
+
+
+_pdf_pool: ProcessPoolExecutor | None = None
+_pdf_pool_lock = threading.Lock()
+# Shards submitted to each pool and not finished yet, and the ones that timed
+# out, so a retired pool is only torn down once other documents' shards drain.
+_pdf_inflight: Dict[ProcessPoolExecutor, Set[Future]] = {}
+_pdf_stuck: Dict[ProcessPoolExecutor, Set[Future]] = {}
+
+
+def _current_pdf_pool() -> ProcessPoolExecutor:
+    # Call with _pdf_pool_lock held.
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn rather than fork: the server process has live threads and sockets.
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    with _pdf_pool_lock:
+        return _current_pdf_pool()
+
+
+def _kill_pdf_pool(pool: ProcessPoolExecutor) -> None:
+    # A timed-out shard keeps its worker busy; the executor has no public way
+    # to stop it, so terminate the processes before abandoning the pool.
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=False)
+
+
+def shutdown_pdf_pool(kill: bool = False) -> None:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        pool, _pdf_pool = _pdf_pool, None
+    if pool is None:
+        return
+    if kill:
+        _kill_pdf_pool(pool)
+    else:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _submit_pdf_shard(path: str, start: int, stop: int) -> Tuple[ProcessPoolExecutor, Future]:
+    with _pdf_pool_lock:
+        # Registered before the lock is released, so a reaper can't miss it.
+        pool = _current_pdf_pool()
+        future = pool.submit(_extract_page_range, path, start, stop)
+        _pdf_inflight.setdefault(pool, set()).add(future)
+
+    def done(f: Future) -> None:
+        with _pdf_pool_lock:
+            _pdf_inflight.get(pool, set()).discard(f)
+
+    future.add_done_callback(done)
+    return pool, future
+
+
+def _retire_pdf_pool(pool: ProcessPoolExecutor, stuck: Future) -> None:
+    """
+    Take a pool with a stuck shard out of service: new shards go to a fresh
+    pool, and the old one's processes are killed once the shards other
+    documents still have on it finish (or PDF_EXTRACT_TIMEOUT passes).
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        _pdf_stuck.setdefault(pool, set()).add(stuck)
+        if _pdf_pool is not pool:
+            # Already retired; its reaper sees this shard too.
+            return
+        _pdf_pool = None
+    threading.Thread(target=_reap_pdf_pool, args=(pool,), name="pdf-pool-reaper", daemon=True).start()
+
+
+def _reap_pdf_pool(pool: ProcessPoolExecutor) -> None:
+    deadline = time.monotonic() + PDF_EXTRACT_TIMEOUT
+    while time.monotonic() < deadline:
+        with _pdf_pool_lock:
+            others = _pdf_inflight.get(pool, set()) - _pdf_stuck.get(pool, set())
+        if not others:
+            break
+        # Re-checked every second, as more of the pool's shards may time out meanwhile.
+        wait(others, timeout=min(1.0, max(0.0, deadline - time.monotonic())))
+    with _pdf_pool_lock:
+        _pdf_inflight.pop(pool, None)
+        _pdf_stuck.pop(pool, None)
+    _kill_pdf_pool(pool)
+
+
+def _iter_pdf_shards(path: str, pages_total: int, workers: int, timeout: float) -> Iterator[Segment]:
+    shard_size = max(PDF_MIN_PAGES_PER_SHARD, -(-pages_total // (workers * 4)))
+    ranges = deque((start, min(start + shard_size, pages_total)) for start in range(0, pages_total, shard_size))
+    pending = deque()
+    waited = 0.0
+
+    def submit() -> None:
+        start, stop = ranges.popleft()
+        pending.append((start, *_submit_pdf_shard(path, start, stop)))
+
+    # Keep every worker busy plus one shard queued each, but no more, so a slow
+    # consumer doesn't make finished pages pile up in memory.
+    try:
+        while ranges and len(pending) < workers * 2:
+            submit()
+        while pending:
+            start, pool, future = pending.popleft()
+            began = time.monotonic()
+            try:
+                texts = future.result(timeout=max(timeout - waited, 0))
+            except FutureTimeoutError:
+                # The pool is shared with other uploads: only this document's
+                # shards are cancelled (below), and the pool is replaced rather than killed.
+                _retire_pdf_pool(pool, future)
+                raise DocumentRejected(f"PDF text extraction timed out after {timeout:g}s")
+            waited += time.monotonic() - began
+            if ranges:
+                submit()
+            for offset, text in enumerate(texts):
+                yield start + offset, text
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+
+
+def _iter_pdf_inline(reader: PdfReader, pages_total: int, timeout: float) -> Iterator[Segment]:
+    # A page can't be interrupted in this process, so the limit is checked between pages.
+    pages = _iter_pdf_pages(reader, 0, pages_total)
+    spent = 0.0
+    while True:
+        began = time.monotonic()
+        segment = next(pages, None)
+        spent += time.monotonic() - began
+        if segment is None:
+            return
+        if spent > timeout:
+            raise DocumentRejected(f"PDF text extraction timed out after {timeout:g}s")
+        yield segment
+
+
+def _is_pdf(path: str, head: bytes) -> bool:
+    # The header may follow some junk bytes; readers accept it anywhere in the first KB.
+    return b"%PDF-" in head[:1024]
+
+
+@register_parser("application/pdf", aliases=("application/x-pdf",), extensions=(".pdf",), sniff=_is_pdf, text=False)
+def _parse_pdf(path: str) -> Tuple[int, Iterator[Segment]]:
+    reader = PdfReader(path)
+    pages_total = len(reader.pages)
+    if pages_total > PDF_MAX_PAGES:
+        raise DocumentRejected(f"PDF has {pages_total} pages; the limit is {PDF_MAX_PAGES}")
+    if PDF_EXTRACT_WORKERS > 0:
+        return pages_total, _iter_pdf_shards(path, pages_total, PDF_EXTRACT_WORKERS, PDF_EXTRACT_TIMEOUT)
+    return pages_total, _iter_pdf_inline(reader, pages_total, PDF_EXTRACT_TIMEOUT)
+
+
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+DOCX_BODY = "word/document.xml"
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def _is_docx(path: str, head: bytes) -> bool:
+    if not head.startswith(b"PK\x03\x04"):
+        return False
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return DOCX_BODY in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+
+
+def _iter_docx_blocks(path: str) -> Iterator[Segment]:
+    # The document XML is fed to a pull parser TEXT_BLOCK_SIZE bytes at a time;
+    # each block yields the paragraphs it completed, one per blank-line-separated run.
+    parser = ElementTree.XMLPullParser(events=("end",))
+    paragraph: List[str] = []
+    try:
+        with zipfile.ZipFile(path) as archive, archive.open(DOCX_BODY) as f:
+            i = 0
+            while True:
+                block = f.read(TEXT_BLOCK_SIZE)
+                if block:
+                    parser.feed(block)
+                else:
+                    parser.close()
+                text = []
+                for _, element in parser.read_events():
+                    if element.tag == _W + "t":
+                        paragraph.append(element.text or "")
+                    elif element.tag == _W + "tab":
+                        paragraph.append("\t")
+                    elif element.tag in (_W + "br", _W + "cr"):
+                        paragraph.append("\n")
+                    elif element.tag == _W + "p":
+                        if "".join(paragraph).strip():
+                            text.append("".join(paragraph).strip() + "\n\n")
+                        paragraph = []
+                        # Finished paragraphs aren't needed again; keep the tree small.
+                        element.clear()
+                if text:
+                    yield i, "".join(text)
+                if not block:
+                    return
+                i += 1
+    except (ElementTree.ParseError, zipfile.BadZipFile) as e:
+        raise DocumentRejected(f"DOCX could not be read: {e}")
+
+
+@register_parser(DOCX_TYPE, extensions=(".docx",), sniff=_is_docx, text=False)
+def _parse_docx(path: str) -> Tuple[int, Iterator[Segment]]:
+    with zipfile.ZipFile(path) as archive:
+        size = archive.getinfo(DOCX_BODY).file_size
+    return _blocks_total(size), _iter_docx_blocks(path)
+
+
+def _blocks_total(size: int) -> int:
+    return max(1, -(-size // TEXT_BLOCK_SIZE))
+
+
+def _looks_binary(head: bytes) -> bool:
+    if b"\x00" in head:
+        return True
+    # Text has the odd form feed or escape, not a tenth of its bytes in control codes.
+    control = sum(1 for byte in head if byte < 32 and byte not in b"\t\n\r\f\b\x1b")
+    return control * 10 > len(head)
+
+
+def _is_utf8(path: str) -> bool:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
+        try:
+            while block := f.read(TEXT_BLOCK_SIZE):
+                decoder.decode(block)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return False
+    return True
+
+
+def _text_encoding(path: str) -> str:
+    # Text that isn't UTF-8 is most likely from a Windows editor.
+    return "utf-8-sig" if _is_utf8(path) else "cp1252"
+
+
+def _iter_text_blocks(path: str, encoding: str = "utf-8", separators: Tuple[str, ...] = (" ", "\n")) -> Iterator[Segment]:
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    carry = ""
+    with open(path, "rb") as f:
+        i = 0
+        while block := f.read(TEXT_BLOCK_SIZE):
+            text = carry + decoder.decode(block)
+            # Cut at the last separator so no word (or line) is split across two
+            # blocks, which would otherwise change how it tokenizes.
+            cut = max(text.rfind(separator) for separator in separators)
+            if cut <= 0:
+                carry = ""
+            else:
+                text, carry = text[:cut + 1], text[cut + 1:]
+            yield i, text
+            i += 1
+        text = carry + decoder.decode(b"", final=True)
+        if text:
+            yield i, text
+
+
+@register_parser("text/plain", extensions=(".txt", ".text", ".log"))
+def _parse_text(path: str) -> Tuple[int, Iterator[Segment]]:
+    return _blocks_total(os.path.getsize(path)), _iter_text_blocks(path, _text_encoding(path))
+
+
+_MD_FENCE = re.compile(r"^ {0,3}(```|~~~).*\n?", re.M)
+_MD_HEADING = re.compile(r"^ {0,3}#{1,6}[ \t]+(.*?)[ \t#]*$", re.M)
+_MD_IMAGE = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+_MD_LINK = re.compile(r"\[([^\]]+)\]\([^)]*\)")
+# Bold, italic and code spans written with * or backticks; underscores are left
+# alone so snake_case identifiers survive.
+_MD_EMPHASIS = re.compile(r"(\*\*|\*|`+)(?=\S)(.+?)(?<=\S)\1")
+_MD_COMMENT = re.compile(r"<!--.*?-->", re.S)
+
+
+def _strip_markdown(text: str) -> str:
+    text = _MD_COMMENT.sub("", text)
+    text = _MD_FENCE.sub("", text)
+    text = _MD_HEADING.sub(r"\1", text)
+    text = _MD_IMAGE.sub(r"\1", text)
+    text = _MD_LINK.sub(r"\1", text)
+    return _MD_EMPHASIS.sub(r"\2", text)
+
+
+def _iter_markdown_blocks(path: str, encoding: str) -> Iterator[Segment]:
+    # Blocks end at a line break so line-based markup is never cut in two.
+    for i, text in _iter_text_blocks(path, encoding, separators=("\n",)):
+        yield i, _strip_markdown(text)
+
+
+@register_parser("text/markdown", aliases=("text/x-markdown",), extensions=(".md", ".markdown"))
+def _parse_markdown(path: str) -> Tuple[int, Iterator[Segment]]:
+    return _blocks_total(os.path.getsize(path)), _iter_markdown_blocks(path, _text_encoding(path))
+
+
+def _is_html(path: str, head: bytes) -> bool:
+    start = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    return start.startswith((b"<!doctype html", b"<html"))
+
+
+_SPACES = re.compile(r"\s+")
+_BLANK_LINES = re.compile(r"\s*\n\s*\n\s*")
+
+
+class _HTMLText(HTMLParser):
+    """Visible text of an HTML document, with block elements as paragraphs."""
+
+    SKIP = {"script", "style", "noscript", "template", "svg"}
+    BLOCKS = {
+        "address", "article", "aside", "blockquote", "dd", "div", "dl", "dt", "figcaption", "figure", "footer",
+        "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main", "nav", "ol", "p", "pre",
+        "section", "table", "title", "tr", "ul",
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skip = 0
+        self._pre = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip += 1
+        elif tag == "br":
+            self.parts.append("\n")
+        elif tag in ("td", "th"):
+            self.parts.append(" ")
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+            if tag == "pre":
+                self._pre += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+            if tag == "pre":
+                self._pre = max(0, self._pre - 1)
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        self.parts.append(data if self._pre else _SPACES.sub(" ", data))
+
+    def take(self, final: bool = False) -> str:
+        """The text gathered so far, up to its last whitespace unless `final`."""
+        text = "".join(self.parts)
+        cut = len(text) if final else max(text.rfind(" "), text.rfind("\n")) + 1
+        self.parts = [text[cut:]] if cut < len(text) else []
+        return _BLANK_LINES.sub("\n\n", text[:cut])
+
+
+def _iter_html_blocks(path: str, encoding: str) -> Iterator[Segment]:
+    parser = _HTMLText()
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    with open(path, "rb") as f:
+        i = 0
+        while block := f.read(TEXT_BLOCK_SIZE):
+            parser.feed(decoder.decode(block))
+            text = parser.take()
+            if text.strip():
+                yield i, text
+            i += 1
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+        text = parser.take(final=True)
+        if text.strip():
+            yield i, text
+
+
+@register_parser("text/html", aliases=("application/xhtml+xml",), extensions=(".html", ".htm", ".xhtml"), sniff=_is_html)
+def _parse_html(path: str) -> Tuple[int, Iterator[Segment]]:
+    return _blocks_total(os.path.getsize(path)), _iter_html_blocks(path, _text_encoding(path))
+
+
+def _iter_csv_rows(path: str, encoding: str, delimiter: str) -> Iterator[Segment]:
+    # Each row becomes a paragraph of "column: value" pairs named by the header
+    # row, so a chunk cut from the middle of the table still says what its
+    # values are. Segments are numbered by the TEXT_BLOCK_SIZE blocks of bytes
+    # read, like _blocks_total counts them.
+    consumed = 0
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+
+    def lines(f):
+        nonlocal consumed
+        # Lines are read as bytes so `consumed` counts bytes, not characters;
+        # csv handles the \r\n and quoted newlines left in them.
+        for line in f:
+            consumed += len(line)
+            yield decoder.decode(line)
+        if tail := decoder.decode(b"", final=True):
+            yield tail
+
+    with open(path, "rb") as f:
+        header: List[str] | None = None
+        rows: List[str] = []
+        i = 0
+        try:
+            for row in csv.reader(lines(f), delimiter=delimiter):
+                if not any(cell.strip() for cell in row):
+                    continue
+                if header is None:
+                    header = [cell.strip() for cell in row]
+                    continue
+                names = header + [""] * (len(row) - len(header))
+                fields = [f"{name or f'column {n + 1}'}: {value.strip()}" for n, (name, value) in enumerate(zip(names, row)) if value.strip()]
+                rows.append("; ".join(fields) + "\n\n")
+                if consumed >= (i + 1) * TEXT_BLOCK_SIZE:
+                    yield i, "".join(rows)
+                    rows, i = [], consumed // TEXT_BLOCK_SIZE
+        except csv.Error as e:
+            raise DocumentRejected(f"CSV could not be read: {e}")
+        if rows:
+            yield i, "".join(rows)
+
+
+@register_parser("text/csv", aliases=("application/csv", "text/x-csv"), extensions=(".csv",))
+def _parse_csv(path: str) -> Tuple[int, Iterator[Segment]]:
+    return _blocks_total(os.path.getsize(path)), _iter_csv_rows(path, _text_encoding(path), ",")
+
+
+@register_parser("text/tab-separated-values", extensions=(".tsv",))
+def _parse_tsv(path: str) -> Tuple[int, Iterator[Segment]]:
+    return _blocks_total(os.path.getsize(path)), _iter_csv_rows(path, _text_encoding(path), "\t")
+
+
+def _media_type(declared: str | None) -> str:
+    return (declared or "").split(";")[0].strip().lower()
+
+
+def sniff_content_type(path: str, declared: str | None = None, filename: str | None = None) -> str:
+    """
+    The registered content type to parse the file at `path` as.
+
+    Signatures win over what the client declared; a text file is then typed
+    by its declared content type or `filename` extension, falling back to
+    text/plain. Raises DocumentRejected for binary files no parser handles.
+    """
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    for format_ in _FORMATS.values():
+        if format_.sniff is not None and format_.sniff(path, head):
+            return format_.content_type
+    extension = os.path.splitext(filename or "")[1].lower()
+    if _looks_binary(head):
+        kind = _media_type(declared) or extension or "unknown"
+        raise DocumentRejected(
+            f"Unsupported file type ({kind}): only PDF, DOCX, HTML, Markdown, CSV and plain-text files can be uploaded"
+        )
+    for content_type in (_ALIASES.get(_media_type(declared)), _EXTENSIONS.get(extension)):
+        if content_type is not None and _FORMATS[content_type].text:
+            return content_type
+    return "text/plain"
+
+
+def _cache_key(file_hash: str, content_type: str) -> str:
+    return hashlib.sha256(f"{file_hash}\0{content_type}\0{PARSER_VERSION}".encode("utf-8")).hexdigest()
+
+
+def parse_document(path: str, content_type: str | None, file_hash: str | None = None) -> Tuple[int, Iterator[Segment]]:
+    """
+    Open an uploaded file for streaming extraction.
+
+    Returns (segments_total, segments) where segments is a generator of
+    (segment number, text). The parser is chosen by sniff_content_type, with
+    `content_type` as the declared type. PDFs are read page by page, on the
+    extraction process pool when PDF_EXTRACT_WORKERS > 0; other formats in
+    TEXT_BLOCK_SIZE blocks.
+
+    With `file_hash`, text already extracted from the same file is read back
+    from the parse cache, and freshly extracted text is added to it.
+
+    Raises DocumentRejected for unsupported binary files and PDFs over
+    PDF_MAX_PAGES; the returned generator raises it for a malformed DOCX or
+    CSV and once PDF extraction has taken longer than PDF_EXTRACT_TIMEOUT.
+    """
+    content_type = sniff_content_type(path, content_type)
+    cache = get_parse_cache() if file_hash else None
+    if cache is not None:
+        key = _cache_key(file_hash, content_type)
+        cached = cache.open(key)
+        if cached is not None:
+            return cached
+    segments_total, segments = _FORMATS[content_type].parse(path)
+    if cache is not None:
+        segments = cache.store(key, file_hash, segments_total, segments)
+    return segments_total, segments
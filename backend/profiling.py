@@ -0,0 +1,100 @@
+"""
+Optional wall-clock sampling profiler.
+
+With PROFILER_SAMPLE_INTERVAL set (seconds, e.g. 0.005), a background thread
+samples the stack of every other thread at that interval and counts identical
+stacks. `/debug/profile` returns the counts as collapsed stacks
+("frame;frame;frame count" per line), the input flamegraph.pl and speedscope
+take; with PROFILER_OUTPUT set they are also written there at shutdown.
+Sampling reads `sys._current_frames()` and costs nothing while disabled.
+"""
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILER_SAMPLE_INTERVAL = float(os.getenv("PROFILER_SAMPLE_INTERVAL", "0"))
+PROFILER_OUTPUT = os.getenv("PROFILER_OUTPUT", "")
+PROFILER_MAX_DEPTH = int(os.getenv("PROFILER_MAX_DEPTH", "64"))
+
+
+class StackSampler:
+    def __init__(self, interval: float, max_depth: int = PROFILER_MAX_DEPTH):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _stack(self, frame) -> str:
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(frames))
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stacks.append(f"{names.get(thread_id, thread_id)};{self._stack(frame)}")
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def collapsed(self, reset: bool = False) -> str:
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self._stacks.most_common()]
+            if reset:
+                self._stacks.clear()
+                self.samples = 0
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+_sampler: StackSampler | None = None
+
+
+def get_sampler() -> Optional[StackSampler]:
+    return _sampler
+
+
+def start_profiler() -> None:
+    global _sampler
+    if PROFILER_SAMPLE_INTERVAL > 0 and _sampler is None:
+        _sampler = StackSampler(PROFILER_SAMPLE_INTERVAL)
+        _sampler.start()
+        logger.info("Sampling profiler running every %.1f ms", PROFILER_SAMPLE_INTERVAL * 1000)
+
+
+def stop_profiler() -> None:
+    global _sampler
+    if _sampler is None:
+        return
+    _sampler.stop()
+    if PROFILER_OUTPUT:
+        with open(PROFILER_OUTPUT, "w") as f:
+            f.write(_sampler.collapsed())
+        logger.info("Wrote %d profiler samples to %s", _sampler.samples, PROFILER_OUTPUT)
+    _sampler = None
@@ -0,0 +1,155 @@
+"""
+Semantic cache for query answers.
+
+Answers are scoped by (user_id, chat_id, model) so nothing leaks between
+users, chats or models. A lookup first tries the normalized query text by
+hash and then falls back to the closest cached query embedding in the same
+scope, accepting it when cosine similarity is at least
+RESPONSE_CACHE_SIMILARITY. Entries expire after RESPONSE_CACHE_TTL seconds,
+the least recently used are evicted beyond RESPONSE_CACHE_MAX_ENTRIES, and a
+chat's entries are dropped whenever its documents change.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "900"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.97"))
+
+Scope = Tuple[str, str, str]
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def _unit(vector) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+class ResponseCache:
+    def __init__(self, ttl: float, max_entries: int, similarity: float):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        # scope -> {query hash: entry}; _lru orders (scope, query hash) by last use.
+        self._scopes: Dict[Scope, Dict[str, Dict[str, Any]]] = {}
+        self._lru: "OrderedDict[Tuple[Scope, str], None]" = OrderedDict()
+        # Bumped by invalidate(), keyed by (user,) and (user, chat). An answer is only
+        # stored if neither changed while it was being generated.
+        self._versions: Dict[Tuple[str, ...], int] = {}
+        self._lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def scope(user_id: int, chat_id: str, model: str) -> Scope:
+        return str(user_id), chat_id, model
+
+    @staticmethod
+    def _hash(query: str) -> str:
+        return hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+
+    def _drop(self, scope: Scope, key: str) -> None:
+        entries = self._scopes.get(scope)
+        if entries is not None:
+            entries.pop(key, None)
+            if not entries:
+                del self._scopes[scope]
+        self._lru.pop((scope, key), None)
+
+    def lookup(self, scope: Scope, query: str, embedding=None) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for `query` in `scope`, or None."""
+        now = time.monotonic()
+        key = self._hash(query)
+        with self._lock:
+            entries = self._scopes.get(scope, {})
+            for expired in [k for k, e in entries.items() if now - e["created"] > self.ttl]:
+                self._drop(scope, expired)
+            entries = self._scopes.get(scope, {})
+
+            entry = entries.get(key)
+            if entry is not None:
+                self.hits_exact += 1
+            elif embedding is not None and entries:
+                vector = _unit(embedding)
+                best_key, best = max(
+                    ((k, float(np.dot(vector, e["embedding"]))) for k, e in entries.items() if e["embedding"] is not None),
+                    key=lambda item: item[1],
+                    default=(None, -1.0),
+                )
+                if best >= self.similarity:
+                    key, entry = best_key, entries[best_key]
+                    self.hits_semantic += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self._lru.move_to_end((scope, key))
+            return entry
+
+    def version(self, scope: Scope) -> Tuple[int, int]:
+        """Snapshot to pass to store(); taken before retrieval starts."""
+        with self._lock:
+            return self._versions.get(scope[:1], 0), self._versions.get(scope[:2], 0)
+
+    def store(self, scope: Scope, version: Tuple[int, int], query: str, embedding, **values: Any) -> None:
+        """Cache an answer, unless the chat's documents changed since `version` was taken."""
+        key = self._hash(query)
+        entry = dict(values)
+        entry["embedding"] = _unit(embedding) if embedding is not None else None
+        entry["created"] = time.monotonic()
+        with self._lock:
+            if (self._versions.get(scope[:1], 0), self._versions.get(scope[:2], 0)) != version:
+                return
+            self._scopes.setdefault(scope, {})[key] = entry
+            self._lru[(scope, key)] = None
+            self._lru.move_to_end((scope, key))
+            while len(self._lru) > self.max_entries:
+                (old_scope, old_key), _ = self._lru.popitem(last=False)
+                self._drop(old_scope, old_key)
+
+    def invalidate(self, user_id: int, chat_id: Optional[str] = None) -> None:
+        """Drop every cached answer for a chat, or for all of a user's chats when chat_id is None."""
+        user = str(user_id)
+        with self._lock:
+            bumped = (user,) if chat_id is None else (user, chat_id)
+            self._versions[bumped] = self._versions.get(bumped, 0) + 1
+            for scope in [s for s in self._scopes if s[0] == user and (chat_id is None or s[1] == chat_id)]:
+                for key in list(self._scopes[scope]):
+                    self._drop(scope, key)
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits_exact + self.hits_semantic + self.misses
+            return {
+                "hits_exact": self.hits_exact,
+                "hits_semantic": self.hits_semantic,
+                "misses": self.misses,
+                "hit_rate": round((self.hits_exact + self.hits_semantic) / lookups, 4) if lookups else 0.0,
+                "entries": len(self._lru),
+                "invalidations": self.invalidations,
+            }
+
+
+_cache: ResponseCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_SIMILARITY)
+    return _cache
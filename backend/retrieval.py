@@ -0,0 +1,379 @@
+"""
+Retrieval over the user_files collection.
+
+Queries are embedded with the query-mode embedder (the collection itself
+embeds stored chunks in passage mode) and searched with `query_embeddings`.
+Several queries, e.g. a question and its follow-up rewrites, share one
+embedding call.
+
+With HYBRID_SEARCH on, each query also runs against the chat's BM25 index (see
+lexical.py) while the vector search is in flight, and the two rankings of
+HYBRID_CANDIDATES chunks each are merged with reciprocal rank fusion: a chunk
+scores sum(1 / (RRF_K + rank)) over the rankings it appears in.
+
+With TWO_STAGE_RETRIEVAL on, a query is first matched against the chat's
+per-file summaries (see summaries.py), and the summarized files other than
+the SUMMARY_TOP_FILES closest ones are left out of the chunk search. Files
+with no summary (uploaded before summaries existed, or whose summary could
+not be stored) are always searched; a chat with no more summarized files than
+SUMMARY_TOP_FILES is searched whole. Questions about the documents as a whole ("summarize these
+files") are answered from the summaries alone, without a chunk search.
+
+Request handlers go through `aembed_query` and `aretrieve`, which coalesce
+queries arriving within RETRIEVAL_BATCH_WINDOW_MS of each other: all of them
+are embedded in one call, and those for the same chat share one search.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import lexical
+import metrics
+from batching import MicroBatcher
+from chroma_connection import get_query_embedding_function, get_summary_collection
+
+DEFAULT_N_RESULTS = 5
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() in ("1", "true", "yes")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Threads running keyword searches alongside the vector queries.
+LEXICAL_SEARCH_THREADS = int(os.getenv("LEXICAL_SEARCH_THREADS", "8"))
+# Page size when reading a chat's chunks back from Chroma to build its index.
+INDEX_LOAD_PAGE = 1000
+# How long the first query of a batch waits for others to join it; 0 turns batching off.
+RETRIEVAL_BATCH_WINDOW_MS = float(os.getenv("RETRIEVAL_BATCH_WINDOW_MS", "2"))
+RETRIEVAL_BATCH_MAX_SIZE = int(os.getenv("RETRIEVAL_BATCH_MAX_SIZE", "32"))
+TWO_STAGE_RETRIEVAL = os.getenv("TWO_STAGE_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+# Files whose chunks are searched per query, picked by their summaries.
+SUMMARY_TOP_FILES = int(os.getenv("SUMMARY_TOP_FILES", "3"))
+# Summaries put into the prompt for an overview question.
+SUMMARY_OVERVIEW_FILES = int(os.getenv("SUMMARY_OVERVIEW_FILES", "10"))
+
+# Questions about the uploaded documents as a whole rather than something in them.
+_DOCUMENTS = r"(?:the |this |these |my |all |each |every |uploaded )*(?:documents?|files?|pdfs?|uploads?)"
+_OVERVIEW_QUESTION = re.compile(
+    rf"\bsummari[sz]e(?: {_DOCUMENTS}| it| them)?\W*$"
+    rf"|\bsummar(?:y|ies|i[sz]e) (?:of )?{_DOCUMENTS}\b"
+    rf"|\b(?:overview|tl;?dr|gist|main points|key points) (?:of|in) {_DOCUMENTS}\b"
+    rf"|\bwhat (?:is|are|'s) {_DOCUMENTS} about\b"
+    rf"|\bwhat {_DOCUMENTS} (?:do i have|did i upload|are there)\b",
+    re.IGNORECASE,
+)
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_SEARCH_LATENCY = metrics.histogram("lexical_search_seconds")
+# Where each fused result came from: "both", "vector" or "lexical".
+RETRIEVAL_SOURCES = metrics.counter("retrieval_sources")
+# Queries answered by one search call; one batch makes a call per chat in it.
+SEARCH_QUERIES_PER_CALL = metrics.histogram("vector_search_queries_per_call", metrics.BATCH_BUCKETS)
+# How each query was answered: "overview", "two_stage" or "flat".
+RETRIEVAL_MODES = metrics.counter("retrieval_modes")
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def chat_filter(user_id: int, chat_id: str) -> Dict[str, Any]:
+    """Chroma `where` clause limiting a search to one user's chat."""
+    return {"$and": [{"user_id": str(user_id)}, {"chat_id": chat_id}]}
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=LEXICAL_SEARCH_THREADS, thread_name_prefix="lexical")
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def embed_queries(queries: List[str]):
+    return get_query_embedding_function()(queries)
+
+
+def is_overview_question(query: str) -> bool:
+    return bool(_OVERVIEW_QUESTION.search(query.strip()))
+
+
+def select_files(user_id: int, chat_id: str, query_embeddings) -> List[Tuple[str, ...] | None]:
+    """
+    The summarized files to leave out of each query's chunk search: all but the
+    SUMMARY_TOP_FILES whose summaries are closest to it. None where the chat
+    has no more than SUMMARY_TOP_FILES summarized files. Files without a
+    summary are never left out.
+    """
+    summary_collection = get_summary_collection()
+    where = chat_filter(user_id, chat_id)
+    stored = summary_collection.get(where=where, include=["metadatas"])
+    summarized = {metadata["filename"] for metadata in stored["metadatas"] or []}
+    if len(summarized) <= SUMMARY_TOP_FILES:
+        return [None] * len(query_embeddings)
+    found = summary_collection.query(
+        query_embeddings=query_embeddings,
+        n_results=SUMMARY_TOP_FILES,
+        where=where,
+        include=["metadatas"],
+    )
+    return [tuple(sorted(summarized - {m["filename"] for m in metadatas})) for metadatas in found["metadatas"]]
+
+
+def overview(user_id: int, chat_id: str, query_embedding) -> Dict[str, Any] | None:
+    """The chat's file summaries as a query result for one query, closest first, or None if it has none."""
+    with metrics.span("summary_query", user=user_id, chat=chat_id):
+        found = get_summary_collection().query(
+            query_embeddings=[query_embedding],
+            n_results=SUMMARY_OVERVIEW_FILES,
+            where=chat_filter(user_id, chat_id),
+        )
+    if not found["ids"] or not found["ids"][0]:
+        return None
+    return {
+        "ids": found["ids"],
+        "documents": [[f"Summary: {document}" for document in found["documents"][0]]],
+        "metadatas": found["metadatas"],
+        "distances": found["distances"],
+    }
+
+
+def _chunk_filter(user_id: int, chat_id: str, skipped: Tuple[str, ...] | None) -> Dict[str, Any]:
+    where = chat_filter(user_id, chat_id)
+    if skipped:
+        where = {"$and": where["$and"] + [{"filename": {"$nin": list(skipped)}}]}
+    return where
+
+
+def retrieve(collection, queries: List[str], user_id: int, chat_id: str, n_results: int = DEFAULT_N_RESULTS, query_embeddings=None) -> Dict[str, Any]:
+    """
+    Search the chat's chunks for each of `queries`.
+
+    Pass `query_embeddings` when the caller already embedded the queries.
+    Returns Chroma's query result: one list of ids/documents/metadatas/distances per query.
+    Chunks found only by keyword search have a distance of None.
+    """
+    if query_embeddings is None:
+        query_embeddings = embed_queries(queries)
+    if not TWO_STAGE_RETRIEVAL:
+        RETRIEVAL_MODES.inc("flat", len(queries))
+        return _search(collection, queries, user_id, chat_id, n_results, query_embeddings)
+
+    try:
+        with metrics.span("file_selection", user=user_id, chat=chat_id):
+            selections = select_files(user_id, chat_id, query_embeddings)
+    except Exception as e:
+        logger.warning("File selection failed, searching the whole chat: %s", e)
+        selections = [None] * len(queries)
+    # Queries that left out the same files share one search.
+    groups: Dict[Tuple[str, ...] | None, List[int]] = {}
+    for i, skipped in enumerate(selections):
+        groups.setdefault(skipped, []).append(i)
+        RETRIEVAL_MODES.inc("flat" if skipped is None else "two_stage")
+    if len(groups) == 1:
+        return _search(collection, queries, user_id, chat_id, n_results, query_embeddings, next(iter(groups)))
+
+    merged: Dict[str, List[Any]] = {key: [None] * len(queries) for key in ("ids", "documents", "metadatas", "distances")}
+    for skipped, indices in groups.items():
+        result = _search(
+            collection, [queries[i] for i in indices], user_id, chat_id, n_results, [query_embeddings[i] for i in indices], skipped,
+        )
+        for key, values in merged.items():
+            for position, i in enumerate(indices):
+                values[i] = (result.get(key) or [[]] * len(indices))[position]
+    return merged
+
+
+def _search(collection, queries: List[str], user_id: int, chat_id: str, n_results: int, query_embeddings, skipped: Tuple[str, ...] | None = None) -> Dict[str, Any]:
+    """Vector or hybrid search of the chat's chunks, leaving out the files in `skipped`."""
+    where = _chunk_filter(user_id, chat_id, skipped)
+    if not HYBRID_SEARCH:
+        with metrics.span("vector_query", user=user_id, chat=chat_id):
+            return collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where,
+            )
+
+    candidates = max(n_results, HYBRID_CANDIDATES)
+    keyword = get_executor().submit(lexical_search, collection, queries, user_id, chat_id, candidates)
+    with metrics.span("vector_query", user=user_id, chat=chat_id):
+        dense = collection.query(
+            query_embeddings=query_embeddings,
+            n_results=candidates,
+            where=where,
+        )
+    try:
+        keyword_hits = keyword.result()
+    except Exception as e:
+        logger.warning("Keyword search failed, using vector results only: %s", e)
+        keyword_hits = [[] for _ in queries]
+    return _fuse_results(collection, dense, keyword_hits, n_results, skipped)
+
+
+def _load_chat(collection, user_id: int, chat_id: str):
+    offset = 0
+    while True:
+        page = collection.get(where=chat_filter(user_id, chat_id), include=["documents"], limit=INDEX_LOAD_PAGE, offset=offset)
+        if page["ids"]:
+            yield page["ids"], page["documents"]
+        if len(page["ids"]) < INDEX_LOAD_PAGE:
+            return
+        offset += len(page["ids"])
+
+
+def lexical_search(collection, queries: List[str], user_id: int, chat_id: str, k: int) -> List[List[Tuple[str, float]]]:
+    """BM25 (id, score) hits per query, building the chat's index from Chroma if needed."""
+    started = time.perf_counter()
+    index = lexical.get_index(user_id, chat_id, lambda: _load_chat(collection, user_id, chat_id))
+    hits = [index.search(query, k) for query in queries]
+    LEXICAL_SEARCH_LATENCY.observe(time.perf_counter() - started)
+    return hits
+
+
+def rrf(rankings: List[List[str]], n: int, k: int | None = None) -> List[str]:
+    """Reciprocal rank fusion of several rankings of ids; ties keep first-seen order."""
+    k = RRF_K if k is None else k
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking, start=1):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda id_: -scores[id_])[:n]
+
+
+def _fuse_results(
+    collection, dense: Dict[str, Any], keyword_hits: List[List[Tuple[str, float]]], n_results: int,
+    skipped: Tuple[str, ...] | None = None,
+) -> Dict[str, Any]:
+    records: Dict[str, Tuple[Any, Any, Any]] = {}
+    for ids, documents, metadatas, distances in zip(dense["ids"], dense["documents"], dense["metadatas"], dense["distances"]):
+        for record in zip(ids, documents, metadatas, distances):
+            records[record[0]] = record[1:]
+
+    if skipped:
+        # The keyword index covers the whole chat; drop hits in the files left out.
+        unknown = list({id_ for hits in keyword_hits for id_, _ in hits if id_ not in records})
+        if unknown:
+            found = collection.get(ids=unknown, include=["documents", "metadatas"])
+            for id_, document, metadata in zip(found["ids"], found["documents"], found["metadatas"]):
+                records[id_] = (document, metadata, None)
+        excluded = set(skipped)
+        keyword_hits = [
+            [(id_, score) for id_, score in hits if id_ in records and (records[id_][1] or {}).get("filename") not in excluded]
+            for hits in keyword_hits
+        ]
+
+    fused = []
+    for dense_ids, hits in zip(dense["ids"], keyword_hits):
+        keyword_ids = [id_ for id_, _ in hits]
+        ranking = rrf([dense_ids, keyword_ids], n_results)
+        dense_set, keyword_set = set(dense_ids), set(keyword_ids)
+        for id_ in ranking:
+            RETRIEVAL_SOURCES.inc("both" if id_ in dense_set and id_ in keyword_set else "vector" if id_ in dense_set else "lexical")
+        fused.append(ranking)
+
+    # Keyword-only hits weren't in the vector results; fetch their text in one call.
+    missing = list({id_ for ranking in fused for id_ in ranking if id_ not in records})
+    if missing:
+        found = collection.get(ids=missing, include=["documents", "metadatas"])
+        for id_, document, metadata in zip(found["ids"], found["documents"], found["metadatas"]):
+            records[id_] = (document, metadata, None)
+    # Ids the index still had but Chroma no longer does are dropped.
+    fused = [[id_ for id_ in ranking if id_ in records] for ranking in fused]
+    return {
+        "ids": fused,
+        "documents": [[records[id_][0] for id_ in ranking] for ranking in fused],
+        "metadatas": [[records[id_][1] for id_ in ranking] for ranking in fused],
+        "distances": [[records[id_][2] for id_ in ranking] for ranking in fused],
+    }
+
+
+
+class SearchRequest(NamedTuple):
+    collection: Any
+    query: str
+    user_id: int
+    chat_id: str
+    n_results: int
+    embedding: Any
+
+
+# Keys of a query result that hold one list per query.
+_PER_QUERY_KEYS = ("ids", "documents", "metadatas", "distances", "embeddings")
+
+
+def _nth(results: Dict[str, Any], i: int) -> Dict[str, Any]:
+    """The single-query result for the `i`th query of a batched result."""
+    return {key: [value[i]] if key in _PER_QUERY_KEYS and value is not None else value for key, value in results.items()}
+
+
+async def _embed_batch(queries: List[str]) -> List[Any]:
+    loop = asyncio.get_running_loop()
+    return list(await loop.run_in_executor(None, embed_queries, queries))
+
+
+async def _search_batch(requests: List[SearchRequest]) -> List[Any]:
+    # A search can only carry one `where` filter, so queries are grouped by chat.
+    groups: Dict[Tuple[int, int, str, int], List[int]] = {}
+    for i, request in enumerate(requests):
+        groups.setdefault((id(request.collection), request.user_id, request.chat_id, request.n_results), []).append(i)
+
+    loop = asyncio.get_running_loop()
+
+    def search(indices: List[int]) -> Dict[str, Any]:
+        first = requests[indices[0]]
+        SEARCH_QUERIES_PER_CALL.observe(len(indices))
+        return retrieve(
+            first.collection, [requests[i].query for i in indices], first.user_id, first.chat_id, first.n_results,
+            query_embeddings=[requests[i].embedding for i in indices],
+        )
+
+    outcomes = await asyncio.gather(
+        *(loop.run_in_executor(None, search, indices) for indices in groups.values()), return_exceptions=True
+    )
+    results: List[Any] = [None] * len(requests)
+    for indices, outcome in zip(groups.values(), outcomes):
+        for position, i in enumerate(indices):
+            results[i] = outcome if isinstance(outcome, BaseException) else _nth(outcome, position)
+    return results
+
+
+_embed_batcher = MicroBatcher("query_embedding", _embed_batch, RETRIEVAL_BATCH_WINDOW_MS / 1000, RETRIEVAL_BATCH_MAX_SIZE)
+_search_batcher = MicroBatcher("vector_search", _search_batch, RETRIEVAL_BATCH_WINDOW_MS / 1000, RETRIEVAL_BATCH_MAX_SIZE)
+
+
+async def aembed_query(query: str):
+    """The query-mode embedding of `query`, embedded together with concurrent queries."""
+    if RETRIEVAL_BATCH_WINDOW_MS <= 0:
+        return (await _embed_batch([query]))[0]
+    return await _embed_batcher.submit(query)
+
+
+async def aretrieve(collection, query: str, user_id: int, chat_id: str, query_embedding, n_results: int = DEFAULT_N_RESULTS) -> Dict[str, Any]:
+    """
+    `retrieve` for one query, searched together with concurrent queries for the
+    same chat. Overview questions get the chat's file summaries instead.
+    """
+    if TWO_STAGE_RETRIEVAL and is_overview_question(query):
+        loop = asyncio.get_running_loop()
+        try:
+            summary_results = await loop.run_in_executor(None, overview, user_id, chat_id, query_embedding)
+        except Exception as e:
+            logger.warning("Summary lookup failed, searching chunks: %s", e)
+            summary_results = None
+        if summary_results is not None:
+            RETRIEVAL_MODES.inc("overview")
+            return summary_results
+    request = SearchRequest(collection, query, user_id, chat_id, n_results, query_embedding)
+    if RETRIEVAL_BATCH_WINDOW_MS > 0:
+        return await _search_batcher.submit(request)
+    result = (await _search_batch([request]))[0]
+    if isinstance(result, BaseException):
+        raise result
+    return result
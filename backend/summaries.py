@@ -0,0 +1,146 @@
+"""
+Per-file summaries, written when an upload completes.
+
+The opening SUMMARY_SOURCE_TOKENS of a file's text are summarized by
+SUMMARY_MODEL (or, with SUMMARY_MODE=extractive, cut down to their leading
+sentences), and the summary is embedded and stored as one record per file in
+the summary collection. Retrieval uses these records to pick which files to
+search before looking at chunks, and answers overview questions from them
+alone (see retrieval.py).
+
+Re-uploading an unchanged file keeps its summary; an edited one gets a new
+summary that replaces the old record.
+"""
+import hashlib
+import logging
+import os
+import re
+from typing import Any, Callable, List, Optional
+
+from chroma_connection import get_summary_collection
+from chunking import TextChunk, get_encoding
+from llm_clients import get_llm
+from retrieval import chat_filter
+
+# llm, extractive, or off (no summaries; retrieval then searches whole chats).
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "llm")
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "nvidia/llama3-chatqa-1.5-8b")
+SUMMARY_SOURCE_TOKENS = int(os.getenv("SUMMARY_SOURCE_TOKENS", "3000"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "200"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+logger = logging.getLogger(__name__)
+
+
+class SourceText:
+    """The opening text of a document, up to `limit` tokens, gathered from its chunks as they are made."""
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = SUMMARY_SOURCE_TOKENS if limit is None else limit
+        self.tokens = 0
+        self._parts: List[str] = []
+        self._end = 0
+
+    def add(self, chunk: TextChunk) -> None:
+        if self.tokens >= self.limit:
+            return
+        # Overlapping chunks repeat text; only keep what's past the previous one.
+        self._parts.append(chunk.text[max(0, self._end - chunk.start):])
+        self._end = max(self._end, chunk.end)
+        self.tokens += chunk.tokens
+
+    def text(self) -> str:
+        return "".join(self._parts)
+
+
+def summary_id(user_id: int, chat_id: str, filename: str) -> str:
+    key = f"{user_id}\0{chat_id}\0{filename}\0summary"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    encoding = get_encoding()
+    tokens = encoding.encode_ordinary(text)
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def extractive_summary(text: str, max_tokens: Optional[int] = None) -> str:
+    """The leading sentences of `text`, up to `max_tokens`."""
+    max_tokens = max_tokens or SUMMARY_MAX_TOKENS
+    encoding = get_encoding()
+    sentences, used = [], 0
+    for sentence in _SENTENCE_END.split(" ".join(text.split())):
+        cost = len(encoding.encode_ordinary(sentence)) + 1
+        if used + cost > max_tokens:
+            if not sentences:
+                sentences.append(_truncate(sentence, max_tokens))
+            break
+        sentences.append(sentence)
+        used += cost
+    return " ".join(sentences)
+
+
+def llm_summary(filename: str, text: str) -> str:
+    prompt = f"""
+Summarize the following document in at most five sentences. Say what kind of document it is,
+what it is about and its main points, so a reader can tell whether it answers their question.
+
+Document name: {filename}
+
+{text}
+"""
+    response = get_llm(SUMMARY_MODEL).invoke(prompt)
+    return _truncate(getattr(response, "content", str(response)).strip(), SUMMARY_MAX_TOKENS)
+
+
+def summarize(filename: str, text: str) -> str:
+    """A summary of `text` per SUMMARY_MODE; falls back to the extractive one if the LLM call fails."""
+    text = _truncate(text, SUMMARY_SOURCE_TOKENS)
+    if SUMMARY_MODE == "llm":
+        try:
+            return llm_summary(filename, text) or extractive_summary(text)
+        except Exception as e:
+            logger.warning("Summarizing %s with %s failed, using its opening sentences: %s", filename, SUMMARY_MODEL, e)
+    return extractive_summary(text)
+
+
+def store_summary(
+    user_id: int, chat_id: str, filename: str, source: SourceText, embed: Callable[[List[str]], Any], **metadata: Any
+) -> bool:
+    """
+    Summarize, embed and store the file's summary; returns whether a new one was written.
+
+    `metadata` (job_id, file_hash, content_type, chunk and page counts) is kept
+    on the record. A stored summary of the same file_hash is left as it is.
+    """
+    if SUMMARY_MODE == "off" or not source.text().strip():
+        return False
+    collection = get_summary_collection()
+    id_ = summary_id(user_id, chat_id, filename)
+    stored = collection.get(ids=[id_], include=["metadatas"])
+    if stored["ids"]:
+        old = (stored["metadatas"] or [{}])[0] or {}
+        if metadata.get("file_hash") and old.get("file_hash") == metadata["file_hash"]:
+            if metadata.get("job_id") and old.get("job_id") != metadata["job_id"]:
+                # The new upload owns it now, so cancelling the old job leaves it in place.
+                collection.update(ids=[id_], metadatas=[{"job_id": metadata["job_id"]}])
+            return False
+    summary = summarize(filename, source.text())
+    record = {"user_id": str(user_id), "chat_id": chat_id, "filename": filename, **{k: v for k, v in metadata.items() if v is not None}}
+    embeddings = embed([summary])
+    if stored["ids"]:
+        collection.delete(ids=[id_])
+    collection.add(ids=[id_], documents=[summary], metadatas=[record], embeddings=embeddings)
+    return True
+
+
+def delete_summaries(user_id: int, chat_id: Optional[str] = None) -> None:
+    """Remove the chat's summaries, or all of the user's with `chat_id=None`."""
+    where = chat_filter(user_id, chat_id) if chat_id is not None else {"user_id": str(user_id)}
+    get_summary_collection().delete(where=where)
+
+
+def forget_job(job_id: str) -> None:
+    """Remove the summaries a job wrote."""
+    get_summary_collection().delete(where={"job_id": job_id})
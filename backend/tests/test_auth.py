@@ -0,0 +1,19 @@
+from fastapi.testclient import TestClient
+
+import database
+import main
+
+
+def test_a_session_token_does_not_replace_the_password():
+    database.configure("sqlite://")
+    with TestClient(main.app) as client:
+        client.post("/register/", json={"username": "grace", "password": "correct horse"}).raise_for_status()
+        token = client.post("/login/", json={"username": "grace", "password": "correct horse"}).json()["access_token"]
+        bearer = {"Authorization": f"Bearer {token}"}
+
+        assert client.post("/login/", json={"username": "grace", "password": "wrong"}, headers=bearer).status_code == 401
+
+        refreshed = client.post("/session/refresh/", headers=bearer)
+        assert refreshed.status_code == 200, refreshed.text
+        assert refreshed.json()["user_id"] == 1
+        assert client.post("/session/refresh/", headers={"Authorization": "Bearer not-a-token"}).status_code == 401
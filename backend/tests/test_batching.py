@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_exception_results_are_raised_in_their_callers_only():
+    async def handler(items):
+        return [asyncio.CancelledError() if item == "cancelled" else ValueError(item) if item == "bad" else item.upper() for item in items]
+
+    async def main():
+        batcher = MicroBatcher("test", handler, window=0.01, max_size=8)
+        return await asyncio.gather(
+            batcher.submit("ok"), batcher.submit("bad"), batcher.submit("cancelled"), return_exceptions=True,
+        )
+
+    ok, bad, cancelled = asyncio.run(main())
+    assert ok == "OK"
+    assert isinstance(bad, ValueError)
+    assert isinstance(cancelled, asyncio.CancelledError)
+
+
+def test_cancelled_batch_fails_its_callers():
+    async def handler(items):
+        raise asyncio.CancelledError()
+
+    async def main():
+        batcher = MicroBatcher("test_cancelled", handler, window=0.01, max_size=8)
+        await asyncio.wait_for(batcher.submit("item"), timeout=1)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(main())
@@ -0,0 +1,18 @@
+import tiktoken
+
+import chunking
+
+
+def byte_encoding():
+    # One token per byte, so the test needs no downloaded vocabulary.
+    return tiktoken.Encoding("bytes", pat_str=r".", mergeable_ranks={bytes([b]): b for b in range(256)}, special_tokens={})
+
+
+def test_fixed_chunks_without_overlap_end_on_a_window_boundary(monkeypatch):
+    monkeypatch.setattr(chunking, "_encoding", byte_encoding())
+    text = "abcd" * 20
+    chunks = list(chunking.chunk_document([(0, text[:40]), (1, text[40:])], "fixed", chunk_size=10, overlap=0))
+
+    assert [c.text for c in chunks] == [text[i:i + 10] for i in range(0, 80, 10)]
+    assert [(c.start, c.end) for c in chunks] == [(i, i + 10) for i in range(0, 80, 10)]
+    assert [c.page_start for c in chunks] == [0, 0, 0, 0, 1, 1, 1, 1]
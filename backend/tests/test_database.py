@@ -0,0 +1,15 @@
+from fastapi.testclient import TestClient
+
+import database
+import main
+
+
+def test_register_and_login_with_in_memory_sqlite():
+    database.configure("sqlite://")
+    with TestClient(main.app) as client:
+        registered = client.post("/register/", json={"username": "ada", "password": "correct horse"})
+        assert registered.status_code == 200, registered.text
+        login = client.post("/login/", json={"username": "ada", "password": "correct horse"})
+        assert login.status_code == 200, login.text
+        assert login.json()["user_id"] == registered.json()["id"]
+        assert client.post("/login/", json={"username": "ada", "password": "wrong"}).status_code == 401
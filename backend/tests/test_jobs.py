@@ -0,0 +1,51 @@
+import chroma_connection
+import chunk_manifest
+import database
+import jobs
+import summaries
+from chunking import TextChunk
+from vector_store import NumpyCollection
+
+
+def add_chunks(collection, ids, job_id):
+    collection.add(
+        ids=ids,
+        documents=[f"text of {id_}" for id_ in ids],
+        metadatas=[{"user_id": "1", "chat_id": "jobs", "filename": "report.txt", "job_id": job_id} for _ in ids],
+        embeddings=[[1.0, 0.0] for _ in ids],
+    )
+    chunk_manifest.record(1, "jobs", job_id, ids)
+
+
+def test_cancelling_an_older_upload_keeps_the_chunks_a_newer_one_reused(monkeypatch):
+    database.configure("sqlite://")
+    database.init_db()
+    collection, summary_collection = NumpyCollection("chunks"), NumpyCollection("summaries")
+    monkeypatch.setattr(chroma_connection, "_summary_collection", summary_collection)
+    db = database.SessionLocal()
+    db.add_all([
+        jobs.IngestionJob(id=job_id, user_id=1, chat_id="jobs", filename="report.txt", status="completed")
+        for job_id in ("old", "new")
+    ])
+    db.commit()
+    db.close()
+
+    # The first upload wrote two chunks and the summary; the second reused them and added one.
+    add_chunks(collection, ["a", "b"], "old")
+    summary_collection.add(
+        ids=[summaries.summary_id(1, "jobs", "report.txt")], documents=["A report."],
+        metadatas=[{"user_id": "1", "chat_id": "jobs", "filename": "report.txt", "job_id": "old", "file_hash": "h"}],
+        embeddings=[[1.0, 0.0]],
+    )
+    add_chunks(collection, ["c"], "new")
+    jobs._adopt_chunks(collection, 1, "jobs", "new", {"a", "b", "c"})
+    source = summaries.SourceText()
+    source.add(TextChunk("A report.", 0, 9, 0, 0, 3))
+    assert not summaries.store_summary(1, "jobs", "report.txt", source, lambda texts: [[1.0, 0.0]], job_id="new", file_hash="h")
+
+    old = database.SessionLocal().get(jobs.IngestionJob, "old")
+    assert jobs.cancel_job(old, collection) == "cancelled"
+
+    assert sorted(collection.get(where={"chat_id": "jobs"}, include=[])["ids"]) == ["a", "b", "c"]
+    assert chunk_manifest.count(1, "jobs") == 3
+    assert summary_collection.count() == 1
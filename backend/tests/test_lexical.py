@@ -0,0 +1,28 @@
+import pytest
+
+import lexical
+
+
+def _load():
+    yield ["a:0"], ["alpha beta"]
+
+
+def test_build_locks_are_released_with_their_index(monkeypatch):
+    monkeypatch.setattr(lexical, "LEXICAL_INDEX_MAX_CHATS", 2)
+    for chat in range(5):
+        lexical.get_index("lexical-user", chat, _load)
+    assert len([k for k in lexical._building if k[0] == "lexical-user"]) == 2
+
+    lexical.drop("lexical-user")
+    assert not [k for k in lexical._building if k[0] == "lexical-user"]
+    assert not [k for k in lexical._indexes if k[0] == "lexical-user"]
+
+
+def test_failed_build_releases_its_lock():
+    def load():
+        raise RuntimeError("store unavailable")
+        yield
+
+    with pytest.raises(RuntimeError):
+        lexical.get_index("lexical-user", "broken", load)
+    assert ("lexical-user", "broken") not in lexical._building
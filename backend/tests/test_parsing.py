@@ -0,0 +1,51 @@
+import pytest
+
+import parse_cache
+import parsing
+from bench.fixtures import write_pdf
+
+
+def test_csv_segments_are_numbered_by_bytes_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(parse_cache, "PARSE_CACHE_PATH", "")
+    monkeypatch.setattr(parsing, "TEXT_BLOCK_SIZE", 64)
+    path = tmp_path / "table.csv"
+    # Multi-byte characters make characters and bytes diverge.
+    path.write_bytes(("name,note\r\n" + 'Zoë,"naïve, «quoted»\r\nsecond line"\r\n' * 40).encode("utf-8"))
+
+    total, segments = parsing.parse_document(str(path), "text/csv")
+    segments = list(segments)
+
+    numbers = [number for number, _ in segments]
+    assert numbers == sorted(set(numbers))
+    assert numbers[-1] < total
+    text = "".join(text for _, text in segments)
+    assert text.count("name: Zoë; note: naïve, «quoted»\r\nsecond line\n\n") == 40
+
+
+def test_a_pdf_timeout_leaves_other_documents_on_the_pool_running(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsing, "PDF_MIN_PAGES_PER_SHARD", 4)
+    slow, other = str(tmp_path / "slow.pdf"), str(tmp_path / "other.pdf")
+    write_pdf(slow, 8)
+    write_pdf(other, 32)
+    try:
+        pages = parsing._iter_pdf_shards(other, 32, 2, 60)
+        first = next(pages)
+        # Times out at once, while the other document still has shards on the pool.
+        with pytest.raises(parsing.DocumentRejected):
+            next(parsing._iter_pdf_shards(slow, 8, 2, 0))
+        numbers = [first[0]] + [number for number, _ in pages]
+        assert numbers == list(range(32))
+    finally:
+        parsing.shutdown_pdf_pool()
+
+
+def test_inline_pdf_extraction_is_timed_out_too(tmp_path, monkeypatch):
+    monkeypatch.setattr(parse_cache, "PARSE_CACHE_PATH", "")
+    monkeypatch.setattr(parsing, "PDF_EXTRACT_WORKERS", 0)
+    monkeypatch.setattr(parsing, "PDF_EXTRACT_TIMEOUT", 0)
+    path = str(tmp_path / "doc.pdf")
+    write_pdf(path, 4)
+
+    _, segments = parsing.parse_document(path, "application/pdf")
+    with pytest.raises(parsing.DocumentRejected):
+        list(segments)
@@ -0,0 +1,62 @@
+import chroma_connection
+import retrieval
+from vector_store import NumpyCollection
+
+DIM = 8
+
+
+def unit(*weights):
+    vector = [0.0] * DIM
+    for axis, weight in weights:
+        vector[axis] = weight
+    return vector
+
+
+def add_file(collection, chat_id, filename, axis, chunks=2):
+    collection.add(
+        ids=[f"{filename}-{i}" for i in range(chunks)],
+        documents=[f"{filename} chunk {i}" for i in range(chunks)],
+        metadatas=[{"user_id": "1", "chat_id": chat_id, "filename": filename, "chunk_number": i} for i in range(chunks)],
+        embeddings=[unit((axis, 1.0)) for _ in range(chunks)],
+    )
+
+
+def add_summary(summary_collection, chat_id, filename, axis):
+    summary_collection.add(
+        ids=[f"summary-{filename}"],
+        documents=[f"About {filename}"],
+        metadatas=[{"user_id": "1", "chat_id": chat_id, "filename": filename}],
+        embeddings=[unit((axis, 1.0))],
+    )
+
+
+def test_two_stage_retrieval_still_searches_files_without_a_summary(monkeypatch):
+    chunks, summary_collection = NumpyCollection("chunks"), NumpyCollection("summaries")
+    monkeypatch.setattr(chroma_connection, "_summary_collection", summary_collection)
+    monkeypatch.setattr(retrieval, "TWO_STAGE_RETRIEVAL", True)
+    monkeypatch.setattr(retrieval, "HYBRID_SEARCH", False)
+    monkeypatch.setattr(retrieval, "SUMMARY_TOP_FILES", 3)
+    chat_id = "two-stage"
+    # Five summarized files, so selection kicks in, and one uploaded before summaries existed.
+    for axis in range(5):
+        add_file(chunks, chat_id, f"file-{axis}.txt", axis)
+        add_summary(summary_collection, chat_id, f"file-{axis}.txt", axis)
+    add_file(chunks, chat_id, "legacy.txt", 6)
+
+    # Closest to the unsummarized file; among summaries, files 0-2 win.
+    query = unit((6, 1.0), (0, 0.3), (1, 0.2), (2, 0.1), (3, 0.05), (4, 0.05))
+    result = retrieval.retrieve(chunks, ["question"], 1, chat_id, n_results=4, query_embeddings=[query])
+
+    files = [metadata["filename"] for metadata in result["metadatas"][0]]
+    assert files[:2] == ["legacy.txt", "legacy.txt"]
+    # Summarized files that weren't picked are still left out.
+    assert not {"file-3.txt", "file-4.txt"} & set(files)
+
+
+def test_select_files_skips_nothing_in_small_chats(monkeypatch):
+    summary_collection = NumpyCollection("summaries")
+    monkeypatch.setattr(chroma_connection, "_summary_collection", summary_collection)
+    monkeypatch.setattr(retrieval, "SUMMARY_TOP_FILES", 3)
+    for axis in range(3):
+        add_summary(summary_collection, "small", f"file-{axis}.txt", axis)
+    assert retrieval.select_files(1, "small", [unit((0, 1.0))]) == [None]
@@ -0,0 +1,142 @@
+"""
+User accounts, and a small TTL cache in front of the users table.
+
+Every login looks its user up by username, so the rows are cached by both
+username and id for USER_CACHE_TTL seconds, USER_CACHE_MAX_ENTRIES at most
+(least recently used first out). Only users that exist are cached, so a
+username registered a moment ago is never reported missing; registering
+drops any entry for that username anyway. Entries are plain snapshots, not ORM
+objects, so they can outlive the session they were read with.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+
+from sqlalchemy import Column, Integer, String, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Base
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, unique=True, index=True)
+    hashed_password = Column(String)
+
+
+class CachedUser(NamedTuple):
+    id: int
+    username: str
+    hashed_password: str
+
+
+class UserCache:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # ("id", id) or ("username", username) -> (stored at, user)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key: tuple) -> Optional[CachedUser]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def by_id(self, user_id: int) -> Optional[CachedUser]:
+        return self._get(("id", user_id))
+
+    def by_username(self, username: str) -> Optional[CachedUser]:
+        return self._get(("username", username))
+
+    def put(self, user: CachedUser) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key in (("id", user.id), ("username", user.username)):
+                self._entries[key] = (now, user)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: Optional[str] = None, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            for key in (("username", username), ("id", user_id)):
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    # Drop the user's other key too.
+                    self._entries.pop(("id", entry[1].id), None)
+                    self._entries.pop(("username", entry[1].username), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+_cache: UserCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_user_cache() -> UserCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = UserCache(USER_CACHE_TTL, USER_CACHE_MAX_ENTRIES)
+    return _cache
+
+
+def _snapshot(user: Optional[User]) -> Optional[CachedUser]:
+    if user is None:
+        return None
+    cached = CachedUser(user.id, user.username, user.hashed_password)
+    get_user_cache().put(cached)
+    return cached
+
+
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[CachedUser]:
+    cached = get_user_cache().by_username(username)
+    if cached is not None:
+        return cached
+    return _snapshot((await db.execute(select(User).where(User.username == username))).scalars().first())
+
+
+async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[CachedUser]:
+    cached = get_user_cache().by_id(user_id)
+    if cached is not None:
+        return cached
+    return _snapshot(await db.get(User, user_id))
+
+
+async def create_user(db: AsyncSession, username: str, hashed_password: str) -> User:
+    user = User(username=username, hashed_password=hashed_password)
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    get_user_cache().invalidate(username=username, user_id=user.id)
+    return user
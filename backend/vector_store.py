@@ -0,0 +1,365 @@
+"""
+In-process vector store with the subset of Chroma's Collection API the app uses
+(add, update, get, query, delete, count).
+
+Chunks are partitioned by (user_id, chat_id), and every partition keeps its
+vectors in one contiguous float32 matrix, so a search filtered to a chat is a
+single matrix-vector product over that chat's rows: no network round-trip and
+no index to maintain. Deleted rows are masked out and a partition is compacted
+once more than half its rows are dead. Vectors are normalized on insert and
+distances are cosine distances (1 - similarity); for the normalized vectors
+NVIDIA's embedders return, that ranks exactly like Chroma's default L2.
+
+With a path, the store is loaded from there on startup (vectors memory-mapped
+until the partition is first written to) and saved back by `save()`.
+"""
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+INITIAL_CAPACITY = 64
+INCLUDE_DEFAULT = ("documents", "metadatas")
+QUERY_INCLUDE_DEFAULT = ("documents", "metadatas", "distances")
+
+
+def _matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Chroma `where` semantics for $and, $or and $eq/$ne/$in/$nin (or a bare value)."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(_matches(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if op == "$eq" and value != operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _equalities(where: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Top-level `key == value` conditions, including those inside a top-level $and."""
+    found: Dict[str, Any] = {}
+    if not where:
+        return found
+    for key, condition in where.items():
+        if key == "$and":
+            for clause in condition:
+                found.update(_equalities(clause))
+        elif not key.startswith("$"):
+            if isinstance(condition, dict):
+                if set(condition) == {"$eq"}:
+                    found[key] = condition["$eq"]
+            else:
+                found[key] = condition
+    return found
+
+
+def _only_partition_keys(where: Optional[Dict[str, Any]]) -> bool:
+    """True when `where` says nothing beyond which partition(s) to look in."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_only_partition_keys(clause) for clause in condition):
+                return False
+        elif key not in ("user_id", "chat_id") or isinstance(condition, dict):
+            return False
+    return True
+
+
+class _Partition:
+    def __init__(self, dim: int):
+        self.ids: List[str] = []
+        self.documents: List[Optional[str]] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.vectors = np.empty((INITIAL_CAPACITY, dim), dtype=np.float32)
+        self.alive = np.zeros(INITIAL_CAPACITY, dtype=bool)
+        self.size = 0
+        self.dead = 0
+
+    def append(self, id_: str, document: Optional[str], metadata: Dict[str, Any], vector: np.ndarray) -> int:
+        if self.size == len(self.vectors) or not self.vectors.flags.writeable:
+            capacity = max(INITIAL_CAPACITY, len(self.vectors) * 2 if self.size == len(self.vectors) else len(self.vectors))
+            vectors = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+            vectors[:self.size] = self.vectors[:self.size]
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self.size] = self.alive[:self.size]
+            self.vectors, self.alive = vectors, alive
+        row = self.size
+        self.ids.append(id_)
+        self.documents.append(document)
+        self.metadatas.append(metadata)
+        self.vectors[row] = vector
+        self.alive[row] = True
+        self.size += 1
+        return row
+
+    def compact(self) -> Dict[str, int]:
+        """Drop dead rows; returns the new row of every live id."""
+        keep = np.flatnonzero(self.alive[:self.size])
+        self.ids = [self.ids[r] for r in keep]
+        self.documents = [self.documents[r] for r in keep]
+        self.metadatas = [self.metadatas[r] for r in keep]
+        capacity = max(INITIAL_CAPACITY, len(keep))
+        vectors = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+        vectors[:len(keep)] = self.vectors[keep]
+        self.vectors = vectors
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.alive[:len(keep)] = True
+        self.size = len(keep)
+        self.dead = 0
+        return {id_: row for row, id_ in enumerate(self.ids)}
+
+
+class NumpyCollection:
+    def __init__(self, name: str, embedding_function: Optional[Callable[[List[str]], Any]] = None, path: Optional[str] = None):
+        self.name = name
+        self._embedding_function = embedding_function
+        self._path = path
+        self._dim: Optional[int] = None
+        self._partitions: Dict[Tuple[str, str], _Partition] = {}
+        # id -> (partition key, row)
+        self._rows: Dict[str, Tuple[Tuple[str, str], int]] = {}
+        self._lock = threading.RLock()
+        self._generation = 0
+        if path and os.path.exists(os.path.join(path, "manifest.json")):
+            self._load()
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def _embed(self, documents: Sequence[str]) -> List[Any]:
+        if self._embedding_function is None:
+            raise ValueError("No embeddings given and the collection has no embedding function")
+        return self._embedding_function(list(documents))
+
+    def _normalized(self, embeddings: Iterable[Any]) -> np.ndarray:
+        vectors = np.asarray(list(embeddings), dtype=np.float32)
+        if vectors.ndim != 2:
+            raise ValueError("Embeddings must be a list of equal-length vectors")
+        if self._dim is None:
+            self._dim = vectors.shape[1]
+        elif vectors.shape[1] != self._dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match collection dimensionality {self._dim}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    @staticmethod
+    def _key(metadata: Dict[str, Any]) -> Tuple[str, str]:
+        return str(metadata.get("user_id", "")), str(metadata.get("chat_id", ""))
+
+    def add(self, ids, embeddings=None, metadatas=None, documents=None) -> None:
+        ids = list(ids)
+        if len(set(ids)) != len(ids):
+            raise ValueError("Expected IDs to be unique within a single add")
+        if embeddings is None:
+            embeddings = self._embed(documents)
+        with self._lock:
+            vectors = self._normalized(embeddings)
+            for i, id_ in enumerate(ids):
+                if id_ in self._rows:
+                    # Like Chroma, adding an existing id is a no-op.
+                    continue
+                metadata = dict(metadatas[i]) if metadatas else {}
+                key = self._key(metadata)
+                partition = self._partitions.get(key)
+                if partition is None:
+                    partition = self._partitions[key] = _Partition(self._dim)
+                row = partition.append(id_, documents[i] if documents else None, metadata, vectors[i])
+                self._rows[id_] = (key, row)
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None) -> None:
+        ids = list(ids)
+        if embeddings is None and documents is not None:
+            embeddings = self._embed(documents)
+        with self._lock:
+            vectors = self._normalized(embeddings) if embeddings is not None else None
+            for i, id_ in enumerate(ids):
+                if id_ not in self._rows:
+                    continue
+                key, row = self._rows[id_]
+                partition = self._partitions[key]
+                metadata = dict(partition.metadatas[row])
+                if metadatas:
+                    # Chroma merges the given keys into the stored metadata.
+                    metadata.update(metadatas[i])
+                document = documents[i] if documents else partition.documents[row]
+                vector = vectors[i] if vectors is not None else partition.vectors[row].copy()
+                if self._key(metadata) != key:
+                    self._delete_rows([id_])
+                    partition = self._partitions.setdefault(self._key(metadata), _Partition(self._dim))
+                    self._rows[id_] = (self._key(metadata), partition.append(id_, document, metadata, vector))
+                    continue
+                if not partition.vectors.flags.writeable:
+                    partition.vectors = partition.vectors.copy()
+                partition.metadatas[row] = metadata
+                partition.documents[row] = document
+                partition.vectors[row] = vector
+
+    def _partitions_for(self, where) -> List[Tuple[Tuple[str, str], _Partition]]:
+        equal = _equalities(where)
+        user_id = str(equal["user_id"]) if "user_id" in equal else None
+        chat_id = str(equal["chat_id"]) if "chat_id" in equal else None
+        if user_id is not None and chat_id is not None:
+            partition = self._partitions.get((user_id, chat_id))
+            return [((user_id, chat_id), partition)] if partition is not None else []
+        return [
+            (key, partition) for key, partition in self._partitions.items()
+            if (user_id is None or key[0] == user_id) and (chat_id is None or key[1] == chat_id)
+        ]
+
+    def _select(self, ids=None, where=None) -> List[Tuple[_Partition, int]]:
+        """(partition, row) of live records matching `ids` and `where`, in insertion order per partition."""
+        if ids is not None:
+            selected = []
+            for id_ in ids:
+                location = self._rows.get(id_)
+                if location is None:
+                    continue
+                partition = self._partitions[location[0]]
+                if _matches(partition.metadatas[location[1]], where):
+                    selected.append((partition, location[1]))
+            return selected
+        check = not _only_partition_keys(where)
+        return [
+            (partition, row)
+            for _, partition in self._partitions_for(where)
+            for row in np.flatnonzero(partition.alive[:partition.size])
+            if not check or _matches(partition.metadatas[row], where)
+        ]
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=INCLUDE_DEFAULT) -> Dict[str, Any]:
+        with self._lock:
+            selected = self._select(ids, where)
+            start = offset or 0
+            selected = selected[start:None if limit is None else start + limit]
+            return {
+                "ids": [p.ids[r] for p, r in selected],
+                "documents": [p.documents[r] for p, r in selected] if "documents" in include else None,
+                "metadatas": [dict(p.metadatas[r]) for p, r in selected] if "metadatas" in include else None,
+                "embeddings": [p.vectors[r].tolist() for p, r in selected] if "embeddings" in include else None,
+            }
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, where=None, include=QUERY_INCLUDE_DEFAULT) -> Dict[str, Any]:
+        if query_embeddings is None:
+            query_embeddings = self._embed(query_texts)
+        with self._lock:
+            queries = self._normalized(query_embeddings) if self._dim is not None else None
+            rows: List[List[Tuple[_Partition, int, float]]] = []
+            for q in range(len(query_embeddings)):
+                candidates: List[Tuple[_Partition, int, float]] = []
+                if queries is not None:
+                    check = not _only_partition_keys(where)
+                    for _, partition in self._partitions_for(where):
+                        size = partition.size
+                        mask = partition.alive[:size].copy()
+                        if check:
+                            mask &= np.fromiter((_matches(m, where) for m in partition.metadatas), dtype=bool, count=size)
+                        if not mask.any():
+                            continue
+                        similarity = partition.vectors[:size] @ queries[q]
+                        similarity[~mask] = -np.inf
+                        live = int(mask.sum())
+                        top = np.argpartition(-similarity, min(n_results, live) - 1)[:min(n_results, live)] if live > n_results else np.flatnonzero(mask)
+                        candidates.extend((partition, int(r), float(1 - similarity[r])) for r in top)
+                candidates.sort(key=lambda c: c[2])
+                rows.append(candidates[:n_results])
+            return {
+                "ids": [[p.ids[r] for p, r, _ in row] for row in rows],
+                "documents": [[p.documents[r] for p, r, _ in row] for row in rows] if "documents" in include else None,
+                "metadatas": [[dict(p.metadatas[r]) for p, r, _ in row] for row in rows] if "metadatas" in include else None,
+                "distances": [[d for _, _, d in row] for row in rows] if "distances" in include else None,
+            }
+
+    def _delete_rows(self, ids: Iterable[str]) -> None:
+        touched = set()
+        for id_ in ids:
+            location = self._rows.pop(id_, None)
+            if location is None:
+                continue
+            partition = self._partitions[location[0]]
+            partition.alive[location[1]] = False
+            partition.dead += 1
+            touched.add(location[0])
+        for key in touched:
+            partition = self._partitions[key]
+            if partition.dead == partition.size:
+                del self._partitions[key]
+            elif partition.dead > partition.size // 2:
+                self._rows.update((id_, (key, row)) for id_, row in partition.compact().items())
+
+    def delete(self, ids=None, where=None) -> None:
+        with self._lock:
+            if ids is None and where is None:
+                raise ValueError("delete needs ids or where")
+            self._delete_rows([p.ids[r] for p, r in self._select(ids, where)])
+
+    def save(self) -> None:
+        """
+        Write the store to its path: one .npy of vectors and one JSON file of
+        records per partition. Each save writes a new generation of files and
+        then swaps the manifest, so the files a loaded store still maps are
+        never overwritten.
+        """
+        if not self._path:
+            return
+        with self._lock:
+            os.makedirs(self._path, exist_ok=True)
+            self._generation += 1
+            manifest = {"dim": self._dim, "generation": self._generation, "partitions": []}
+            for n, (key, partition) in enumerate(self._partitions.items()):
+                name = f"{self._generation}-{n}"
+                live = np.flatnonzero(partition.alive[:partition.size])
+                np.save(os.path.join(self._path, name + ".npy"), np.ascontiguousarray(partition.vectors[live]))
+                records = [[partition.ids[r], partition.documents[r], partition.metadatas[r]] for r in live]
+                with open(os.path.join(self._path, name + ".json"), "w", encoding="utf-8") as f:
+                    json.dump(records, f)
+                manifest["partitions"].append({"key": list(key), "file": name})
+            tmp = os.path.join(self._path, "manifest.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp, os.path.join(self._path, "manifest.json"))
+            for filename in os.listdir(self._path):
+                if filename.endswith((".npy", ".json")) and filename != "manifest.json" and not filename.startswith(f"{self._generation}-"):
+                    try:
+                        os.remove(os.path.join(self._path, filename))
+                    except OSError:
+                        pass
+
+    def _load(self) -> None:
+        with open(os.path.join(self._path, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        self._dim = manifest["dim"]
+        self._generation = manifest.get("generation", 0)
+        for entry in manifest["partitions"]:
+            key = tuple(entry["key"])
+            with open(os.path.join(self._path, entry["file"] + ".json"), encoding="utf-8") as f:
+                records = json.load(f)
+            partition = _Partition(self._dim)
+            # Read-only until the partition is first written to (see _Partition.append).
+            partition.vectors = np.load(os.path.join(self._path, entry["file"] + ".npy"), mmap_mode="r")
+            partition.alive = np.ones(len(records), dtype=bool)
+            partition.size = len(records)
+            for row, (id_, document, metadata) in enumerate(records):
+                partition.ids.append(id_)
+                partition.documents.append(document)
+                partition.metadatas.append(metadata)
+                self._rows[id_] = (key, row)
+            self._partitions[key] = partition
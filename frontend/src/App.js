@@ -62,6 +62,7 @@ export default function App() {
         alert('Could not reach the server to clear uploaded files. You will be logged out locally.');
       } finally {
         localStorage.removeItem('user_id');
+        sessionStorage.removeItem('session_token');
         // Keep the selected version persisted across reloads, do not clear it on logout
         setIsLoggedIn(false);
         setUserId(null);
@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useEffect, useRef, useState } from "react";
 import "./App.css";      // global styles
 import "./AppPro.css";   // Pro-specific overrides
 
@@ -8,6 +8,12 @@ export default function ChatWindowPro(props) {
   const messages = activeChat ? activeChat.messages : [];
   const [file, setFile] = useState(null);
   const [fileName, setFileName] = useState("");
+  // Progress of the last upload's ingestion job, while it is being processed.
+  const [uploadStatus, setUploadStatus] = useState("");
+  const [processing, setProcessing] = useState(false);
+  const unmounted = useRef(false);
+
+  useEffect(() => () => { unmounted.current = true; }, []);
 
   const handleFileChange = (e) => {
     const selectedFile = e.target.files[0];
@@ -30,15 +36,56 @@ export default function ChatWindowPro(props) {
     });
 
     const data = await response.json();
-    if (response.ok) {
-      alert("File uploaded successfully.");
-    } else {
+    if (!response.ok) {
       alert(data.detail);
+      return;
+    }
+    // The upload is only queued; its chunks are searchable once the job completes.
+    setProcessing(true);
+    setUploadStatus("Queued");
+    try {
+      const job = await waitForJob(data.job_id);
+      if (!job) return;
+      if (job.status === "completed") {
+        const failed = job.failures ? ` ${job.failures} chunks failed: ${job.error}` : "";
+        alert(`File processed: ${job.chunks_total} chunks.${failed}`);
+      } else if (job.status === "failed") {
+        alert(`Processing ${job.filename} failed: ${job.error}`);
+      } else {
+        alert(`Processing ${job.filename} was cancelled.`);
+      }
+    } catch (err) {
+      console.error("Polling the upload job failed", err);
+      alert("Lost track of the upload while it was being processed; it may still finish.");
+    } finally {
+      if (!unmounted.current) {
+        setProcessing(false);
+        setUploadStatus("");
+      }
+    }
+  };
+
+  // Poll /jobs/{job_id} until the job finishes; returns its final status, or null if the window closed.
+  const waitForJob = async (jobId) => {
+    while (!unmounted.current) {
+      const response = await fetch(`http://localhost:8000/jobs/${jobId}?user_id=${userId}`);
+      const job = await response.json();
+      if (!response.ok) throw new Error(job.detail);
+      if (["completed", "failed", "cancelled"].includes(job.status)) return job;
+      if (job.status === "running") {
+        const pages = job.pages_total ? `${job.pages_parsed}/${job.pages_total} pages, ` : "";
+        const eta = job.eta_seconds != null ? `, ~${Math.ceil(job.eta_seconds)}s left` : "";
+        setUploadStatus(`Processing: ${pages}${job.chunks_embedded + job.chunks_reused} chunks${eta}`);
+      } else {
+        setUploadStatus(job.status === "cancelling" ? "Cancelling" : "Queued");
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000));
     }
+    return null;
   };
 
   const handleSendMessage = async () => {
-    if (!input.trim()) return;
+    if (!input.trim() || processing) return;
     sendMessage(input);
     const response = await fetch("http://localhost:8000/query/", {
       method: "POST",
@@ -108,13 +155,14 @@ export default function ChatWindowPro(props) {
           <input id="pro-file-input" type="file" onChange={handleFileChange} style={{ display: 'none' }} />
           <label htmlFor="pro-file-input" className="file-button">Choose</label>
           <div className="file-name" title={fileName}>{fileName ? (fileName.length > 40 ? fileName.slice(0, 37) + '...' : fileName) : 'No file'}</div>
+          {uploadStatus && <div className="upload-status">{uploadStatus}</div>}
         </div>
 
         
 
         <div className="actions">
-          <button className="upload-button" onClick={handleFileUpload}>Upload</button>
-          <button className="chat-pro-send" onClick={() => handleSendMessage()}>Send</button>
+          <button className="upload-button" onClick={handleFileUpload} disabled={processing}>Upload</button>
+          <button className="chat-pro-send" onClick={() => handleSendMessage()} disabled={processing} title={processing ? "Wait for the upload to be processed" : undefined}>Send</button>
         </div>
       </div>
     </div>
@@ -30,6 +30,9 @@ const Login = ({ onLogin }) => {
             if (isLogin) {
                 alert('Login successful');
                 localStorage.setItem('user_id', data.user_id);
+                if (data.access_token) {
+                    sessionStorage.setItem('session_token', data.access_token);
+                }
                 if (rememberMe) {
                     localStorage.setItem('rememberedUsername', username);
                 } else {